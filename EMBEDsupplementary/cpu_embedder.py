@@ -0,0 +1,123 @@
+import argparse
+import h5py
+
+from fasta_io import read_fasta
+
+# In-process per-protein embedder (alternative to the bio_embeddings CLI), meant for CPU-only nodes.
+# Loads a ProtT5 encoder through transformers once, sorts the sequences by length, packs them into batches whose
+# padded size (longest sequence x batch size) stays below --max-tokens and writes the mean-pooled vector of every
+# protein straight into the output H5 under its FASTA header. When the input is the "missing" FASTA written by
+# embedding_cache.py the headers are the sequence hashes, so the vectors land directly in the embedding cache and
+# neither the ingest step nor the 'original_id' renaming of h5_correction.py is needed.
+# --model accepts a Hugging Face model name or a local directory, e.g. a tiny T5 encoder for testing: the tokenizer needs
+# a sentencepiece model (spiece.model) next to the weights, benchmarks/check_cpu_embedder.py builds such a stand-in.
+# Must be run with the Python of the environment that has torch and transformers (env_bio_embedding).
+# embedding_worker.py keeps the same model resident between runs.
+
+DEFAULT_MODEL = "Rostlab/prot_t5_xl_uniref50"
+
+
+def length_batches(records: list, max_tokens: int, max_batch_size: int):
+    """Yields lists of records of similar length; padded batch size (longest x count) stays within max_tokens."""
+    batch = []
+    for record in sorted(records, key=lambda r: len(r[1])):
+        # sorted ascending, so the current record is the longest one in the batch
+        if batch and (len(record[1]) * (len(batch) + 1) > max_tokens or len(batch) >= max_batch_size):
+            yield batch
+            batch = []
+        batch.append(record)
+    if batch:
+        yield batch
+
+
+def prepare_sequence(sequence: str) -> str:
+    # ProtT5 vocabulary: rare amino acids map to X, residues are separated by spaces
+    sequence = sequence.upper()
+    for rare in "UZOB":
+        sequence = sequence.replace(rare, "X")
+    return " ".join(sequence)
+
+
+def load_model(model_name: str, device: str, threads: int):
+    import torch
+    from transformers import T5EncoderModel, T5Tokenizer
+
+    if threads > 0:
+        torch.set_num_threads(threads)
+    tokenizer = T5Tokenizer.from_pretrained(model_name, do_lower_case=False)
+    model = T5EncoderModel.from_pretrained(model_name).to(device)
+    if device == "cpu":
+        model = model.float()   # half precision weights are slow or unsupported on CPU
+    model.eval()
+    return tokenizer, model
+
+
+def embed_batch(tokenizer, model, device: str, batch: list):
+    """Returns one mean-pooled vector per record (float32 NumPy arrays)."""
+    import torch
+
+    encoded = tokenizer([prepare_sequence(seq) for _, seq in batch], add_special_tokens=True,
+                        padding="longest", return_tensors="pt")
+    input_ids = encoded["input_ids"].to(device)
+    attention_mask = encoded["attention_mask"].to(device)
+    with torch.no_grad():
+        hidden = model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+
+    vectors = []
+    for i, (_, seq) in enumerate(batch):
+        # only the residues, the trailing </s> token is not part of the protein
+        vectors.append(hidden[i, :len(seq)].mean(dim=0).float().cpu().numpy())
+    return vectors
+
+
+def embed_records(tokenizer, model, device: str, records: list, output_file: str, max_tokens: int,
+                  max_batch_size: int) -> int:
+    """Embeds the records with an already loaded model into output_file, skipping headers that are already in it."""
+    done = 0
+    embedded = 0
+    with h5py.File(output_file, "a") as out:
+        for batch in length_batches(records, max_tokens, max_batch_size):
+            todo = [r for r in batch if r[0] not in out]
+            if todo:
+                for (header, _), vector in zip(todo, embed_batch(tokenizer, model, device, todo)):
+                    out.create_dataset(header, data=vector)
+                embedded += len(todo)
+            done += len(batch)
+            print(f"{done * 100 // len(records)}% ({done}/{len(records)} sequences embedded)", flush=True)
+    return embedded
+
+
+def embed_fasta(fasta_file: str, output_file: str, model_name: str, device: str, threads: int,
+                max_tokens: int, max_batch_size: int):
+    records = list(read_fasta(fasta_file))
+    if not records:
+        print("No sequences to embed.")
+        return
+
+    tokenizer, model = load_model(model_name, device, threads)
+    embed_records(tokenizer, model, device, records, output_file, max_tokens, max_batch_size)
+    print(f"Embeddings of {len(records)} sequences written to '{output_file}'.")
+
+
+def main():
+    # --- Argument Parsing ---
+    parser = argparse.ArgumentParser(
+        description="Embed a FASTA file with a ProtT5 encoder in-process (length-bucketed batches, mean pooling)."
+    )
+
+    parser.add_argument("-i", "--input-file", help="FASTA file to embed.", required=True)
+    parser.add_argument("-o", "--output-file", help="Output H5 (datasets named by FASTA header, appended to).", required=True)
+    parser.add_argument("-m", "--model", default=DEFAULT_MODEL, help=f"Model name or local path (default: {DEFAULT_MODEL}).")
+    parser.add_argument("--device", default="cpu", help="torch device (default: cpu).")
+    parser.add_argument("--threads", type=int, default=0, help="CPU threads for torch (default: torch's choice).")
+    parser.add_argument("--max-tokens", type=int, default=4000, help="Padded residues per batch (default: 4000).")
+    parser.add_argument("--max-batch-size", type=int, default=64, help="Upper bound on sequences per batch (default: 64).")
+
+    args = parser.parse_args()
+
+    embed_fasta(args.input_file, args.output_file, args.model, args.device, args.threads,
+                args.max_tokens, args.max_batch_size)
+
+
+if __name__ == "__main__":
+    main()
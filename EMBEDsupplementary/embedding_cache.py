@@ -0,0 +1,94 @@
+import argparse
+import hashlib
+import h5py
+
+from fasta_io import read_fasta   # yields (full header, sequence), the header is bio_embeddings' 'original_id'
+
+# Persistent, content-addressed store for per-protein embeddings.
+# Every sequence is keyed by the sha256 of its (upper-cased, whitespace free) residues, so the UniProt base dataset is
+# embedded once and reused by every later run, no matter which organism hits were appended to it.
+# The store is one HDF5 file per embedding protocol: <cache_dir>/<protocol>.h5, dataset name = sequence hash.
+# Actions:
+#   missing  -i <merged fasta> -c <store> -o <fasta>   writes only the sequences that are not in the store yet,
+#                                                       with the sequence hash as header (-> bio_embeddings 'original_id')
+#   ingest   -i <bio_embeddings h5> -c <store>          adds freshly embedded vectors to the store
+#   assemble -i <merged fasta> -c <store> -o <h5>       writes the final file, one dataset per protein ID
+
+
+def sequence_hash(sequence: str) -> str:
+    return hashlib.sha256("".join(sequence.split()).upper().encode("ascii")).hexdigest()
+
+
+def write_missing(fasta_file: str, cache_file: str, output_fasta: str) -> int:
+    written = set()
+    total = 0
+    with h5py.File(cache_file, "a") as cache, open(output_fasta, "w") as out:
+        for _, sequence in read_fasta(fasta_file):
+            total += 1
+            key = sequence_hash(sequence)
+            if key in cache or key in written:
+                continue
+            written.add(key)
+            out.write(f">{key}\n{sequence}\n")
+
+    print(f"{total - len(written)} of {total} sequences found in the embedding cache, {len(written)} left to embed.")
+    return len(written)
+
+
+def ingest(embedding_file: str, cache_file: str):
+    added = 0
+    with h5py.File(embedding_file, "r") as infile, h5py.File(cache_file, "a") as cache:
+        for dataset_name in infile.keys():
+            key = infile[dataset_name].attrs.get("original_id", dataset_name)
+            if isinstance(key, bytes):
+                key = key.decode("utf-8")
+            key = str(key).strip()
+            if key in cache:
+                continue
+            cache.create_dataset(key, data=infile[dataset_name][()])
+            added += 1
+
+    print(f"Added {added} new embeddings to the cache '{cache_file}'.")
+
+
+def assemble(fasta_file: str, cache_file: str, output_file: str):
+    with h5py.File(cache_file, "r") as cache, h5py.File(output_file, "w") as outfile:
+        for protein_id, sequence in read_fasta(fasta_file):
+            if protein_id in outfile:
+                print(f"Duplicate protein ID '{protein_id}', keeping the first occurrence.")
+                continue
+            key = sequence_hash(sequence)
+            if key not in cache:
+                raise KeyError(f"No cached embedding for '{protein_id}' (sequence hash {key}).")
+            outfile.create_dataset(protein_id, data=cache[key][()])
+            outfile[protein_id].attrs["original_id"] = protein_id
+
+    print(f"Embeddings assembled from the cache and saved to '{output_file}'.")
+
+
+def main():
+    # --- Argument Parsing ---
+    parser = argparse.ArgumentParser(
+        description="Content-addressed embedding cache: find missing sequences, ingest new embeddings, assemble the final H5."
+    )
+
+    parser.add_argument("action", choices=["missing", "ingest", "assemble"], help="Cache action to perform.")
+    parser.add_argument("-i", "--input-file", help="Merged FASTA (missing/assemble) or bio_embeddings H5 (ingest).", required=True)
+    parser.add_argument("-c", "--cache-file", help="Path to the embedding store (.h5).", required=True)
+    parser.add_argument("-o", "--output-file", help="Output FASTA (missing) or output H5 (assemble).")
+
+    args = parser.parse_args()
+
+    if args.action != "ingest" and not args.output_file:
+        parser.error(f"-o/--output-file is required for '{args.action}'.")
+
+    if args.action == "missing":
+        write_missing(args.input_file, args.cache_file, args.output_file)
+    elif args.action == "ingest":
+        ingest(args.input_file, args.cache_file)
+    else:
+        assemble(args.input_file, args.cache_file, args.output_file)
+
+
+if __name__ == "__main__":
+    main()
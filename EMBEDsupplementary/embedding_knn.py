@@ -0,0 +1,189 @@
+import argparse
+import h5py
+import numpy as np
+
+from embedding_matrix import load_embedding_matrix
+from extract_hits_and_append import parse_protein_id
+from fasta_io import read_fasta
+
+# Nearest base-dataset neighbours of every hit protein, by cosine similarity of the per-protein embeddings.
+# Hits are the proteins whose ID is in the hit ID file, every other protein in the embedding file is a base protein.
+# The search is a blocked matrix multiply: a block of normalised hit vectors is multiplied against one block of
+# normalised base vectors at a time; the top-k of every similarity block is partitioned out first and only those k
+# candidates are merged into the running top-k, so the peak is (hit block + base block read twice + similarity block +
+# its partition indices). Block sizes are derived from --memory-mb; the embedding file is read block by block as well
+# (per-protein H5, or the contiguous .npy/.h5 matrix written by embedding_matrix.py).
+# Output (tab separated, one row per hit and neighbour, ordered by similarity):
+#   hit_id, rank, neighbour_id, cosine_similarity, entry_name, protein_name, organism, gene
+# The annotation columns come from the UniProt headers of the original base dataset (-b), empty if not given.
+
+HIT_BLOCK_ROWS = 1024
+COLUMNS = ["hit_id", "rank", "neighbour_id", "cosine_similarity", "entry_name", "protein_name", "organism", "gene"]
+
+
+class EmbeddingRows:
+    """Row access to an embedding file without loading it completely."""
+
+    def __init__(self, path: str):
+        self.h5 = None
+        self.matrix = None
+        if path.endswith(".npy"):
+            self.ids, self.matrix = load_embedding_matrix(path)   # memory map
+            self.dim = self.matrix.shape[1]
+            return
+        self.h5 = h5py.File(path, "r")
+        if isinstance(self.h5.get("embeddings"), h5py.Dataset) and isinstance(self.h5.get("ids"), h5py.Dataset):
+            self.matrix = self.h5["embeddings"]
+            self.ids = [i.decode("utf-8") if isinstance(i, bytes) else str(i) for i in self.h5["ids"][()]]
+            self.dim = self.matrix.shape[1]
+        else:
+            self.ids = list(self.h5.keys())
+            if not self.ids:
+                raise ValueError(f"No embeddings found in '{path}'.")
+            if len(self.h5[self.ids[0]].shape) != 1:
+                raise ValueError("k-NN needs one vector per protein, per-residue embeddings are not supported.")
+            self.dim = self.h5[self.ids[0]].shape[0]
+
+    def rows(self, indices) -> np.ndarray:
+        """Returns the L2-normalised float32 vectors of the given (ascending) row indices."""
+        if self.matrix is not None:
+            block = np.asarray(self.matrix[np.asarray(indices)], dtype=np.float32)
+        else:
+            block = np.stack([self.h5[self.ids[i]][()] for i in indices]).astype(np.float32, copy=False)
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        block /= np.maximum(norms, 1e-12)   # in place, no second copy of the block
+        return block
+
+    def close(self):
+        if self.h5 is not None:
+            self.h5.close()
+
+
+def parse_uniprot_header(header: str) -> dict:
+    """">sp|P01112|RASH_HUMAN GTPase HRas OS=Homo sapiens OX=9606 GN=HRAS PE=1 SV=1" -> its annotation fields."""
+    header = header.lstrip(">").strip()
+    first, _, description = header.partition(" ")
+    parts = first.split("|")
+    entry_name = parts[2] if len(parts) > 2 else ""
+
+    fields = {}
+    protein_name = description
+    keys = [(description.find(f" {k}="), k) for k in ("OS", "OX", "GN", "PE", "SV")]
+    keys = sorted((pos, k) for pos, k in keys if pos >= 0)
+    if keys:
+        protein_name = description[:keys[0][0]]
+    for n, (pos, k) in enumerate(keys):
+        end = keys[n + 1][0] if n + 1 < len(keys) else len(description)
+        fields[k] = description[pos + len(k) + 2:end].strip()
+
+    return {"entry_name": entry_name, "protein_name": protein_name.strip(),
+            "organism": fields.get("OS", ""), "gene": fields.get("GN", "")}
+
+
+def load_annotations(base_fasta: str) -> dict:
+    annotations = {}
+    # read_fasta, so a gzipped base dataset works here as everywhere else
+    for header, _ in read_fasta(base_fasta):
+        annotations[parse_protein_id(header)] = parse_uniprot_header(header)
+    return annotations
+
+
+def block_sizes(dim: int, k: int, memory_mb: int) -> tuple:
+    """Hit and base block rows so that all buffers of one block step fit in memory_mb."""
+    budget = memory_mb * 1024 * 1024 // 4   # float32 values (int64 indices count twice)
+    # per hit row: its vector (read and normalised, two copies) and the running and candidate top-k (sims + indices)
+    per_hit = 2 * dim + 12 * k
+    hit_rows = HIT_BLOCK_ROWS
+    while hit_rows > 1 and hit_rows * per_hit > budget // 2:
+        hit_rows //= 2
+    # per base row: its vector (two copies while it is read) and per hit row the similarity plus the int64 index of
+    # argpartition, with one value of headroom for NumPy temporaries
+    base_rows = max(1, (budget - hit_rows * per_hit) // (2 * dim + 4 * hit_rows))
+    return hit_rows, base_rows
+
+
+def knn_search(embeddings: EmbeddingRows, hit_rows: list, base_rows: list, k: int, memory_mb: int):
+    """Yields (hit row, [(base row, similarity), ...]) with the neighbours sorted by similarity."""
+    k = min(k, len(base_rows))
+    hit_block_rows, base_block_rows = block_sizes(embeddings.dim, k, memory_mb)
+    base_rows = np.asarray(base_rows)
+
+    for h in range(0, len(hit_rows), hit_block_rows):
+        hit_block = hit_rows[h:h + hit_block_rows]
+        queries = embeddings.rows(hit_block)
+        best_sims = np.full((len(hit_block), k), -np.inf, dtype=np.float32)
+        best_idx = np.zeros((len(hit_block), k), dtype=np.int64)
+
+        for b in range(0, len(base_rows), base_block_rows):
+            block_idx = base_rows[b:b + base_block_rows]
+            sims = queries @ embeddings.rows(block_idx).T
+            # top-k of the block first, then only those k candidates are merged into the running top-k
+            block_k = min(k, sims.shape[1])
+            top = np.argpartition(sims, sims.shape[1] - block_k, axis=1)[:, -block_k:]
+            cand_sims = np.concatenate([best_sims, np.take_along_axis(sims, top, axis=1)], axis=1)
+            cand_idx = np.concatenate([best_idx, block_idx[top]], axis=1)
+            del sims, top
+            top = np.argpartition(cand_sims, cand_sims.shape[1] - k, axis=1)[:, -k:]
+            best_sims = np.take_along_axis(cand_sims, top, axis=1)
+            best_idx = np.take_along_axis(cand_idx, top, axis=1)
+
+        order = np.argsort(-best_sims, axis=1, kind="stable")
+        best_sims = np.take_along_axis(best_sims, order, axis=1)
+        best_idx = np.take_along_axis(best_idx, order, axis=1)
+        for row, hit in enumerate(hit_block):
+            yield hit, list(zip(best_idx[row].tolist(), best_sims[row].tolist()))
+
+
+def hit_neighbours(embedding_file: str, hit_id_file: str, output_file: str, k: int = 10, memory_mb: int = 1024,
+                   base_fasta: str = None):
+    with open(hit_id_file, "r") as f:
+        hit_ids = {parse_protein_id(line) for line in f if line.strip()}
+    annotations = load_annotations(base_fasta) if base_fasta else {}
+
+    embeddings = EmbeddingRows(embedding_file)
+    try:
+        hit_rows, base_rows = [], []
+        for row, protein_id in enumerate(embeddings.ids):
+            (hit_rows if parse_protein_id(protein_id) in hit_ids else base_rows).append(row)
+        print(f"{len(hit_rows)} hits and {len(base_rows)} base proteins in '{embedding_file}'.")
+        if not hit_rows or not base_rows:
+            raise ValueError("Need at least one hit and one base protein for the neighbour search.")
+
+        empty = {"entry_name": "", "protein_name": "", "organism": "", "gene": ""}
+        with open(output_file, "w") as out:
+            out.write("\t".join(COLUMNS) + "\n")
+            for hit, neighbours in knn_search(embeddings, hit_rows, base_rows, k, memory_mb):
+                hit_id = embeddings.ids[hit]
+                for rank, (base, similarity) in enumerate(neighbours, start=1):
+                    neighbour_id = embeddings.ids[base]
+                    note = annotations.get(parse_protein_id(neighbour_id), empty)
+                    out.write(f"{hit_id}\t{rank}\t{neighbour_id}\t{similarity:.4f}\t{note['entry_name']}\t"
+                              f"{note['protein_name']}\t{note['organism']}\t{note['gene']}\n")
+    finally:
+        embeddings.close()
+
+    print(f"Top {min(k, len(base_rows))} base neighbours of {len(hit_rows)} hits written to '{output_file}'.")
+
+
+def main():
+    # --- Argument Parsing ---
+    parser = argparse.ArgumentParser(
+        description="Find the nearest base-dataset proteins of every hit by cosine similarity of their embeddings."
+    )
+
+    parser.add_argument("-e", "--embeddings", help="Per-protein H5 or embedding matrix (.npy/.h5).", required=True)
+    parser.add_argument("-i", "--hit-ids", help="Hit ID list (one UniProt ID or MMseqs target name per line).", required=True)
+    parser.add_argument("-o", "--output-file", help="Output TSV.", required=True)
+    parser.add_argument("-b", "--base-dataset", help="Original base dataset FASTA (UniProt headers) for the annotations.")
+    parser.add_argument("-k", "--neighbours", type=int, default=10, help="Neighbours per hit (default: 10).")
+    parser.add_argument("--memory-mb", type=int, default=1024, help="Memory ceiling for the search blocks (default: 1024).")
+
+    args = parser.parse_args()
+
+    if args.neighbours < 1:
+        parser.error("--neighbours must be at least 1.")
+    hit_neighbours(args.embeddings, args.hit_ids, args.output_file, args.neighbours, args.memory_mb, args.base_dataset)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import argparse
+import h5py
+import numpy as np
+
+# Contiguous embedding matrix format as an alternative to one HDF5 dataset per protein.
+#   npy: <output>.npy   float32 matrix (proteins x dimensions), loaded with np.load(mmap_mode="r") -> zero-copy mmap
+#        <output>.ids.tsv   row index -> protein ID (row<TAB>id)
+#   h5:  <output>.h5    dataset "embeddings" (proteins x dimensions, float32, chunked by rows) + dataset "ids"
+# Rows are in the order of the per-protein input file. load_embedding_matrix() returns (ids, matrix) for both formats.
+
+
+def ids_path_for(npy_path: str) -> str:
+    return npy_path[:-len(".npy")] + ".ids.tsv" if npy_path.endswith(".npy") else npy_path + ".ids.tsv"
+
+
+def convert(per_protein_h5: str, output_file: str, fmt: str, chunk_rows: int = 4096):
+    with h5py.File(per_protein_h5, "r") as infile:
+        ids = list(infile.keys())
+        if not ids:
+            raise ValueError(f"No embeddings found in '{per_protein_h5}'.")
+        if len(infile[ids[0]].shape) != 1:
+            raise ValueError("The matrix format holds one vector per protein, per-residue embeddings are not supported.")
+        dim = infile[ids[0]].shape[0]
+
+        if fmt == "npy":
+            matrix = np.lib.format.open_memmap(output_file, mode="w+", dtype=np.float32, shape=(len(ids), dim))
+            for row, protein_id in enumerate(ids):
+                matrix[row] = infile[protein_id][()]
+            matrix.flush()
+            del matrix
+            with open(ids_path_for(output_file), "w") as out:
+                for row, protein_id in enumerate(ids):
+                    out.write(f"{row}\t{protein_id}\n")
+        else:
+            with h5py.File(output_file, "w") as outfile:
+                matrix = outfile.create_dataset("embeddings", shape=(len(ids), dim), dtype=np.float32,
+                                                chunks=(min(len(ids), chunk_rows), dim))
+                # fill through a row buffer so every chunk is written once
+                for start in range(0, len(ids), chunk_rows):
+                    block = ids[start:start + chunk_rows]
+                    matrix[start:start + len(block)] = np.stack([infile[p][()] for p in block]).astype(np.float32)
+                outfile.create_dataset("ids", data=np.array(ids, dtype=object), dtype=h5py.string_dtype())
+
+    print(f"{len(ids)} embeddings ({dim} dimensions) written as one {fmt} matrix to '{output_file}'.")
+
+
+def load_embedding_matrix(path: str):
+    """Returns (ids, matrix). For .npy the matrix is a read-only memory map, for .h5 it is read in one go."""
+    if path.endswith(".npy"):
+        matrix = np.load(path, mmap_mode="r")
+        with open(ids_path_for(path), "r") as f:
+            ids = [line.rstrip("\n").split("\t", 1)[1] for line in f]
+        return ids, matrix
+    with h5py.File(path, "r") as h5:
+        ids = [i.decode("utf-8") if isinstance(i, bytes) else str(i) for i in h5["ids"][()]]
+        return ids, h5["embeddings"][()]
+
+
+def main():
+    # --- Argument Parsing ---
+    parser = argparse.ArgumentParser(
+        description="Convert a per-protein embedding H5 into one contiguous matrix plus an ID index."
+    )
+
+    parser.add_argument("-i", "--input-file", help="Per-protein H5 (e.g. reduced_embeddings_with_ids.h5).", required=True)
+    parser.add_argument("-o", "--output-file", help="Output matrix file (.npy or .h5).", required=True)
+    parser.add_argument("-f", "--format", choices=["npy", "h5"], help="Output format (default: from the file suffix).")
+
+    args = parser.parse_args()
+
+    fmt = args.format or ("npy" if args.output_file.endswith(".npy") else "h5")
+    convert(args.input_file, args.output_file, fmt)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+
+# Long-lived embedding worker: loads the ProtT5 encoder once and keeps it resident, so repeated (small) runs do not
+# pay for loading the multi-GB weights again. Jobs arrive over a local Unix socket (multiprocessing.connection,
+# one JSON request and one JSON reply per connection) and are processed one after the other.
+# Actions:
+#   serve   -a <socket> -m <model> --device --threads --idle-minutes
+#           runs the worker (with the Python of env_bio_embedding); it exits after --idle-minutes without a job
+#   submit  -a <socket> -i <fasta> -o <h5> [--python <env python> -m <model> --device --threads --log <file>]
+#           sends one embedding job and waits for it; if no worker answers on the socket and --python is given, a
+#           worker is started in the background first (its output goes to --log). Needs only the standard library.
+#   stop    -a <socket>
+# The job writes the vectors into the output H5 under the FASTA headers, exactly like cpu_embedder.py, so the
+# "missing" FASTA of embedding_cache.py lands directly in the embedding cache.
+# Model, device and threads are fixed per worker; a submit with other settings gets an error instead of the wrong
+# vectors (stop the worker to switch models). Only one worker serves an address: serve exits if one already answers.
+
+STARTUP_TIMEOUT_SECONDS = 1800   # loading the model from a cold disk can take minutes
+POLL_SECONDS = 2
+
+
+def request(address: str, message: dict, timeout: float = None) -> dict:
+    with Client(address, family="AF_UNIX") as conn:
+        conn.send_bytes(json.dumps(message).encode("utf-8"))
+        if timeout is not None and not conn.poll(timeout):
+            raise TimeoutError(f"No reply from the embedding worker at {address}")
+        return json.loads(conn.recv_bytes().decode("utf-8"))
+
+
+def ping(address: str):
+    """Returns the worker's settings, or None if no worker is listening."""
+    try:
+        return request(address, {"action": "ping"}, timeout=10)
+    except (FileNotFoundError, ConnectionRefusedError, ConnectionResetError, EOFError, TimeoutError):
+        return None
+
+
+def serve(address: str, model_name: str, device: str, threads: int, idle_minutes: float):
+    from cpu_embedder import embed_records, load_model
+    from fasta_io import read_fasta
+
+    running = ping(address)
+    if running is not None:
+        # a second worker would orphan the first one, both holding the model
+        print(f"Embedding worker {running['pid']} already listens on {address}.", flush=True)
+        sys.exit(1)
+
+    settings = {"model": model_name, "device": device, "threads": threads, "pid": os.getpid()}
+    print(f"Loading {model_name} on {device}...", flush=True)
+    start = time.perf_counter()
+    tokenizer, model = load_model(model_name, device, threads)
+    print(f"Model loaded in {time.perf_counter() - start:.1f}s, listening on {address}", flush=True)
+
+    if os.path.exists(address):
+        if ping(address) is not None:
+            print(f"Another embedding worker started on {address} meanwhile, exiting.", flush=True)
+            sys.exit(1)
+        os.unlink(address)   # stale socket of a worker that did not shut down cleanly
+    listener = Listener(address, family="AF_UNIX")
+    os.chmod(address, 0o600)
+    state = {"last_job": time.monotonic(), "busy": False}
+    lock = threading.Lock()
+
+    def watchdog():
+        while True:
+            time.sleep(30)
+            with lock:
+                if not state["busy"] and time.monotonic() - state["last_job"] > idle_minutes * 60:
+                    print(f"Idle for {idle_minutes} minutes, shutting down.", flush=True)
+                    listener.close()
+                    os._exit(0)
+
+    if idle_minutes > 0:
+        threading.Thread(target=watchdog, daemon=True).start()
+
+    while True:
+        conn = listener.accept()
+        # busy from the moment a client is connected, so the idle watchdog cannot exit under a job being sent
+        with lock:
+            state["busy"] = True
+        try:
+            message = json.loads(conn.recv_bytes().decode("utf-8"))
+            action = message.get("action")
+            if action == "ping":
+                conn.send_bytes(json.dumps({"status": "ok", **settings}).encode("utf-8"))
+                continue
+            if action == "stop":
+                conn.send_bytes(json.dumps({"status": "ok"}).encode("utf-8"))
+                break
+            if action != "embed":
+                conn.send_bytes(json.dumps({"status": "error", "error": f"unknown action '{action}'"}).encode("utf-8"))
+                continue
+
+            try:
+                mismatch = [k for k in ("model", "device", "threads") if message.get(k) not in (None, settings[k])]
+                if mismatch:
+                    raise ValueError(f"worker runs {settings['model']} on {settings['device']} with "
+                                     f"{settings['threads']} threads, the job asks for another {' and '.join(mismatch)}")
+                start = time.perf_counter()
+                records = list(read_fasta(message["input"]))
+                print(f"Job: {len(records)} sequences from {message['input']}", flush=True)
+                embedded = embed_records(tokenizer, model, device, records, message["output"],
+                                         int(message.get("max_tokens", 4000)), int(message.get("max_batch_size", 64)))
+                reply = {"status": "ok", "sequences": len(records), "embedded": embedded,
+                         "seconds": round(time.perf_counter() - start, 2)}
+            except Exception as e:   # a failed job must not take the resident model down
+                reply = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+            print(f"Job finished: {reply}", flush=True)
+            conn.send_bytes(json.dumps(reply).encode("utf-8"))
+        except (EOFError, ConnectionError) as e:   # client went away, keep serving
+            print(f"Connection lost: {type(e).__name__}", flush=True)
+        finally:
+            conn.close()
+            with lock:
+                state["busy"] = False
+                state["last_job"] = time.monotonic()
+
+    listener.close()
+    print("Embedding worker stopped.", flush=True)
+
+
+def start_worker(args) -> dict:
+    """Starts a detached worker with the environment's Python and waits until it answers."""
+    log_path = args.log or str(Path(args.address).with_suffix(".log"))
+    cmd = [args.python, str(Path(__file__).resolve()), "serve", "-a", args.address, "-m", args.model,
+           "--device", args.device, "--threads", str(args.threads), "--idle-minutes", str(args.idle_minutes)]
+    print(f"Starting embedding worker (log: {log_path})")
+    with open(log_path, "a") as log:
+        process = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                   start_new_session=True)
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Embedding worker exited with code {process.returncode}, see {log_path}")
+        settings = ping(args.address)
+        if settings is not None:
+            return settings
+        time.sleep(POLL_SECONDS)
+    raise RuntimeError(f"Embedding worker did not come up within {STARTUP_TIMEOUT_SECONDS}s, see {log_path}")
+
+
+def submit(args) -> int:
+    settings = ping(args.address)
+    if settings is None:
+        if not args.python:
+            print(f"No embedding worker listening on {args.address}.")
+            return 1
+        settings = start_worker(args)
+    print(f"Using embedding worker {settings['pid']} ({settings['model']} on {settings['device']})")
+
+    try:
+        reply = request(args.address, {
+            "action": "embed",
+            "input": str(Path(args.input_file).resolve()),
+            "output": str(Path(args.output_file).resolve()),
+            "model": args.model if args.python else None,
+            "device": args.device if args.python else None,
+            "threads": args.threads if args.python else None,
+            "max_tokens": args.max_tokens,
+            "max_batch_size": args.max_batch_size,
+        })
+    except (EOFError, ConnectionError, FileNotFoundError) as e:
+        # the worker went down under the job (idle shutdown, crash, stop)
+        print(f"Embedding job failed: lost the connection to the worker ({type(e).__name__}).")
+        return 1
+    if reply["status"] != "ok":
+        print(f"Embedding job failed: {reply['error']}")
+        return 1
+    print(f"{reply['embedded']} of {reply['sequences']} sequences embedded by the worker in {reply['seconds']}s.")
+    return 0
+
+
+def main():
+    # --- Argument Parsing ---
+    parser = argparse.ArgumentParser(description="Resident ProtT5 embedding worker and its client.")
+    parser.add_argument("action", choices=["serve", "submit", "stop"])
+    parser.add_argument("-a", "--address", required=True, help="Unix socket path of the worker.")
+    parser.add_argument("-i", "--input-file", help="FASTA file to embed (submit).")
+    parser.add_argument("-o", "--output-file", help="Output H5, appended to (submit).")
+    parser.add_argument("--python", help="Python of the embedding environment, starts a worker if none runs (submit).")
+    parser.add_argument("-m", "--model", default="Rostlab/prot_t5_xl_uniref50", help="Model name or local path.")
+    parser.add_argument("--device", default="cpu", help="torch device (default: cpu).")
+    parser.add_argument("--threads", type=int, default=0, help="CPU threads for torch (default: torch's choice).")
+    parser.add_argument("--max-tokens", type=int, default=4000, help="Padded residues per batch (default: 4000).")
+    parser.add_argument("--max-batch-size", type=int, default=64, help="Upper bound on sequences per batch (default: 64).")
+    parser.add_argument("--idle-minutes", type=float, default=60, help="Worker exits after this idle time (0: never).")
+    parser.add_argument("--log", help="Log file of a worker started by submit (default: <socket>.log).")
+
+    args = parser.parse_args()
+
+    if args.action == "serve":
+        serve(args.address, args.model, args.device, args.threads, args.idle_minutes)
+    elif args.action == "stop":
+        if ping(args.address) is None:
+            print(f"No embedding worker listening on {args.address}.")
+        else:
+            request(args.address, {"action": "stop"})
+            print("Embedding worker stopped.")
+    else:
+        if not args.input_file or not args.output_file:
+            parser.error("submit needs -i and -o.")
+        sys.exit(submit(args))
+
+
+if __name__ == "__main__":
+    main()
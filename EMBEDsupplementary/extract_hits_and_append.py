@@ -1,60 +1,175 @@
-import argparse
-import shutil
-
-# --- Argument Parsing ---
-parser = argparse.ArgumentParser(
-    description="Extract sequences from a proteome by matching UniProt IDs and append them to an existing base dataset."
-)
-
-parser.add_argument("-i", "--id-file", help="UniProt ID list", required=True)
-parser.add_argument("-p", "--proteome-file", help="Proteome FASTA file", required=True)
-parser.add_argument("-b", "--base-dataset", help="Base dataset FASTA file", required=True)
-parser.add_argument("-o", "--output-file", help="Output merged FASTA file", required=True)
-
-args = parser.parse_args()
-
-id_file = args.id_file
-proteome_file = args.proteome_file
-base_dataset_file = args.base_dataset
-output_file = args.output_file
-
-# --- Step 1: Load all target UniProt IDs ---
-with open(id_file, "r") as f:
-    target_ids = {line.strip() for line in f if line.strip()}
-
-print(f"Loaded {len(target_ids)} target IDs.")
-
-# --- Step 2: Parse proteome and extract matches ---
-matches = []
-current_header = None
-current_seq = []
-
-with open(proteome_file, "r") as f:
-    for line in f:
-        if line.startswith(">"):
-            if current_header:
-                match = next((uid for uid in target_ids if uid in current_header), None)
-                if match:
-                    matches.append(current_header + "".join(current_seq))
-            current_header = line
-            current_seq = []
-        else:
-            current_seq.append(line)
-
-if current_header:
-    match = next((uid for uid in target_ids if uid in current_header), None)
-    if match:
-        matches.append(current_header + "".join(current_seq))
-
-print(f"Found {len(matches)} matching sequences in the proteome.")
-
-# --- Step 3: Copy base dataset to output file ---
-shutil.copyfile(base_dataset_file, output_file)
-print(f"Copied base dataset to '{output_file}'")
-
-# --- Step 4: Append matches to the copied file ---
-with open(output_file, "a") as out:
-    for entry in matches:
-        out.write(entry.strip()+"\n")
-
-print(f"Merged dataset written to '{output_file}'")
+import argparse
+import os
+import shutil
+
+from fasta_io import is_gzip, read_fasta_bytes, write_record
+from keep_protein_ids import clean_fasta
+
+# Extracts the hit proteins (by UniProt ID) from an organism proteome and appends them to the base dataset.
+# IDs are parsed exactly from each header (second '|' field, or the first word for plain headers) and looked up in a set.
+# An offset index is kept next to each proteome (<proteome>.hits.idx) so repeat runs seek straight to the
+# hit records instead of rescanning the whole proteome. The index is rebuilt when the proteome is newer than it or
+# not in the expected format. (Its own suffix: <proteome>.fai belongs to the 5-column faidx of samtools/pyfaidx.)
+# Index line format (tab separated): protein_id, byte offset of the header line, byte length of the full record
+# Compressed proteomes (.gz / bgzip) cannot be seeked into, their hits are picked out in one streaming pass instead.
+# --clean-base fuses the header cleaning of keep_protein_ids.py into this step: the raw base dataset is streamed into the
+# output with cleaned headers and the hits are appended, one pass and no intermediate cleaned copy.
+# Without -b only the hit records are written (batch mode of pipelineEMBEDDER.py merges them with the base itself).
+
+
+def parse_protein_id(header: str) -> str:
+    """Returns the UniProt ID of a FASTA header line (">sp|P01112|RASH_HUMAN ..." -> "P01112", ">P01112 ..." -> "P01112")."""
+    header = header.lstrip(">").strip()
+    if not header:
+        return ""
+    parts = header.split("|")
+    if len(parts) > 1:
+        return parts[1].strip()
+    return header.split()[0]
+
+
+def index_path_for(proteome_file: str) -> str:
+    return proteome_file + ".hits.idx"
+
+
+def build_fasta_index(proteome_file: str, index_file: str) -> dict:
+    """Scans the proteome once and writes the offset index. Returns {protein_id: (offset, length)}."""
+    index = {}
+    current_id = None
+    record_start = 0
+    offset = 0
+
+    with open(proteome_file, "rb") as f:
+        for line in f:
+            if line.startswith(b">"):
+                if current_id is not None:
+                    index.setdefault(current_id, (record_start, offset - record_start))
+                current_id = parse_protein_id(line.decode("utf-8", errors="replace"))
+                record_start = offset
+            offset += len(line)
+    if current_id is not None:
+        index.setdefault(current_id, (record_start, offset - record_start))
+
+    # write to a temporary file first so an interrupted run never leaves a truncated index behind
+    tmp_index_file = index_file + ".tmp"
+    with open(tmp_index_file, "w") as out:
+        for protein_id, (start, length) in index.items():
+            out.write(f"{protein_id}\t{start}\t{length}\n")
+    os.replace(tmp_index_file, index_file)
+    return index
+
+
+def load_fasta_index(index_file: str):
+    """Returns {protein_id: (offset, length)}, or None if the file is not an index of this script."""
+    index = {}
+    with open(index_file, "r") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) != 3 or not fields[1].isdigit() or not fields[2].isdigit():
+                return None
+            index[fields[0]] = (int(fields[1]), int(fields[2]))
+    return index
+
+
+def get_fasta_index(proteome_file: str) -> dict:
+    """Loads the proteome index, (re)building it if it is missing, older than the proteome or in another format."""
+    index_file = index_path_for(proteome_file)
+    if os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(proteome_file):
+        index = load_fasta_index(index_file)
+        if index is not None:
+            print(f"Using existing proteome index '{index_file}'")
+            return index
+        print(f"'{index_file}' is not a proteome index of this script, rebuilding it")
+    print(f"Building proteome index '{index_file}'")
+    return build_fasta_index(proteome_file, index_file)
+
+
+def load_target_ids(id_file: str) -> set:
+    """Loads the hit IDs; full MMseqs target names ("tr|A0A...|NAME") are reduced to the UniProt ID as well."""
+    with open(id_file, "r") as f:
+        return {parse_protein_id(line) for line in f if line.strip()}
+
+
+def write_base(base_dataset_file: str, out, clean_base: bool):
+    if clean_base:
+        clean_fasta(base_dataset_file, out)
+        print(f"Cleaned base dataset headers into '{out.name}'")
+        return
+    with open(base_dataset_file, "rb") as base:
+        shutil.copyfileobj(base, out)
+    # make sure the first appended header starts on its own line
+    if out.tell() > 0:
+        out.seek(-1, os.SEEK_END)
+        if out.read(1) != b"\n":
+            out.write(b"\n")
+    print(f"Copied base dataset to '{out.name}'")
+
+
+def append_indexed_hits(target_ids: set, proteome_file: str, out) -> int:
+    # --- Look the IDs up in the proteome index and stream the hit records straight into the output ---
+    index = get_fasta_index(proteome_file)
+    hits = sorted(index[uid] for uid in target_ids if uid in index)  # sorted by offset -> sequential reads
+    with open(proteome_file, "rb") as proteome:
+        for start, length in hits:
+            proteome.seek(start)
+            record = proteome.read(length).strip()
+            out.write(record + b"\n")
+    return len(hits)
+
+
+def append_streamed_hits(target_ids: set, proteome_file: str, out) -> int:
+    # --- Compressed proteome: one pass over all records, keep the ones with a target ID ---
+    found = set()
+    for header, sequence in read_fasta_bytes(proteome_file):
+        protein_id = parse_protein_id(header.decode("utf-8", errors="replace"))
+        if protein_id in target_ids and protein_id not in found:
+            found.add(protein_id)
+            write_record(out, header, sequence)
+    return len(found)
+
+
+def extract_hits_and_append(id_file: str, proteome_file: str, base_dataset_file: str, output_file: str,
+                            clean_base: bool = False):
+    """base_dataset_file None: only the hits are written."""
+    # --- Step 1: Load all target UniProt IDs ---
+    target_ids = load_target_ids(id_file)
+    print(f"Loaded {len(target_ids)} target IDs.")
+
+    with open(output_file, "wb+") as out:
+        # --- Step 2: Base dataset into the output file (optionally with cleaned headers) ---
+        if base_dataset_file:
+            write_base(base_dataset_file, out, clean_base)
+            out.seek(0, os.SEEK_END)
+
+        # --- Step 3: Append the hit records from the proteome ---
+        if is_gzip(proteome_file):
+            found = append_streamed_hits(target_ids, proteome_file, out)
+        else:
+            found = append_indexed_hits(target_ids, proteome_file, out)
+
+    print(f"Found {found} matching sequences in the proteome.")
+    if len(target_ids) - found:
+        print(f"{len(target_ids) - found} target IDs were not found in the proteome.")
+    print(f"{'Merged dataset' if base_dataset_file else 'Hits'} written to '{output_file}'")
+
+
+def main():
+    # --- Argument Parsing ---
+    parser = argparse.ArgumentParser(
+        description="Extract sequences from a proteome by matching UniProt IDs and append them to an existing base dataset."
+    )
+
+    parser.add_argument("-i", "--id-file", help="UniProt ID list", required=True)
+    parser.add_argument("-p", "--proteome-file", help="Proteome FASTA file (.fasta or .fasta.gz)", required=True)
+    parser.add_argument("-b", "--base-dataset", help="Base dataset FASTA file (omit to write only the hits)")
+    parser.add_argument("-o", "--output-file", help="Output merged FASTA file", required=True)
+    parser.add_argument("--clean-base", action="store_true",
+                        help="Clean the base dataset headers while copying (raw UniProt base dataset as -b).")
+
+    args = parser.parse_args()
+
+    extract_hits_and_append(args.id_file, args.proteome_file, args.base_dataset, args.output_file, args.clean_base)
+
+
+if __name__ == "__main__":
+    main()
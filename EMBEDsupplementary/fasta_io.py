@@ -0,0 +1,127 @@
+import gzip
+import io
+import os
+import shutil
+import subprocess
+
+# Shared FASTA reading/writing for the pipeline scripts.
+# read_fasta() parses records out of large block reads: every block is split at record starts ("\n>") and the line
+# breaks of a whole sequence are dropped in one bytes.translate call, so no per-line strings are built or joined.
+# Compressed input (.gz, plain gzip or bgzip/BGZF as shipped by UniProt) is read directly, no need to decompress to
+# disk first. Decompression runs in a separate process with several threads when a tool is available:
+#   BGZF: bgzip -@ <threads> (truly parallel, blocks are independent), otherwise pigz (separate read/crc threads)
+#   fallback: Python's gzip module in-process.
+# Compression is detected by the gzip magic bytes, not the file suffix.
+
+BLOCK_SIZE = 1 << 24   # 16 MiB
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def is_gzip(path) -> bool:
+    with open(path, "rb") as f:
+        return f.read(2) == GZIP_MAGIC
+
+
+def is_bgzf(path) -> bool:
+    """BGZF files are gzip members with an extra field holding the 'BC' subfield."""
+    with open(path, "rb") as f:
+        head = f.read(14)
+    return len(head) == 14 and head[:2] == GZIP_MAGIC and head[3] & 4 and head[12:14] == b"BC"
+
+
+def decompression_command(path, threads: int = 0):
+    """Returns the external decompressor command for path, or None to fall back to the gzip module."""
+    threads = threads or min(4, os.cpu_count() or 1)
+    if is_bgzf(path) and shutil.which("bgzip"):
+        return ["bgzip", "-dc", "-@", str(threads), str(path)]
+    if shutil.which("pigz"):
+        return ["pigz", "-dc", "-p", str(threads), str(path)]
+    return None
+
+
+class _ProcessReader(io.RawIOBase):
+    """Binary stream over the stdout of a decompressor; fails on close if the decompressor failed."""
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self.process.stdout.readinto(buffer)
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        finished = self.process.stdout.read(1) == b""
+        self.process.stdout.close()
+        if not finished:
+            self.process.kill()   # closed early, the decompressor does not need to finish
+        stderr = self.process.stderr.read().decode(errors="replace").strip()
+        self.process.stderr.close()
+        if self.process.wait() != 0 and finished:
+            raise OSError(f"{' '.join(self.cmd)} failed: {stderr}")
+
+
+def open_fasta(path, threads: int = 0):
+    """Opens a FASTA file for binary reading, decompressing gzip/bgzip input on the fly."""
+    if not is_gzip(path):
+        return open(path, "rb")
+    cmd = decompression_command(path, threads)
+    if cmd is None:
+        return gzip.open(path, "rb")
+    return io.BufferedReader(_ProcessReader(cmd), buffer_size=BLOCK_SIZE)
+
+
+def read_fasta_bytes(path, threads: int = 0, block_size: int = BLOCK_SIZE):
+    """Yields (header, sequence) as bytes; the header without '>', the sequence without line breaks."""
+    with open_fasta(path, threads) as f:
+        rest = b""
+        while True:
+            block = f.read(block_size)
+            data = rest + block if rest else block
+            if block:
+                # keep the last (possibly incomplete) record for the next block
+                cut = data.rfind(b"\n>")
+                if cut < 0:
+                    rest = data
+                    continue
+                data, rest = data[:cut], data[cut + 1:]
+            data = data.lstrip()
+            if data:
+                if not data.startswith(b">"):
+                    raise ValueError(f"'{path}' is not a FASTA file (first record does not start with '>').")
+                for record in data[1:].split(b"\n>"):
+                    header, _, sequence = record.partition(b"\n")
+                    yield header.rstrip(b"\r"), sequence.translate(None, b"\r\n")
+            if not block:
+                return
+
+
+def read_fasta(path, threads: int = 0, block_size: int = BLOCK_SIZE):
+    """Yields (header, sequence) tuples as strings; the header is the full header line without '>'."""
+    for header, sequence in read_fasta_bytes(path, threads, block_size):
+        yield header.decode("utf-8", errors="replace"), sequence.decode("ascii", errors="replace")
+
+
+def count_records(path, threads: int = 0) -> int:
+    count = 0
+    with open_fasta(path, threads) as f:
+        previous = b"\n"
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                return count
+            count += block.count(b"\n>") + (previous == b"\n" and block.startswith(b">"))
+            previous = block[-1:]
+
+
+def write_record(out, header, sequence):
+    """Writes one unwrapped record to a binary (bytes arguments) or text (str arguments) file."""
+    if isinstance(header, bytes):
+        out.write(b">" + header + b"\n" + sequence + b"\n")
+    else:
+        out.write(f">{header}\n{sequence}\n")
@@ -1,49 +1,106 @@
-import argparse
-import h5py
-
-# --- Argument Parsing ---
-parser = argparse.ArgumentParser(
-    description="Rename datasets in an HDF5 file using their 'original_id' attribute."
-)
-
-parser.add_argument(
-    "-i", "--input-file",
-    help="Path to the input HDF5 file (e.g., reduced_embeddings_file.h5).",
-    required=True
-)
-parser.add_argument(
-    "-o", "--output-file",
-    help="Path to the output HDF5 file (e.g., reduced_embeddings_with_ids.h5).",
-    required=True
-)
-
-args = parser.parse_args()
-embedding_file = args.input_file
-output_file = args.output_file
-
-# --- Core logic ---
-with h5py.File(embedding_file, "r") as infile, h5py.File(output_file, "w") as outfile:
-    for dataset_name in infile.keys():
-        data = infile[dataset_name][:]
-        attrs = dict(infile[dataset_name].attrs)
-
-        protein_id = attrs.get("original_id", None)
-
-        if protein_id is None:
-            new_name = str(dataset_name)
-        else:
-            if isinstance(protein_id, bytes):
-                protein_id = protein_id.decode("utf-8")
-            elif isinstance(protein_id, (list, tuple)) and isinstance(protein_id[0], bytes):
-                protein_id = protein_id[0].decode("utf-8")
-            elif isinstance(protein_id, (list, tuple)):
-                protein_id = protein_id[0]
-            new_name = str(protein_id).strip()
-
-        outfile.create_dataset(new_name, data=data)
-
-        for key, value in attrs.items():
-            outfile[new_name].attrs[key] = value
-
-print(f"All datasets renamed using their 'original_id' attribute and saved to '{output_file}'.")
-
+import argparse
+import h5py
+
+# Renames the datasets of a bio_embeddings HDF5 file by their 'original_id' attribute.
+# Two modes:
+#   in-place (--in-place): datasets are renamed through HDF5 links (h5py move), no embedding data is read or copied
+#   copy (default, needs -o): datasets are copied into a new file in slices so that at most --max-memory-mb
+#                             of embedding data is held in memory at any time (matters for per-residue embeddings)
+
+
+def resolve_protein_id(dataset_name, attrs) -> str:
+    """Returns the new dataset name: the 'original_id' attribute if present, else the current name."""
+    protein_id = attrs.get("original_id", None)
+
+    if protein_id is None:
+        return str(dataset_name)
+    if isinstance(protein_id, bytes):
+        protein_id = protein_id.decode("utf-8")
+    elif isinstance(protein_id, (list, tuple)) and isinstance(protein_id[0], bytes):
+        protein_id = protein_id[0].decode("utf-8")
+    elif isinstance(protein_id, (list, tuple)):
+        protein_id = protein_id[0]
+    return str(protein_id).strip()
+
+
+def rename_in_place(embedding_file: str):
+    with h5py.File(embedding_file, "r+") as h5:
+        # list() first, the group must not change while iterating over its keys
+        for dataset_name in list(h5.keys()):
+            new_name = resolve_protein_id(dataset_name, h5[dataset_name].attrs)
+            if new_name == dataset_name:
+                continue
+            if new_name in h5:
+                print(f"Cannot rename '{dataset_name}' to '{new_name}': name already exists, keeping the old name.")
+                continue
+            h5.move(dataset_name, new_name)
+
+    print(f"All datasets renamed in place using their 'original_id' attribute in '{embedding_file}'.")
+
+
+def copy_dataset_chunked(source, outfile, new_name: str, max_bytes: int):
+    """Copies one dataset into outfile in slices along its first axis, each slice at most max_bytes large."""
+    if source.shape == ():
+        target = outfile.create_dataset(new_name, data=source[()])
+    else:
+        target = outfile.create_dataset(new_name, shape=source.shape, dtype=source.dtype)
+        row_bytes = max(1, source.dtype.itemsize * (source.size // max(1, source.shape[0])))
+        rows_per_slice = max(1, max_bytes // row_bytes)
+        for start in range(0, source.shape[0], rows_per_slice):
+            stop = min(start + rows_per_slice, source.shape[0])
+            target[start:stop] = source[start:stop]
+
+    for key, value in source.attrs.items():
+        target.attrs[key] = value
+
+
+def rename_to_copy(embedding_file: str, output_file: str, max_memory_mb: float):
+    max_bytes = int(max_memory_mb * 1024 * 1024)
+    with h5py.File(embedding_file, "r") as infile, h5py.File(output_file, "w") as outfile:
+        for dataset_name in infile.keys():
+            source = infile[dataset_name]
+            new_name = resolve_protein_id(dataset_name, source.attrs)
+            copy_dataset_chunked(source, outfile, new_name, max_bytes)
+
+    print(f"All datasets renamed using their 'original_id' attribute and saved to '{output_file}'.")
+
+
+def main():
+    # --- Argument Parsing ---
+    parser = argparse.ArgumentParser(
+        description="Rename datasets in an HDF5 file using their 'original_id' attribute."
+    )
+
+    parser.add_argument(
+        "-i", "--input-file",
+        help="Path to the input HDF5 file (e.g., reduced_embeddings_file.h5).",
+        required=True
+    )
+    parser.add_argument(
+        "-o", "--output-file",
+        help="Path to the output HDF5 file (e.g., reduced_embeddings_with_ids.h5). Required unless --in-place is given."
+    )
+    parser.add_argument(
+        "--in-place",
+        action="store_true",
+        help="Rename the datasets inside the input file through HDF5 links instead of writing a new file."
+    )
+    parser.add_argument(
+        "--max-memory-mb",
+        type=float,
+        default=256,
+        help="Upper bound for the embedding data held in memory while copying (default: 256 MB)."
+    )
+
+    args = parser.parse_args()
+
+    if args.in_place:
+        rename_in_place(args.input_file)
+    else:
+        if not args.output_file:
+            parser.error("-o/--output-file is required unless --in-place is given.")
+        rename_to_copy(args.input_file, args.output_file, args.max_memory_mb)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,47 @@
-import argparse
-
-# --- Argument parsing ---
-parser = argparse.ArgumentParser(
-    description="Clean FASTA headers by keeping only the UniProt ID (the second element after '|')."
-)
-
-parser.add_argument(
-    "-i", "--input-file",
-    help="Path to the input FASTA file.",
-    required=True
-)
-parser.add_argument(
-    "-o", "--output-file",
-    help="Path to the cleaned output FASTA file.",
-    required=True
-)
-
-args = parser.parse_args()
-input_file = args.input_file
-output_file = args.output_file
-
-# --- FASTA cleaning ---
-with open(input_file, "r") as infile, open(output_file, "w") as outfile:
-    for line in infile:
-        if line.startswith(">"):
-            parts = line.strip().split("|")
-            if len(parts) > 1:
-                new_header = ">" + parts[1].strip()
-            else:
-                new_header = line.strip()
-            outfile.write(new_header + "\n")
-        else:
-            outfile.write(line)
-
-print(f"Cleaned FASTA saved to '{output_file}'")
+import argparse
+
+from fasta_io import read_fasta_bytes, write_record
+
+
+def clean_header(header: bytes) -> bytes:
+    """Keeps only the UniProt ID of a header (the second element after '|'), other headers stay as they are."""
+    parts = header.strip().split(b"|")
+    if len(parts) > 1:
+        return parts[1].strip()
+    return header.strip()
+
+
+def clean_fasta(input_file: str, outfile):
+    """Streams the records of input_file (plain or gzip/bgzip) into the open binary file with cleaned headers."""
+    for header, sequence in read_fasta_bytes(input_file):
+        write_record(outfile, clean_header(header), sequence)
+
+
+def main():
+    # --- Argument parsing ---
+    parser = argparse.ArgumentParser(
+        description="Clean FASTA headers by keeping only the UniProt ID (the second element after '|')."
+    )
+
+    parser.add_argument(
+        "-i", "--input-file",
+        help="Path to the input FASTA file (.fasta or .fasta.gz).",
+        required=True
+    )
+    parser.add_argument(
+        "-o", "--output-file",
+        help="Path to the cleaned output FASTA file.",
+        required=True
+    )
+
+    args = parser.parse_args()
+
+    # --- FASTA cleaning ---
+    with open(args.output_file, "wb") as outfile:
+        clean_fasta(args.input_file, outfile)
+
+    print(f"Cleaned FASTA saved to '{args.output_file}'")
+
+
+if __name__ == "__main__":
+    main()
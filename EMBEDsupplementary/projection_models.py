@@ -0,0 +1,227 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import re
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+from embedding_knn import load_annotations
+from extract_hits_and_append import parse_protein_id
+
+# Reusable projections: fit PCA/UMAP once on the base dataset embeddings and only transform the hits of each organism.
+# The fitted models and the base coordinates are stored in <models_dir>/projection_models.pkl together with a
+# fingerprint of the base embeddings (IDs + vectors), the methods and their parameters. They are refitted only when
+# one of these changes, so every organism lands in the same coordinate system and only its hits are transformed.
+# Supported methods: pcaN (NumPy SVD) and umapN (umap-learn). t-SNE and MDS cannot place new points into an existing
+# embedding and are skipped in this mode (use the regular protspace-local run for them).
+# Output: a protspace folder with the tables protspace-local writes with --bundled false
+#   projections_metadata.parquet  projection_name, dimensions, info_json
+#   projections_data.parquet      projection_name, identifier, x, y, z
+#   selected_features.parquet     identifier + the --features that can be read from the UniProt headers of the base
+#                                 dataset: species (OS=), gene (GN=), protein_name, entry_name, fragment (yes/no).
+#                                 Hits get their organism name as species and empty values otherwise. Features that
+#                                 protspace-local fetches from the UniProt API (class, cc_subcellular_location, ...) are
+#                                 not available offline and are skipped with a warning.
+# Several organisms can be projected together: --hit-ids and --organism take one entry per organism, in the same order.
+# Must be run with the Python of the protspace environment (umap-learn, pyarrow).
+
+MODELS_FILE = "projection_models.pkl"
+TRANSFORMABLE = ("pca", "umap")
+HEADER_FEATURES = {
+    "species": lambda note: note.get("organism", ""),
+    "gene": lambda note: note.get("gene", ""),
+    "protein_name": lambda note: note.get("protein_name", ""),
+    "entry_name": lambda note: note.get("entry_name", ""),
+    "fragment": lambda note: ("yes" if "(Fragment)" in note["protein_name"] else "no") if note else "",
+}
+
+
+def parse_methods(methods: str) -> list:
+    """"umap3,tsne2,pca2" -> [("umap", 3), ("tsne", 2), ("pca", 2)]"""
+    parsed = []
+    for method in methods.split(","):
+        match = re.fullmatch(r"([a-z]+)(\d+)", method.strip().lower())
+        if not match:
+            raise ValueError(f"Invalid projection method '{method}' (expected e.g. umap3 or pca2).")
+        parsed.append((match.group(1), int(match.group(2))))
+    return parsed
+
+
+def load_embeddings(embedding_file: str):
+    with h5py.File(embedding_file, "r") as h5:
+        ids = list(h5.keys())
+        matrix = np.stack([h5[i][()] for i in ids]).astype(np.float32)
+    return ids, matrix
+
+
+def base_fingerprint(ids: list, matrix: np.ndarray) -> str:
+    digest = hashlib.sha256()
+    digest.update("\n".join(ids).encode("utf-8"))
+    digest.update(np.ascontiguousarray(matrix).tobytes())
+    return digest.hexdigest()
+
+
+def fit_projection(method: str, dims: int, matrix: np.ndarray, params: dict):
+    """Returns (model, base coordinates, info)."""
+    if method == "pca":
+        mean = matrix.mean(axis=0)
+        _, singular_values, components = np.linalg.svd(matrix - mean, full_matrices=False)
+        variance = singular_values ** 2
+        model = {"mean": mean, "components": components[:dims]}
+        info = {"explained_variance_ratio": (variance[:dims] / variance.sum()).tolist()}
+        return model, transform_projection(method, model, matrix), info
+
+    import umap
+    model = umap.UMAP(n_components=dims, n_neighbors=params["n_neighbors"], min_dist=params["min_dist"],
+                      metric=params["metric"])
+    coords = model.fit_transform(matrix)
+    return model, coords, dict(params)
+
+
+def transform_projection(method: str, model, matrix: np.ndarray) -> np.ndarray:
+    if method == "pca":
+        return (matrix - model["mean"]) @ model["components"].T
+    return model.transform(matrix)
+
+
+def fitted_models(models_dir: Path, base_ids: list, base_matrix: np.ndarray, methods: list, params: dict) -> dict:
+    """Loads the stored models, refitting them if the base embeddings, methods or parameters changed."""
+    models_path = models_dir / MODELS_FILE
+    fingerprint = base_fingerprint(base_ids, base_matrix)
+    if models_path.exists():
+        with open(models_path, "rb") as f:
+            stored = pickle.load(f)
+        if stored["fingerprint"] == fingerprint and stored["methods"] == methods and stored["params"] == params:
+            print(f"Using fitted projections from '{models_path}'.")
+            return stored
+        print(f"Base embeddings or projection settings changed, refitting '{models_path}'.")
+
+    stored = {"fingerprint": fingerprint, "methods": methods, "params": params, "base_ids": base_ids, "projections": {}}
+    for method, dims in methods:
+        print(f"Fitting {method.upper()} ({dims} dimensions) on {len(base_ids)} base embeddings.")
+        model, coords, info = fit_projection(method, dims, base_matrix, params)
+        stored["projections"][f"{method.upper()}_{dims}"] = {"method": method, "dimensions": dims, "model": model,
+                                                             "base_coords": coords, "info": info}
+
+    models_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = models_path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(stored, f)
+    os.replace(tmp_path, models_path)
+    return stored
+
+
+def header_features(features: str, base_ids: list, hit_names: list, hit_organism: dict, annotations: dict) -> dict:
+    """Feature columns (base proteins first, then hits) for the requested features that the headers provide."""
+    requested = [f.strip() for f in features.split(",") if f.strip()]
+    unavailable = [f for f in requested if f not in HEADER_FEATURES]
+    if unavailable:
+        print(f"WARNING: {', '.join(unavailable)} cannot be read from the FASTA headers and are missing from the "
+              f"projection output (use protspace_mode 'full' for them).")
+    columns = {}
+    for feature in requested:
+        if feature not in HEADER_FEATURES:
+            continue
+        values = [HEADER_FEATURES[feature](annotations.get(parse_protein_id(i), {})) for i in base_ids]
+        if feature == "species":
+            values += [hit_organism[parse_protein_id(i)] for i in hit_names]
+        else:
+            values += [""] * len(hit_names)
+        columns[feature] = values
+    return columns
+
+
+def write_protspace_output(output_dir: Path, projections: dict, identifiers: list, coordinates: dict, features: dict):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    pq.write_table(pa.table({
+        "projection_name": list(projections),
+        "dimensions": [p["dimensions"] for p in projections.values()],
+        "info_json": [json.dumps(p["info"]) for p in projections.values()],
+    }), output_dir / "projections_metadata.parquet")
+
+    data = {"projection_name": [], "identifier": [], "x": [], "y": [], "z": []}
+    for name, coords in coordinates.items():
+        data["projection_name"] += [name] * len(identifiers)
+        data["identifier"] += identifiers
+        for axis, column in enumerate(("x", "y", "z")):
+            data[column] += coords[:, axis].tolist() if axis < coords.shape[1] else [None] * len(identifiers)
+    pq.write_table(pa.table(data), output_dir / "projections_data.parquet")
+
+    pq.write_table(pa.table({"identifier": identifiers, **features}), output_dir / "selected_features.parquet")
+
+
+def project(embedding_file: str, hit_id_files: list, models_dir: str, output_dir: str, methods: str, organisms: list,
+            base_fasta: str = None, params: dict = None, features: str = "species"):
+    """hit_id_files[i] holds the hits of organisms[i]."""
+    params = params or {"n_neighbors": 15, "min_dist": 0.1, "metric": "euclidean"}
+    methods = parse_methods(methods)
+    skipped = [f"{m}{d}" for m, d in methods if m not in TRANSFORMABLE]
+    if skipped:
+        print(f"Skipping {', '.join(skipped)}: only {' and '.join(TRANSFORMABLE)} can project new points.")
+    methods = [(m, d) for m, d in methods if m in TRANSFORMABLE]
+    if not methods:
+        raise ValueError("None of the projection methods can be reused (supported: pcaN, umapN).")
+
+    if len(hit_id_files) != len(organisms):
+        raise ValueError("Every hit ID file needs its organism name.")
+    hit_organism = {}
+    for hit_id_file, organism in zip(hit_id_files, organisms):
+        with open(hit_id_file, "r") as f:
+            for uid in {parse_protein_id(line) for line in f if line.strip()}:
+                if hit_organism.setdefault(uid, organism) != organism:
+                    raise ValueError(f"Hit {uid} is listed for both {hit_organism[uid]} and {organism}.")
+    ids, matrix = load_embeddings(embedding_file)
+    is_hit = np.array([parse_protein_id(i) in hit_organism for i in ids], dtype=bool)
+    base_ids = [i for i, hit in zip(ids, is_hit) if not hit]
+    hit_names = [i for i, hit in zip(ids, is_hit) if hit]
+    print(f"{len(hit_names)} hits and {len(base_ids)} base proteins in '{embedding_file}'.")
+
+    stored = fitted_models(Path(models_dir), base_ids, matrix[~is_hit], methods, params)
+    coordinates = {}
+    for name, projection in stored["projections"].items():
+        hit_coords = transform_projection(projection["method"], projection["model"], matrix[is_hit]) \
+            if hit_names else np.empty((0, projection["dimensions"]))
+        coordinates[name] = np.vstack([projection["base_coords"], hit_coords])
+
+    annotations = load_annotations(base_fasta) if base_fasta else {}
+    columns = header_features(features, base_ids, hit_names, hit_organism, annotations)
+    write_protspace_output(Path(output_dir), stored["projections"], base_ids + hit_names, coordinates, columns)
+    print(f"{len(hit_names)} hits projected onto {', '.join(coordinates)}, written to '{output_dir}'.")
+
+
+def main():
+    # --- Argument Parsing ---
+    parser = argparse.ArgumentParser(
+        description="Project the hits onto PCA/UMAP models fitted once on the base dataset embeddings."
+    )
+
+    parser.add_argument("-i", "--input-file", help="Per-protein H5 (base dataset + hits).", required=True)
+    parser.add_argument("--hit-ids", nargs="+", help="Hit ID list(s) (one UniProt ID or MMseqs target name per line), "
+                                                     "one per organism.", required=True)
+    parser.add_argument("-m", "--models-dir", help="Folder of the fitted projection models (shared by organisms).", required=True)
+    parser.add_argument("-o", "--output-dir", help="protspace output folder.", required=True)
+    parser.add_argument("--methods", default="umap3,pca2", help="Projection methods (default: umap3,pca2).")
+    parser.add_argument("--organism", nargs="+", help="Organism name(s), used as the species of the hits.", required=True)
+    parser.add_argument("-b", "--base-dataset", help="Original base dataset FASTA (UniProt headers) for the features.")
+    parser.add_argument("-f", "--features", default="species",
+                        help="Comma separated features, as protspace_features (default: species).")
+    parser.add_argument("--n-neighbors", type=int, default=15, help="UMAP n_neighbors (default: 15).")
+    parser.add_argument("--min-dist", type=float, default=0.1, help="UMAP min_dist (default: 0.1).")
+    parser.add_argument("--metric", default="euclidean", help="UMAP metric (default: euclidean).")
+
+    args = parser.parse_args()
+
+    project(args.input_file, args.hit_ids, args.models_dir, args.output_dir, args.methods, args.organism,
+            args.base_dataset, {"n_neighbors": args.n_neighbors, "min_dist": args.min_dist, "metric": args.metric},
+            args.features)
+
+
+if __name__ == "__main__":
+    main()
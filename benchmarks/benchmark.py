@@ -0,0 +1,307 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Offline benchmark harness for the Python stages of the pipeline.
+# For every scale (number of proteome records) it generates synthetic inputs, runs each stage as its own process and
+# records wall time, throughput (records/s) and peak RSS of that process (from wait4 rusage, Linux/macOS only).
+#   keep_protein_ids       UniProt-style proteome -> cleaned headers
+#   extract_hits_cold      1% of the proteome IDs as hits, builds the .hits.idx index
+#   extract_hits_warm      same again, reuses the index
+#   h5_correction_copy     bio_embeddings-style H5 (records / --h5-divisor proteins, 1024 floats each), chunked copy
+#   h5_correction_in_place same H5, renamed through HDF5 links
+#   mmseqs_filter          convertalis TSV with one row per record, thresholds + best hit per query + hit_ids
+#   pipeline_mmseqs        pipelineMMSeqs.py with stub wsl/mmseqs binaries
+#   pipeline_famsa         pipelineFAMSA.py with a stub famsa binary
+#   pipeline_tree          pipelineTreePart.py with a stub iqtree binary
+# The stubs only mimic the interface (files in, files out), so the pipeline_* numbers measure our own overhead.
+# Results are written as JSON and compared against a stored baseline (--save-baseline to create/replace it).
+#
+# Usage example:
+#   python benchmarks/benchmark.py --scales 10000,100000 --save-baseline
+#   python benchmarks/benchmark.py --scales 10000,100000          # compare against benchmarks/baseline.json
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+BENCH_DIR = Path(__file__).resolve().parent
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+TSV_FORMAT = "query,target,evalue,pident,alnlen,qcov,tcov,tstart,tend"
+
+# ------------------------------------- SYNTHETIC INPUTS -------------------------------------
+
+def protein_id(i: int) -> str:
+    return f"A{i:09d}"
+
+def write_proteome(path: Path, records: int, rng: random.Random):
+    # sequences are slices of one random pool, generating 10M records stays fast
+    pool = "".join(rng.choices(AMINO_ACIDS, k=100_000))
+    with open(path, "w") as out:
+        for i in range(records):
+            length = rng.randint(50, 500)
+            start = rng.randint(0, len(pool) - length)
+            seq = pool[start:start + length]
+            out.write(f">tr|{protein_id(i)}|P{i}_SYNTH Synthetic protein {i} OS=Synthetica benchmarkii OX=1 GN=g{i} PE=4 SV=1\n")
+            for j in range(0, length, 60):
+                out.write(seq[j:j + 60] + "\n")
+
+def write_hit_ids(path: Path, records: int, rng: random.Random):
+    with open(path, "w") as out:
+        for i in rng.sample(range(records), max(1, records // 100)):
+            out.write(protein_id(i) + "\n")
+
+def write_mmseqs_tsv(path: Path, records: int, rng: random.Random):
+    with open(path, "w") as out:
+        out.write(TSV_FORMAT.replace(",", "\t") + "\n")
+        for i in range(records):
+            tstart = rng.randint(1, 1_000_000)
+            tend = tstart + rng.choice((1, -1)) * rng.randint(30, 900)
+            out.write(f"Q{i % 500}\ttr|{protein_id(rng.randrange(records))}|X\t{10 ** -rng.uniform(0, 50):.3g}\t"
+                      f"{rng.uniform(20, 100):.1f}\t{rng.randint(20, 500)}\t{rng.random():.3f}\t{rng.random():.3f}\t"
+                      f"{tstart}\t{tend}\n")
+
+def write_embeddings_h5(path: Path, proteins: int, seed: int):
+    import h5py
+    import numpy as np
+    np_rng = np.random.default_rng(seed)
+    with h5py.File(path, "w") as h5:
+        for i in range(proteins):
+            name = hashlib.md5(str(i).encode()).hexdigest()
+            dataset = h5.create_dataset(name, data=np_rng.random(1024, dtype=np.float32))
+            dataset.attrs["original_id"] = protein_id(i)
+
+# ------------------------------------- STUB BINARIES -------------------------------------
+
+STUBS = {
+    # runs the rest of the command line, stands in for WSL
+    "wsl": """
+import os, sys
+os.execvp(sys.argv[1], sys.argv[1:])
+""",
+    # createdb copies the FASTA so convertalis can report the query names
+    "mmseqs": """
+import shutil, sys
+from pathlib import Path
+args = sys.argv[1:]
+if args[0] == "createdb":
+    shutil.copyfile(args[1], args[2])
+elif args[0] in ("createindex", "search"):
+    Path(args[1] + ".stub" if args[0] == "createindex" else args[3]).touch()
+elif args[0] == "convertalis":
+    fmt = args[args.index("--format-output") + 1].split(",")
+    names = [l[1:].split()[0] for l in open(args[1]) if l.startswith(">")]
+    with open(args[4], "w") as out:
+        out.write("\\t".join(fmt) + "\\n")
+        for q in names:
+            for t in range(5):
+                values = {"query": q, "target": f"chr{t}", "evalue": "1e-20", "pident": "80.0", "alnlen": "100",
+                          "qcov": "0.9", "tcov": "0.1", "tstart": "100", "tend": "400"}
+                out.write("\\t".join(values.get(c, "0") for c in fmt) + "\\n")
+""",
+    # pads every sequence to the longest one, that is a valid (if useless) alignment
+    "famsa": """
+import sys
+src, dst = sys.argv[-2], sys.argv[-1]
+records = []
+for line in open(src):
+    if line.startswith(">"):
+        records.append([line, ""])
+    else:
+        records[-1][1] += line.strip()
+width = max((len(s) for _, s in records), default=0)
+with open(dst, "w") as out:
+    for header, s in records:
+        out.write(header + s.ljust(width, "-") + "\\n")
+""",
+    # star tree over all sequence names, reports a fixed model like ModelFinder does
+    "iqtree": """
+import sys
+args = sys.argv[1:]
+aln = args[args.index("-s") + 1]
+prefix = args[args.index("--prefix") + 1] if "--prefix" in args else aln
+names = [l[1:].split()[0] for l in open(aln) if l.startswith(">")]
+print("Best-fit model: LG+G4 chosen according to BIC")
+open(prefix + ".treefile", "w").write("(" + ",".join(f"{n}:0.1" for n in names) + ");\\n")
+open(prefix + ".iqtree", "w").write("Best-fit model according to BIC: LG+G4\\n")
+""",
+}
+
+def write_stubs(bin_dir: Path):
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    for name, body in STUBS.items():
+        path = bin_dir / name
+        path.write_text(f"#!{sys.executable}\n{body.lstrip()}")
+        path.chmod(path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+# ------------------------------------- TIMING -------------------------------------
+
+def run_timed(cmd: list, env: dict, log_path: Path) -> dict:
+    """Runs one stage process; wall time plus peak RSS of exactly that child (rusage from wait4)."""
+    with open(log_path, "w") as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(cmd, cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+        if hasattr(os, "wait4"):
+            _, status, rusage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is KiB on Linux, bytes on macOS
+            peak_rss_mb = rusage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+        else:
+            process.wait()
+            peak_rss_mb = None
+        seconds = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(map(str, cmd))} failed with exit code {process.returncode}, see {log_path}")
+    return {"seconds": round(seconds, 4), "peak_rss_mb": None if peak_rss_mb is None else round(peak_rss_mb, 1)}
+
+def benchmark_scale(records: int, work_dir: Path, env: dict, h5_divisor: int, seed: int) -> list:
+    rng = random.Random(seed)
+    data = work_dir / f"scale_{records}"
+    data.mkdir(parents=True, exist_ok=True)
+    python = sys.executable
+
+    print(f"[BENCH] Generating synthetic inputs for {records} records...")
+    proteome = data / "proteome.fasta"
+    write_proteome(proteome, records, rng)
+    hit_ids = data / "hit_ids.txt"
+    write_hit_ids(hit_ids, records, rng)
+    tsv = data / "mmseqs_results.tsv"
+    write_mmseqs_tsv(tsv, records, rng)
+    h5_proteins = max(1, records // h5_divisor)
+    embeddings = data / "reduced_embeddings_file.h5"
+    # generated in a child process: a fork of this process inherits its RSS as the starting peak, so the harness
+    # itself must not load numpy/h5py or it would inflate the peak RSS measured for every stage
+    subprocess.run([python, __file__, "--generate-h5", str(embeddings), str(h5_proteins), str(rng.randrange(2 ** 32))],
+                   check=True)
+    query = data / "query.fasta"
+    write_proteome(query, min(records, 1000), rng)
+
+    config = data / "config.json"
+    with open(config, "w") as f:
+        json.dump({
+            "famsa": {"exe": str(work_dir / "bin" / "famsa"), "input_fasta": str(query),
+                      "output_fasta": str(data / "alignment.fasta")},
+            "iqtree": {"exe": str(work_dir / "bin" / "iqtree"), "mode": "single", "threads": "1"},
+            "mmseqs": {"exe": "mmseqs", "query": str(query), "target": str(proteome),
+                       "result": str(data / "stub_results.tsv"), "format": TSV_FORMAT,
+                       "tmp_dir": str(data / "tmp"), "db_cache_dir": str(data / "db_cache")},
+        }, f, indent=2)
+
+    stages = [
+        ("keep_protein_ids", records,
+         [python, "EMBEDsupplementary/keep_protein_ids.py", "-i", proteome, "-o", data / "cleaned.fasta"], None),
+        ("extract_hits_cold", records,
+         [python, "EMBEDsupplementary/extract_hits_and_append.py", "-i", hit_ids, "-p", proteome,
+          "-b", data / "cleaned.fasta", "-o", data / "merged.fasta"],
+         lambda: Path(str(proteome) + ".hits.idx").unlink(missing_ok=True)),
+        ("extract_hits_warm", records,
+         [python, "EMBEDsupplementary/extract_hits_and_append.py", "-i", hit_ids, "-p", proteome,
+          "-b", data / "cleaned.fasta", "-o", data / "merged.fasta"], None),
+        ("h5_correction_copy", h5_proteins,
+         [python, "EMBEDsupplementary/h5_correction.py", "-i", embeddings, "-o", data / "renamed.h5"], None),
+        ("h5_correction_in_place", h5_proteins,
+         [python, "EMBEDsupplementary/h5_correction.py", "-i", data / "in_place.h5", "--in-place"],
+         lambda: shutil.copyfile(embeddings, data / "in_place.h5")),
+        ("mmseqs_filter", records,
+         [python, "mmseqs_filter.py", "-i", tsv, "--evalue-max", "1e-5", "--pident-min", "35",
+          "--best-per", "query", "-o", data / "filtered.tsv", "--hit-ids", data / "filtered_ids.txt"], None),
+        ("pipeline_mmseqs", min(records, 1000), [python, "pipelineMMSeqs.py", config], None),
+        ("pipeline_famsa", min(records, 1000), [python, "pipelineFAMSA.py", config], None),
+        ("pipeline_tree", min(records, 1000), [python, "pipelineTreePart.py", config], None),
+    ]
+
+    results = []
+    for name, items, cmd, prepare in stages:
+        if prepare is not None:
+            prepare()   # setup work is not part of the measurement
+        metrics = run_timed([str(c) for c in cmd], env, data / f"{name}.log")
+        metrics.update({
+            "stage": name,
+            "records": records,
+            "items": items,
+            "throughput_per_s": round(items / metrics["seconds"], 1) if metrics["seconds"] else None,
+        })
+        print(f"[BENCH] {name:<24} {items:>10} items  {metrics['seconds']:>9.3f}s  "
+              f"{metrics['throughput_per_s'] or 0:>12.1f}/s  {metrics['peak_rss_mb'] or 0:>8.1f} MB")
+        results.append(metrics)
+    return results
+
+# ------------------------------------- BASELINE -------------------------------------
+
+def result_key(result: dict) -> str:
+    return f"{result['stage']}@{result['records']}"
+
+def compare_with_baseline(results: list, baseline: dict, tolerance: float) -> list:
+    """Returns the keys of all stages that got slower or bigger than baseline * (1 + tolerance)."""
+    regressions = []
+    print(f"[BENCH] Comparison with baseline (tolerance {tolerance:.0%}):")
+    for result in results:
+        key = result_key(result)
+        base = baseline.get(key)
+        if base is None:
+            print(f"[BENCH]   {key:<34} no baseline")
+            continue
+        time_ratio = result["seconds"] / base["seconds"] if base["seconds"] else 1.0
+        rss_ratio = (result["peak_rss_mb"] / base["peak_rss_mb"]
+                     if result["peak_rss_mb"] and base.get("peak_rss_mb") else 1.0)
+        regressed = time_ratio > 1 + tolerance or rss_ratio > 1 + tolerance
+        if regressed:
+            regressions.append(key)
+        print(f"[BENCH]   {key:<34} time x{time_ratio:.2f}  rss x{rss_ratio:.2f}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == "--generate-h5":
+        write_embeddings_h5(Path(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]))
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline's Python stages on synthetic data.")
+    parser.add_argument("--scales", default="10000", help="Comma separated record counts (default: 10000).")
+    parser.add_argument("--h5-divisor", type=int, default=10,
+                        help="Embedding H5 holds records / divisor proteins (default: 10).")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--work-dir", help="Where synthetic data is written (default: a temporary folder).")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated data.")
+    parser.add_argument("--output", default=str(BENCH_DIR / "results.json"), help="Results JSON.")
+    parser.add_argument("--baseline", default=str(BENCH_DIR / "baseline.json"), help="Baseline JSON.")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before flagging (default: 0.2).")
+    args = parser.parse_args()
+
+    scales = [int(s) for s in args.scales.split(",") if s.strip()]
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix="gobi_bench_"))
+    write_stubs(work_dir / "bin")
+    env = dict(os.environ)
+    env["PATH"] = str(work_dir / "bin") + os.pathsep + env.get("PATH", "")
+
+    try:
+        results = []
+        for records in scales:
+            results += benchmark_scale(records, work_dir, env, args.h5_divisor, args.seed)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"[BENCH] Results written to {args.output}")
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        with open(baseline_path, "w") as f:
+            json.dump({result_key(r): r for r in results}, f, indent=2)
+        print(f"[BENCH] Baseline saved to {baseline_path}")
+    elif baseline_path.exists():
+        with open(baseline_path, "r") as f:
+            baseline = json.load(f)
+        if compare_with_baseline(results, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import sys
+import tempfile
+from pathlib import Path
+
+# Offline check of the in-process embedder (EMBEDsupplementary/cpu_embedder.py) with a tiny local stand-in model.
+# Builds a sentencepiece vocabulary with one piece per amino acid ("▁M", like ProtT5's) and a randomly initialised
+# 1-layer T5EncoderModel in a temp folder, loads both through cpu_embedder.load_model() exactly like a real model
+# directory and checks that
+#   - every FASTA header gets one vector of the model width,
+#   - headers that are already in the output H5 are skipped on resume (their vectors stay as they are).
+# Needs torch, transformers and sentencepiece, i.e. run it with the Python of env_bio_embedding:
+#   <env_bio_embedding>/bin/python benchmarks/check_cpu_embedder.py
+# Without them it reports the check as skipped and exits with 0.
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "EMBEDsupplementary"))
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWYX"
+D_MODEL = 16
+RECORDS = [("seq_a", "MKTAYIAKQR"), ("seq_b", "MVLSPADKTNVKAAW"), ("seq_c", "GLSDGEWQQVLNVWGKVEAD")]
+
+
+def build_stand_in_model(model_dir: Path):
+    import sentencepiece
+    from transformers import T5Config, T5EncoderModel, T5Tokenizer
+
+    # ProtT5 tokenizes space-separated residues: a word model over single residues gives one token per residue,
+    # so the mean pooling in cpu_embedder.embed_batch covers exactly the residues as with the real model
+    corpus = model_dir / "corpus.txt"
+    corpus.write_text("\n".join(" ".join(AMINO_ACIDS[i:] + AMINO_ACIDS[:i]) for i in range(len(AMINO_ACIDS))) + "\n")
+    sentencepiece.SentencePieceTrainer.train(
+        input=str(corpus), model_prefix=str(model_dir / "spiece"), model_type="word", vocab_size=len(AMINO_ACIDS) + 3,
+        pad_id=0, eos_id=1, unk_id=2, bos_id=-1, minloglevel=2)
+    corpus.unlink()
+    # loaded once without the 100 sentinel tokens of T5 and saved back, so a plain from_pretrained() sees the same
+    tokenizer = T5Tokenizer.from_pretrained(str(model_dir), extra_ids=0)
+    tokenizer.save_pretrained(str(model_dir))
+
+    config = T5Config(vocab_size=len(tokenizer), d_model=D_MODEL, d_kv=8, d_ff=32, num_layers=1, num_heads=2,
+                      pad_token_id=0, eos_token_id=1, decoder_start_token_id=0)
+    T5EncoderModel(config).save_pretrained(str(model_dir))
+
+
+def check(tmp: Path) -> list:
+    import h5py
+    import numpy as np
+    from cpu_embedder import embed_fasta, embed_records, load_model
+
+    model_dir = tmp / "tiny_t5"
+    model_dir.mkdir()
+    build_stand_in_model(model_dir)
+
+    fasta = tmp / "input.fasta"
+    fasta.write_text("".join(f">{header}\n{sequence}\n" for header, sequence in RECORDS[:2]))
+    output = tmp / "embeddings.h5"
+    errors = []
+
+    embed_fasta(str(fasta), str(output), str(model_dir), "cpu", 1, 4000, 64)
+    with h5py.File(output, "r") as h5:
+        if sorted(h5.keys()) != sorted(h for h, _ in RECORDS[:2]):
+            errors.append(f"expected one vector per header, got {sorted(h5.keys())}")
+        for header in h5.keys():
+            if h5[header].shape != (D_MODEL,):
+                errors.append(f"{header}: shape {h5[header].shape}, expected ({D_MODEL},)")
+            elif not np.isfinite(h5[header][()]).all():
+                errors.append(f"{header}: vector is not finite")
+
+    # resume: a marker vector under an existing header must survive, only the new record is embedded
+    with h5py.File(output, "a") as h5:
+        h5[RECORDS[0][0]][...] = 7.0
+    tokenizer, model = load_model(str(model_dir), "cpu", 1)
+    embedded = embed_records(tokenizer, model, "cpu", RECORDS, str(output), 4000, 64)
+    if embedded != 1:
+        errors.append(f"resume embedded {embedded} records, expected only the new one")
+    with h5py.File(output, "r") as h5:
+        if not (h5[RECORDS[0][0]][()] == 7.0).all():
+            errors.append("an existing header was embedded again on resume")
+        if sorted(h5.keys()) != sorted(h for h, _ in RECORDS):
+            errors.append(f"after resume expected {len(RECORDS)} headers, got {sorted(h5.keys())}")
+    return errors
+
+
+def main():
+    try:
+        import sentencepiece  # noqa: F401
+        import torch  # noqa: F401
+        import transformers  # noqa: F401
+    except ImportError as e:
+        print(f"SKIPPED: {e.name} is not installed (run with the Python of env_bio_embedding).")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        errors = check(Path(tmp))
+    if errors:
+        for error in errors:
+            print(f"FAILED: {error}")
+        sys.exit(1)
+    print("cpu_embedder check passed: one vector per header, existing headers skipped on resume.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,246 @@
-from pathlib import Path
-import argparse
-import subprocess
-import shutil
-import sys
-import logging
-
 #!/usr/bin/env python3
 """
 mmseqs_exons.py
 
 Simple helper to run an MMseqs2 search of exon queries against genomic data.
-Footprint / style follows pipelineMMSeqs.py in this folder (import not required).
+Footprint / style follows pipelineMMSeqs.py in this folder.
 
 Usage example:
     python mmseqs_exons.py --query exons.fasta --target genome.fasta --out out_mmseqs --threads 4
 
-Creates mmseqs DBs as needed, runs `mmseqs search` and converts alignments to tabular output.
+Windowed search: chromosomes / scaffolds longer than --window-size are cut into windows that overlap by --overlap
+bases (set it above the longest expected exon alignment, so every hit lies completely inside at least one window).
+All windows go into ONE target DB, so every e-value is computed against the whole genome (plus the small window
+overlaps), exactly as without windows; splitting the target into separately searched batches would score each batch
+against its own size and distort the e-values (see the sharded mode of pipelineMMSeqs.py). Memory is bounded by
+--memory-limit-gb instead, which mmseqs applies through --split-memory-limit. For parallelism the exon queries are split
+into --parallel residue-balanced shards that are searched at once within the core budget --threads, each against the
+full target DB. Hit coordinates (tstart/tend) are lifted back from window to chromosome space and hits that were found
+twice in the overlap of two windows are merged (same query, chromosome and strand, overlapping on the chromosome,
+coming from different windows -> the one with the higher bit score is kept).
+
+Outputs in --out:
+    exon_hits.tsv   convertalis columns (header row), target = chromosome, tstart/tend in chromosome coordinates
+    exon_hits.bed   chrom start end query score strand (score = pident mapped to 0..1000)
+Plain and gzip/bgzip compressed FASTA are accepted.
 """
 
+from pathlib import Path
+import argparse
+import subprocess
+import shutil
+import sys
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from EMBEDsupplementary.fasta_io import read_fasta_bytes, write_record
+from mmseqs_filter import LINE_COLUMN, read_tsv_chunks, write_bed
+from pipelineMMSeqs import split_fasta, windows_to_wsl
+from run_metrics import run_measured
+
+FORMAT = "query,target,pident,alnlen,mismatch,gapopen,qstart,qend,tstart,tend,evalue,bits"
+SEARCH_PARAMS = ["--search-type", "3"]   # protein->nucleotide (TBLASTN mode) as in pipelineMMSeqs.py
+
+
+def window_starts(length: int, window_size: int, overlap: int) -> list:
+    """0-based window starts covering length; the last window ends exactly at the sequence end."""
+    if length <= window_size:
+        return [0]
+    step = window_size - overlap
+    starts = list(range(0, length - window_size, step))
+    starts.append(length - window_size)
+    return starts
+
+
+def write_windows(genome: Path, windows_fasta: Path, window_size: int, overlap: int):
+    """Cuts the genome into windows named w<index>, all written to one FASTA.
+    Returns (window chromosome names, window offsets)."""
+    chroms = []
+    offsets = []
+    with open(windows_fasta, "wb") as out:
+        for header, sequence in read_fasta_bytes(genome):
+            if not sequence:
+                continue
+            chrom = header.split()[0].decode("utf-8", errors="replace") if header.strip() else ""
+            for start in window_starts(len(sequence), window_size, overlap):
+                write_record(out, f"w{len(chroms)}".encode("ascii"), sequence[start:start + window_size])
+                chroms.append(chrom)
+                offsets.append(start)
+    return np.array(chroms, dtype=object), np.array(offsets, dtype=np.int64)
+
+
+def run_commands(cmds: list, stage: str):
+    for c in cmds:
+        print(f"[{stage}] Running:", " ".join(c))
+        returncode = run_measured(c, f"{stage}_{c[2]}", stdout=subprocess.DEVNULL)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, c)
+
+
+# createdb/search/convertalis of one query shard against the shared target DB in its own tmp folder, returns the TSV
+def search_shard(wsl: list, exe: str, shard: Path, t_db: str, threads: int, memory_limit_gb: float,
+                 search_args: list) -> Path:
+    shard_tmp = shard.parent / f"{shard.stem}_tmp"
+    shard_tmp.mkdir(parents=True, exist_ok=True)
+    tmp = windows_to_wsl(shard_tmp)
+    q_db = os.path.join(tmp, "queryDB")
+    res_db = os.path.join(tmp, "searchRes")
+    shard_result = shard.parent / f"{shard.stem}.tsv"
+    limits = ["--threads", str(threads)]
+    if memory_limit_gb:
+        limits += ["--split-memory-limit", f"{max(1, int(memory_limit_gb * 1024))}M"]
+
+    run_commands([
+        wsl + [exe, "createdb", windows_to_wsl(shard), q_db],
+        wsl + [exe, "search", q_db, t_db, res_db, tmp] + SEARCH_PARAMS + ["-a"] + limits + search_args,
+        wsl + [exe, "convertalis", q_db, t_db, res_db, windows_to_wsl(shard_result),
+               "--format-output", FORMAT, "--format-mode", "4", "--threads", str(threads)],
+    ], f"mmseqs_exons_{shard.stem}")
+    shutil.rmtree(shard_tmp, ignore_errors=True)
+    shard.unlink()
+    return shard_result
+
+
+def lift_hits(shard_results: list, chroms: np.ndarray, offsets: np.ndarray):
+    """Reads the shard TSVs and lifts the hits to chromosome coordinates.
+    Returns (header, rows, table) with rows as field lists and table as NumPy columns of the lifted hits."""
+    header = FORMAT.split(",")
+    rows = []
+    columns = {name: [] for name in ("query", "target", "tstart", "tend", "pident", "bits", "window")}
+    for shard_result in shard_results:
+        for header, table in read_tsv_chunks(shard_result):
+            window = np.array([int(t[1:]) for t in table["target"]], dtype=np.int64)
+            tstart = table["tstart"].astype(np.int64) + offsets[window]
+            tend = table["tend"].astype(np.int64) + offsets[window]
+            target = chroms[window]
+            t_col, s_col, e_col = header.index("target"), header.index("tstart"), header.index("tend")
+            for line, chrom, start, end in zip(table[LINE_COLUMN], target, tstart, tend):
+                fields = line.split("\t")
+                fields[t_col], fields[s_col], fields[e_col] = chrom, str(start), str(end)
+                rows.append(fields)
+            for name, values in (("query", table["query"]), ("target", target), ("tstart", tstart),
+                                 ("tend", tend), ("pident", table["pident"]), ("bits", table["bits"]),
+                                 ("window", window)):
+                columns[name].append(values)
+        shard_result.unlink()
+
+    if not rows:
+        return header, rows, {name: np.array([]) for name in columns}
+    table = {name: np.concatenate(values) for name, values in columns.items()}
+    return header, rows, table
+
+
+def overlap_duplicates(table: dict) -> np.ndarray:
+    """Boolean mask of the hits to keep: of two hits of the same query on the same chromosome and strand that overlap
+    on the chromosome but come from different windows, only the one with the higher bit score survives."""
+    n = len(table["query"])
+    keep = np.ones(n, dtype=bool)
+    if n == 0:
+        return keep
+    minus = table["tstart"] > table["tend"]
+    low = np.minimum(table["tstart"], table["tend"])
+    high = np.maximum(table["tstart"], table["tend"])
+
+    order = np.lexsort((low, minus, table["target"].astype(str), table["query"].astype(str)))
+    active = []   # kept hits of the current (query, chrom, strand) group that may still overlap
+    group = None
+    for i in order:
+        key = (table["query"][i], table["target"][i], minus[i])
+        if key != group:
+            group, active = key, []
+        active = [j for j in active if keep[j] and high[j] >= low[i]]
+        for j in active:
+            if table["window"][j] == table["window"][i]:
+                continue
+            # same hit seen in two overlapping windows
+            if table["bits"][i] > table["bits"][j]:
+                keep[j] = False
+            else:
+                keep[i] = False
+                break
+        if keep[i]:
+            active.append(i)
+    return keep
+
+
+def search_exons(query: Path, target: Path, out_dir: Path, exe: str = "mmseqs", threads: int = 0,
+                 parallel: int = 0, window_size: int = 5_000_000, overlap: int = 20_000,
+                 memory_limit_gb: float = 0, use_wsl: bool = False, search_args: list = None):
+    if overlap >= window_size:
+        raise ValueError("--overlap must be smaller than --window-size.")
+    threads = threads or os.cpu_count() or 1
+    wsl = ["wsl"] if use_wsl else []
+    out_dir.mkdir(parents=True, exist_ok=True)
+    work_dir = out_dir / "windows"
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    windows_fasta = work_dir / "target_windows.fasta"
+    chroms, offsets = write_windows(target, windows_fasta, window_size, overlap)
+    print(f"{len(set(chroms))} sequences cut into {len(chroms)} windows.")
+
+    # one target DB over all windows, shared read-only by every query shard: e-values on the scale of the whole genome
+    t_db = os.path.join(windows_to_wsl(work_dir), "targetDB")
+    run_commands([wsl + [exe, "createdb", windows_to_wsl(windows_fasta), t_db]], "mmseqs_exons")
+    windows_fasta.unlink()
+
+    shards = split_fasta(query, max(1, min(parallel or threads, threads)), work_dir)
+    parallel = max(1, len(shards))
+    threads_per_shard = max(1, threads // parallel)
+    print(f"Searching {len(shards)} query shards in parallel with {threads_per_shard} threads each.")
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        futures = [pool.submit(search_shard, wsl, exe, shard, t_db, threads_per_shard, memory_limit_gb / parallel,
+                               search_args or [])
+                   for shard in shards]
+        shard_results = [f.result() for f in futures]
+
+    header, rows, table = lift_hits(shard_results, chroms, offsets)
+    keep = overlap_duplicates(table)
+    print(f"{len(rows)} hits, {int((~keep).sum())} duplicates from window overlaps removed.")
+
+    kept = np.flatnonzero(keep)
+    # chromosome order, then position
+    kept = kept[np.lexsort((np.minimum(table["tstart"], table["tend"])[kept], table["target"][kept].astype(str)))] \
+        if len(kept) else kept
+    with open(out_dir / "exon_hits.tsv", "w") as out:
+        out.write("\t".join(header) + "\n")
+        for i in kept:
+            out.write("\t".join(rows[i]) + "\n")
+    write_bed({name: values[kept] for name, values in table.items()}, out_dir / "exon_hits.bed")
+    shutil.rmtree(work_dir, ignore_errors=True)
+    print(f"Results written to {out_dir / 'exon_hits.tsv'} and {out_dir / 'exon_hits.bed'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Windowed, parallel MMseqs2 search of exon queries against a genome.")
+    parser.add_argument("--query", required=True, help="Exon (protein) query FASTA.")
+    parser.add_argument("--target", required=True, help="Genome FASTA (plain or .gz).")
+    parser.add_argument("--out", required=True, help="Output folder.")
+    parser.add_argument("--exe", default="mmseqs", help="MMseqs2 executable (default: mmseqs).")
+    parser.add_argument("--wsl", action="store_true", help="Run MMseqs2 through WSL (as pipelineMMSeqs.py).")
+    parser.add_argument("--threads", type=int, default=0, help="Core budget (default: all cores).")
+    parser.add_argument("--parallel", type=int, default=0,
+                        help="Query shards searched at once (default: one per core).")
+    parser.add_argument("--window-size", type=int, default=5_000_000, help="Window length in bases (default: 5 Mb).")
+    parser.add_argument("--overlap", type=int, default=20_000, help="Overlap of neighbouring windows (default: 20 kb).")
+    parser.add_argument("--memory-limit-gb", type=float, default=0,
+                        help="Total --split-memory-limit shared by the parallel searches (default: no limit).")
+    parser.add_argument("--search-args", default="", help="Extra arguments for mmseqs search, e.g. \"-e 1e-3\".")
+    args = parser.parse_args()
+
+    query, target = Path(args.query).resolve(), Path(args.target).resolve()
+    for path in (query, target):
+        if not path.exists():
+            print(f"File not found: {path}"); sys.exit(1)
+    try:
+        search_exons(query, target, Path(args.out).resolve(), args.exe, args.threads, args.parallel,
+                     args.window_size, args.overlap, args.memory_limit_gb, args.wsl,
+                     args.search_args.split())
+    except subprocess.CalledProcessError:
+        print("MMseqs2 exon search failed.")
+        sys.exit(1)
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import argparse
+import json
+import re
+import sys
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+
+# Vectorized replacement for the AWK one-liners in mmseqsfiltering.sh.
+# Reads the header-aware convertalis TSV (--format-mode 4) written by pipelineMMSeqs.mmseqs_search in chunks of
+# --chunk-rows lines, turns every chunk into columnar NumPy arrays and applies all thresholds in one vectorized pass.
+# Best-hit reductions (per query or per target) are merged chunk by chunk, so the file is read exactly once and only
+# the surviving rows are held in memory.
+# Outputs (any combination): filtered TSV (header kept), 6-column BED, hit_ids list for pipelineEMBEDDER.py
+#
+# Usage example:
+#   python mmseqs_filter.py -i data/mmseqs_results.tsv --evalue-max 1e-5 --pident-min 35 --qcov-min 0.6 \
+#       --best-per target -o data/mmseqs_hiconf.tsv --hit-ids data/mmseqs_hits.txt
+# Without -i the "result" path of the "mmseqs" section in config.json is used.
+
+# columns of convertalis --format-output that hold numbers, everything else is kept as text
+NUMERIC_COLUMNS = {
+    "evalue", "pident", "fident", "nident", "alnlen", "mismatch", "gapopen", "raw", "bits",
+    "qstart", "qend", "tstart", "tend", "qlen", "tlen", "qcov", "tcov", "qframe", "tframe", "taxid",
+}
+
+LINE_COLUMN = "__line__"
+# columns read by write_bed / write_hit_ids
+BED_COLUMNS = ["target", "query", "tstart", "tend", "pident"]
+HIT_ID_COLUMNS = ["target"]
+
+
+def read_tsv_chunks(tsv_path, chunk_rows: int = 1_000_000):
+    """Yields (header, table) per chunk; table maps column name -> NumPy array plus the raw lines under LINE_COLUMN."""
+    with open(tsv_path, "r") as f:
+        header_line = f.readline().rstrip("\r\n")
+        if not header_line:
+            return
+        header = header_line.split("\t")
+        while True:
+            lines = [line.rstrip("\r\n") for line in islice(f, chunk_rows)]
+            lines = [line for line in lines if line]
+            if not lines:
+                break
+            yield header, lines_to_table(header, lines)
+
+
+def lines_to_table(header: list, lines: list) -> dict:
+    fields = np.array([line.split("\t") for line in lines], dtype=str)
+    if fields.ndim != 2 or fields.shape[1] != len(header):
+        raise ValueError(f"Expected {len(header)} tab separated columns per row, found malformed rows.")
+
+    table = {LINE_COLUMN: np.array(lines, dtype=object)}
+    for i, name in enumerate(header):
+        column = fields[:, i]
+        table[name] = column.astype(np.float64) if name in NUMERIC_COLUMNS else column
+    return table
+
+
+def table_size(table: dict) -> int:
+    return len(table[LINE_COLUMN])
+
+
+def take(table: dict, selection) -> dict:
+    return {name: column[selection] for name, column in table.items()}
+
+
+def select(table: dict, columns: list) -> dict:
+    """The raw lines plus those of the columns that the table has (missing ones are reported by require later)."""
+    return {name: table[name] for name in [LINE_COLUMN] + columns if name in table}
+
+
+def concat(first: dict, second: dict) -> dict:
+    if first is None:
+        return second
+    return {name: np.concatenate([first[name], second[name]]) for name in first}
+
+
+def require(table: dict, *columns):
+    missing = [c for c in columns if c not in table]
+    if missing:
+        raise KeyError(f"Filter needs column(s) {', '.join(missing)} which are not in the TSV header.")
+
+
+def filter_mask(table: dict, args) -> np.ndarray:
+    """Combines every threshold given on the command line into one boolean mask."""
+    mask = np.ones(table_size(table), dtype=bool)
+    # thresholds are always fractions, percent columns are scaled down to match
+    coverage_scale = 100.0 if args.coverage_percent else 1.0
+
+    if args.evalue_max is not None:
+        require(table, "evalue")
+        mask &= table["evalue"] <= args.evalue_max
+    if args.pident_min is not None:
+        require(table, "pident")
+        mask &= table["pident"] >= args.pident_min
+    if args.alnlen_min is not None:
+        require(table, "alnlen")
+        mask &= table["alnlen"] >= args.alnlen_min
+    if args.qcov_min is not None:
+        require(table, "qcov")
+        mask &= table["qcov"] / coverage_scale >= args.qcov_min
+    if args.tcov_min is not None:
+        require(table, "tcov")
+        mask &= table["tcov"] / coverage_scale >= args.tcov_min
+    if args.query_aln_frac_min is not None:
+        require(table, "alnlen", "qlen")
+        mask &= table["alnlen"] >= args.query_aln_frac_min * table["qlen"]
+    if args.target_aln_frac_min is not None:
+        require(table, "alnlen", "tlen")
+        mask &= table["alnlen"] >= args.target_aln_frac_min * table["tlen"]
+    if args.strand is not None:
+        require(table, "tstart", "tend")
+        plus = table["tstart"] <= table["tend"]
+        mask &= plus if args.strand == "+" else ~plus
+    if args.target_regex is not None:
+        require(table, "target")
+        pattern = re.compile(args.target_regex)
+        mask &= np.fromiter((pattern.search(t) is not None for t in table["target"]), dtype=bool, count=table_size(table))
+    if args.no_self:
+        require(table, "query", "target")
+        mask &= table["query"] != table["target"]
+    return mask
+
+
+def best_per(table: dict, key: str) -> dict:
+    """Keeps the single best row per key: lowest evalue, ties broken by highest pident."""
+    require(table, key, "evalue")
+    pident = table["pident"] if "pident" in table else np.zeros(table_size(table))
+    order = np.lexsort((-pident, table["evalue"], table[key]))
+    keys = table[key][order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    return take(table, np.sort(order[first]))
+
+
+def write_tsv(table: dict, header: list, output_path):
+    with open(output_path, "w") as out:
+        out.write("\t".join(header) + "\n")
+        for line in table[LINE_COLUMN]:
+            out.write(line + "\n")
+
+
+def write_bed(table: dict, output_path):
+    """chrom start end name score strand; tstart/tend are 1-based, score is pident mapped to 0..1000."""
+    require(table, "target", "query", "tstart", "tend", "pident")
+    start, end = table["tstart"], table["tend"]
+    minus = start > end
+    start0 = np.where(minus, end, start).astype(np.int64) - 1
+    end1 = np.where(minus, start, end).astype(np.int64)
+    score = np.minimum((table["pident"] / 100 * 1000).astype(np.int64), 1000)
+    strand = np.where(minus, "-", "+")
+    with open(output_path, "w") as out:
+        for row in zip(table["target"], start0, end1, table["query"], score, strand):
+            out.write("\t".join(map(str, row)) + "\n")
+
+
+def write_hit_ids(table: dict, output_path):
+    """Unique target IDs in order of first appearance, one per line (hit_ids input of pipelineEMBEDDER.py)."""
+    require(table, "target")
+    _, first_index = np.unique(table["target"], return_index=True)
+    with open(output_path, "w") as out:
+        for target in table["target"][np.sort(first_index)]:
+            out.write(f"{target}\n")
+
+
+def filter_results(args) -> dict:
+    header = None
+    kept = None
+    total = 0
+    passed = 0
+    tsv_out = open(args.output, "w") if args.output and args.best_per is None else None
+    retained = (BED_COLUMNS if args.bed else []) + (HIT_ID_COLUMNS if args.hit_ids else [])
+
+    try:
+        for header, chunk in read_tsv_chunks(args.input, args.chunk_rows):
+            total += table_size(chunk)
+            chunk = take(chunk, filter_mask(chunk, args))
+            passed += table_size(chunk)
+            if args.best_per is not None:
+                # merge the current winners with this chunk and reduce again, memory stays bounded by #keys
+                kept = best_per(concat(kept, chunk), args.best_per)
+                continue
+            if tsv_out is not None:
+                if tsv_out.tell() == 0:
+                    tsv_out.write("\t".join(header) + "\n")
+                for line in chunk[LINE_COLUMN]:
+                    tsv_out.write(line + "\n")
+            # BED/hit_ids need the kept rows; only the lines and the used columns are retained
+            if args.bed or args.hit_ids:
+                kept = concat(kept, select(chunk, retained))
+    finally:
+        if tsv_out is not None:
+            tsv_out.close()
+
+    if header is None:
+        print(f"No results found in {args.input}.")
+        return {}
+    if kept is None:
+        kept = {name: np.array([], dtype=object) for name in [LINE_COLUMN] + header}
+
+    if args.output and args.best_per is not None:
+        write_tsv(kept, header, args.output)
+    if args.bed:
+        write_bed(kept, args.bed)
+    if args.hit_ids:
+        write_hit_ids(kept, args.hit_ids)
+
+    print(f"{passed} of {total} rows passed the thresholds.")
+    if args.best_per is not None:
+        print(f"{table_size(kept)} rows kept as best hit per {args.best_per}.")
+    return kept
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Filter MMseqs2 convertalis TSV results (vectorized, single pass).")
+    parser.add_argument("-i", "--input", help="MMseqs TSV with header row (default: mmseqs.result from the config).")
+    parser.add_argument("-c", "--config", default="config.json", help="Config used when -i is not given.")
+    parser.add_argument("-o", "--output", help="Filtered TSV output.")
+    parser.add_argument("--bed", help="BED6 output (target as chrom, tstart/tend as coordinates).")
+    parser.add_argument("--hit-ids", help="Output list of unique target IDs for the embedder.")
+    parser.add_argument("--chunk-rows", type=int, default=1_000_000, help="Rows parsed per chunk (default: 1000000).")
+
+    parser.add_argument("--evalue-max", type=float)
+    parser.add_argument("--pident-min", type=float)
+    parser.add_argument("--alnlen-min", type=float)
+    parser.add_argument("--qcov-min", type=float, help="Minimum query coverage as fraction (0..1).")
+    parser.add_argument("--tcov-min", type=float, help="Minimum target coverage as fraction (0..1).")
+    parser.add_argument("--coverage-percent", action="store_true",
+                        help="qcov/tcov columns are stored as 0..100 percentages instead of 0..1 fractions.")
+    parser.add_argument("--query-aln-frac-min", type=float, help="Minimum alnlen/qlen.")
+    parser.add_argument("--target-aln-frac-min", type=float, help="Minimum alnlen/tlen.")
+    parser.add_argument("--strand", choices=["+", "-"], help="Keep only plus (tstart<=tend) or minus strand hits.")
+    parser.add_argument("--target-regex", help="Keep only targets matching this regular expression (e.g. '^(chr|scaffold_)').")
+    parser.add_argument("--no-self", action="store_true", help="Remove hits where query == target.")
+    parser.add_argument("--best-per", choices=["query", "target"], help="Keep only the best hit per query or target.")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+
+    if args.input is None:
+        with open(args.config, "r") as f:
+            args.input = json.load(f)["mmseqs"]["result"]
+    if not Path(args.input).exists():
+        print(f"Result file not found: {args.input}"); sys.exit(1)
+    if not (args.output or args.bed or args.hit_ids):
+        print("Nothing to write, give at least one of -o, --bed, --hit-ids."); sys.exit(1)
+
+    try:
+        filter_results(args)
+    except (KeyError, ValueError) as e:
+        print(f"Filtering failed: {e}"); sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
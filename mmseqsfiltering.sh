@@ -3,6 +3,7 @@
 # AI generated helper file to retrieve command lines for filtering the mmseqs results
 # Those were basically the commands used, changing and altering the parameters as needed depending on use case
 # Not automatized as depending on the search only certain filters or outputs made sense, all were then run manually as needed
+# The same filters are available as one vectorized, single-pass Python tool: python mmseqs_filter.py --help
 
 # mmseqs_filters.sh
 # A grab‑bag of AWK one‑liners to filter MMseqs2 convertalis TSV outputs.
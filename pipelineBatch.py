@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from EMBEDsupplementary.fasta_io import count_records
+from run_metrics import run_measured, set_run_report
+
+# Batch driver: FAMSA + IQ-TREE for many gene families at once.
+# Families come from the command line (FASTA files) or from "batch": {"inputs": [...]} in config.json; the FAMSA and
+# IQ-TREE executables are taken from the "famsa"/"iqtree" sections. Families run concurrently under a global core
+# budget ("cores", default: all cores). Each family gets a thread share proportional to its input size (larger
+# alignments get more threads, at least 1) and the largest families are started first.
+# Per family the outputs go to <output_dir>/<family>/ (alignment, IQ-TREE files, log) and a summary of all families
+# is written to <output_dir>/batch_summary.tsv. FAMSA and IQ-TREE runs are recorded in the run report ("run_report")
+# as stages famsa_<family> and iqtree_<family>.
+#
+# Usage example:
+#   python pipelineBatch.py data/families/*.fasta --cores 32 --output-dir batch_out
+
+class CoreBudget:
+    """Counting semaphore over CPU cores: a job blocks until the number of cores it asked for is free."""
+
+    def __init__(self, cores: int):
+        self.cores = cores
+        self.free = cores
+        self.condition = threading.Condition()
+
+    def acquire(self, n: int):
+        n = min(n, self.cores)
+        with self.condition:
+            self.condition.wait_for(lambda: self.free >= n)
+            self.free -= n
+        return n
+
+    def release(self, n: int):
+        with self.condition:
+            self.free += n
+            self.condition.notify_all()
+
+def thread_shares(sizes: dict, cores: int) -> dict:
+    """Splits the core budget proportionally to input size, every family gets at least one thread."""
+    total = sum(sizes.values()) or 1
+    return {name: max(1, min(cores, round(cores * size / total))) for name, size in sizes.items()}
+
+def run_logged(cmd: list, stage: str, log):
+    log.write("Running: " + " ".join(cmd) + "\n")
+    log.flush()
+    returncode = run_measured(cmd, stage, stdout=log, stderr=subprocess.STDOUT)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+
+def best_model_from_report(iqtree_report: Path):
+    if not iqtree_report.exists():
+        return None
+    match = re.search(r"Best-fit model according to \w+:\s+(\S+)", iqtree_report.read_text())
+    return match.group(1) if match else None
+
+def run_family(name: str, input_fasta: Path, family_dir: Path, threads: int, budget: CoreBudget, config: dict) -> dict:
+    famsa_exe = config["famsa"]["exe"]
+    iqtree_exe = config["iqtree"]["exe"]
+    compaction = config.get("compaction", {})
+    family_dir.mkdir(parents=True, exist_ok=True)
+    alignment = family_dir / f"{name}_alignment.fasta"
+    summary = {"family": name, "sequences": count_records(input_fasta), "threads": threads, "status": "ok",
+               "famsa_seconds": None, "iqtree_seconds": None, "best_model": None, "treefile": None}
+
+    threads = budget.acquire(threads)
+    try:
+        with open(family_dir / f"{name}.log", "w") as log:
+            start = time.perf_counter()
+            run_logged([str(famsa_exe), "-t", str(threads), str(input_fasta), str(alignment)], f"famsa_{name}", log)
+            summary["famsa_seconds"] = round(time.perf_counter() - start, 2)
+
+            tree_input = alignment
+            if compaction.get("enabled", False):
+                from pipelineCompaction import compact_alignment, compacted_path
+                tree_input = compacted_path(alignment, {})
+                compact_alignment(alignment, tree_input, float(compaction.get("max_gap_fraction", 0.9)))
+
+            prefix = family_dir / name
+            start = time.perf_counter()
+            run_logged([str(iqtree_exe), "-s", str(tree_input), "-m", "MFP", "-B", "1000",
+                        "-T", str(threads), "--prefix", str(prefix), "-redo"], f"iqtree_{name}", log)
+            summary["iqtree_seconds"] = round(time.perf_counter() - start, 2)
+
+            treefile = Path(str(prefix) + ".treefile")
+            if compaction.get("enabled", False):
+                from pipelineCompaction import expand_tree
+                expanded = Path(str(prefix) + ".expanded.treefile")
+                expand_tree(treefile, Path(str(tree_input) + ".duplicates.json"), expanded)
+                treefile = expanded
+            summary["best_model"] = best_model_from_report(Path(str(prefix) + ".iqtree"))
+            summary["treefile"] = str(treefile)
+    except subprocess.CalledProcessError as e:
+        summary["status"] = f"failed ({Path(e.cmd[0]).name} exit code {e.returncode})"
+    except (OSError, ValueError) as e:
+        summary["status"] = f"failed ({e})"
+    finally:
+        budget.release(threads)
+
+    print(f"[BATCH] {name}: {summary['status']}")
+    return summary
+
+def write_summary(summaries: list, summary_path: Path):
+    columns = ["family", "status", "sequences", "threads", "famsa_seconds", "iqtree_seconds", "best_model", "treefile"]
+    with open(summary_path, "w") as out:
+        out.write("\t".join(columns) + "\n")
+        for summary in summaries:
+            out.write("\t".join("" if summary[c] is None else str(summary[c]) for c in columns) + "\n")
+
+def batch(inputs: list, output_dir: Path, cores: int, config: dict) -> list:
+    inputs = [Path(p) for p in inputs]
+    missing = [str(p) for p in inputs if not p.exists()]
+    if missing:
+        print(f"Input not found: {', '.join(missing)}"); sys.exit(1)
+
+    families = {p.stem: p for p in inputs}
+    if len(families) != len(inputs):
+        print("Family inputs must have distinct file names."); sys.exit(1)
+    shares = thread_shares({name: p.stat().st_size for name, p in families.items()}, cores)
+    budget = CoreBudget(cores)
+    order = sorted(families, key=lambda name: families[name].stat().st_size, reverse=True)
+    print(f"[BATCH] {len(families)} families, {cores} cores")
+
+    # one worker per family, the core budget decides how many actually run at the same time
+    with ThreadPoolExecutor(max_workers=len(order) or 1) as pool:
+        futures = [pool.submit(run_family, name, families[name], output_dir / name, shares[name], budget, config)
+                   for name in order]
+        summaries = [f.result() for f in futures]
+
+    summary_path = output_dir / "batch_summary.tsv"
+    write_summary(summaries, summary_path)
+    print(f"[BATCH] Summary written to {summary_path}")
+    return summaries
+
+def main():
+    parser = argparse.ArgumentParser(description="Run FAMSA + IQ-TREE for many gene families concurrently.")
+    parser.add_argument("inputs", nargs="*", help="Family FASTA files (default: batch.inputs from the config).")
+    parser.add_argument("-c", "--config", default="config.json", help="Path to the JSON configuration file.")
+    parser.add_argument("--cores", type=int, help="Global core budget (default: batch.cores or all cores).")
+    parser.add_argument("--output-dir", help="Output directory (default: batch.output_dir or batch_out).")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = json.load(f)
+    settings = config.get("batch", {})
+    set_run_report(config.get("run_report"))
+
+    inputs = args.inputs or settings.get("inputs", [])
+    if not inputs:
+        print("No family inputs given."); sys.exit(1)
+    cores = args.cores or int(settings.get("cores") or os.cpu_count() or 1)
+    output_dir = Path(args.output_dir or settings.get("output_dir") or "batch_out")
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    summaries = batch(inputs, output_dir, cores, config)
+    if any(s["status"] != "ok" for s in summaries):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import json
+import re
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Alignment compaction between FAMSA and IQ-TREE.
+# The FAMSA alignment is loaded into a NumPy character matrix (sequences x columns), then
+#   1) identical aligned sequences are collapsed to their first occurrence (mapping saved as <output>.duplicates.json)
+#   2) all-gap columns and columns with a gap fraction above "max_gap_fraction" are dropped
+# and the compression is reported. pipelineTreePart.py runs IQ-TREE on the compacted alignment when
+# "compaction": {"enabled": true} is set and re-expands the collapsed duplicates on the final tree with expand_tree().
+
+GAP_CHARS = np.frombuffer(b"-.", dtype=np.uint8)
+
+def read_alignment(fasta: Path):
+    """Returns (names, headers, matrix); names are the first header word (what IQ-TREE uses as leaf label)."""
+    headers = []
+    sequences = []
+    with open(fasta, "r") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if line.startswith(">"):
+                headers.append(line[1:])
+                sequences.append([])
+            elif line:
+                sequences[-1].append(line)
+    sequences = ["".join(parts) for parts in sequences]
+    lengths = {len(s) for s in sequences}
+    if len(lengths) > 1:
+        raise ValueError(f"{fasta} is not an alignment, sequence lengths differ: {sorted(lengths)[:5]}")
+    names = [h.split()[0] if h.strip() else "" for h in headers]
+    matrix = np.frombuffer("".join(sequences).encode("ascii"), dtype=np.uint8).reshape(len(sequences), -1)
+    return names, headers, matrix
+
+def write_alignment(fasta: Path, headers: list, matrix: np.ndarray, width: int = 60):
+    with open(fasta, "w") as out:
+        for header, row in zip(headers, matrix):
+            seq = row.tobytes().decode("ascii")
+            out.write(f">{header}\n")
+            for i in range(0, len(seq), width):
+                out.write(seq[i:i + width] + "\n")
+
+def compact_alignment(alignment_fasta: Path, output_fasta: Path, max_gap_fraction: float = 0.9) -> dict:
+    names, headers, matrix = read_alignment(alignment_fasta)
+    n_seqs, n_cols = matrix.shape
+
+    # identical rows -> keep the first occurrence of every distinct row, in input order
+    _, first_index, inverse = np.unique(matrix, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    representatives = np.sort(first_index)
+    duplicates = {}
+    for row, group in enumerate(inverse):
+        rep = first_index[group]
+        if row != rep:
+            duplicates.setdefault(names[rep], []).append(names[row])
+    unique_matrix = matrix[representatives]
+
+    # gap-dominated columns, measured on the sequences that actually go into the tree
+    gap_fraction = np.isin(unique_matrix, GAP_CHARS).mean(axis=0)
+    keep_columns = (gap_fraction < 1.0) & (gap_fraction <= max_gap_fraction)
+    compact = np.ascontiguousarray(unique_matrix[:, keep_columns])
+
+    write_alignment(output_fasta, [headers[i] for i in representatives], compact)
+    mapping_path = Path(str(output_fasta) + ".duplicates.json")
+    with open(mapping_path, "w") as f:
+        json.dump(duplicates, f, indent=2)
+
+    report = {
+        "sequences_before": int(n_seqs),
+        "sequences_after": int(compact.shape[0]),
+        "columns_before": int(n_cols),
+        "columns_after": int(compact.shape[1]),
+        "cells_ratio": float(compact.size / matrix.size) if matrix.size else 1.0,
+    }
+    print(f"Sequences: {report['sequences_before']} -> {report['sequences_after']} "
+          f"({n_seqs - compact.shape[0]} identical collapsed)")
+    print(f"Columns:   {report['columns_before']} -> {report['columns_after']} "
+          f"({n_cols - compact.shape[1]} gap-dominated dropped)")
+    print(f"Alignment size reduced to {report['cells_ratio']:.1%} of the original.")
+    return report
+
+def expand_tree(treefile: Path, mapping_path: Path, output_treefile: Path):
+    """Replaces every representative leaf by a zero-length polytomy of itself and its collapsed duplicates."""
+    with open(mapping_path, "r") as f:
+        duplicates = json.load(f)
+    with open(treefile, "r") as f:
+        newick = f.read().strip()
+
+    def expand(match):
+        label = match.group(1)
+        if label not in duplicates:
+            return label
+        return "(" + ",".join(f"{name}:0.0" for name in [label] + duplicates[label]) + ")"
+
+    # leaf labels follow '(' or ',' and end at ':' ',' ')' (support values follow ')' and are not touched)
+    expanded = re.sub(r"(?<=[(,])([^(),:;]+)(?=[:,);])", expand, newick)
+    with open(output_treefile, "w") as f:
+        f.write(expanded + "\n")
+    print(f"Expanded tree with collapsed duplicates written to {output_treefile}")
+
+def compacted_path(alignment_fasta: Path, compaction: dict) -> Path:
+    if compaction.get("output_fasta"):
+        return Path(compaction["output_fasta"])
+    return alignment_fasta.with_name(alignment_fasta.stem + "_compact" + alignment_fasta.suffix)
+
+def compaction(config_path="config.json"):
+    # Load JSON configuration
+    with open(config_path, "r") as f:
+        config = json.load(f)
+
+    alignment_fasta = Path(config["famsa"]["output_fasta"])
+    settings = config.get("compaction", {})
+    output_fasta = compacted_path(alignment_fasta, settings)
+
+    if not alignment_fasta.exists():
+        print(f"Alignment not found: {alignment_fasta}"); sys.exit(1)
+
+    try:
+        compact_alignment(alignment_fasta, output_fasta, float(settings.get("max_gap_fraction", 0.9)))
+    except ValueError as e:
+        print(f"Compaction failed: {e}"); sys.exit(1)
+    print(f"Compacted alignment written to {output_fasta}")
+
+if __name__ == "__main__":
+    # optional first argument: path to the config file (default: config.json)
+    compaction(sys.argv[1] if len(sys.argv) > 1 else "config.json")
@@ -6,6 +6,11 @@ from pathlib import Path
 import json
 import yaml
 import re
+import hashlib
+import shutil
+from EMBEDsupplementary.fasta_io import read_fasta_bytes
+from run_metrics import set_run_report
+from process_supervisor import configure, print_failure, run_concurrently, run_supervised
 
 # ------------------------------------------------------------------------------------------
 # This pipeline implementation is responsible for three actions (where each action is done continuously):
@@ -15,7 +20,21 @@ import re
 # -------------------------------------SCRIPT ARGUMENTS-------------------------------------
 # -c / --config <config.json>: path to the .json file with an "embedding" section which holds keys that are crucial for the setup of the pipeline
 # -o / --organism <organism_name>: Name of the target organism(case sensitive), given in double quotes, which be marked distinctively in the protspace output
+# --base-only: only clean and embed the base dataset into the embedding cache (stages 1 and 3), no hits are needed.
+#              Lets the expensive base embedding run in parallel to the MMseqs search (see pipelineOrchestrator.py)
+# --batch: compare several organisms in one run, taken from "organisms": [{"name", "hit_ids", "hit_organism_proteome"}]
+#          of the embedding section (optional "color"/"shape" per organism). The base dataset is cleaned once, the hits
+#          of all organisms are extracted concurrently and embedded together, and one protspace output holds them all,
+#          each organism with its own color and marker. Works in <workflow_file_name>_batch_embedding_dir.
+# Reruns with the same workflow_file_name resume the existing workflow directory: every stage stores a fingerprint of its
+# inputs, parameters and outputs in stage_checkpoints.json and is skipped while that fingerprint still matches
 #-------------------------------------- HELPER METHODS -------------------------------------
+# colors and markers of the organisms in visualization_state.json, the first one is the style of a single-organism run
+ORGANISM_COLORS = ["rgba(255, 64, 64, 0.9)", "rgba(32, 128, 255, 0.9)", "rgba(40, 170, 80, 0.9)",
+                   "rgba(255, 160, 0, 0.9)", "rgba(150, 70, 220, 0.9)", "rgba(0, 180, 180, 0.9)",
+                   "rgba(230, 60, 170, 0.9)", "rgba(120, 90, 40, 0.9)"]
+ORGANISM_SHAPES = ["x", "diamond", "cross", "square", "diamond-open", "square-open", "circle-open"]
+
 def exit_with_error(message: str):
     embed_print(f"(ERROR) {message}")
     sys.exit(1)
@@ -23,7 +42,7 @@ def exit_with_error(message: str):
 def embed_print(message: str):
     print(f"[EMBED]{message}")
 
-def setup_yml_file(sequence_file: str, prefix: str, protocol: str, path_to_save: str):
+def setup_yml_file(sequence_file: str, prefix: str, protocol: str, path_to_save: str, device: str = "cuda"):
     """Create YAML config for bio_embeddings."""
     config = {
         "global": {
@@ -35,7 +54,7 @@ def setup_yml_file(sequence_file: str, prefix: str, protocol: str, path_to_save:
             "type": "embed",
             "protocol": protocol,
             "reduce": True,
-            "device": "cuda",
+            "device": device,
         },
     }
     with open(path_to_save, "w") as output:
@@ -45,50 +64,167 @@ def find_python_executable(path: Path) -> Path:
     """Finds Python executable in given virtual environment path."""
     return path / "bin" / "python"
 
-def check_package_in_env(env_path: Path, package: str) -> bool:
-    """Checks if a package is installed inside a specific virtual environment."""
+def env_mtime(env_path: Path) -> int:
+    """Latest change of the environment: the env folder, conda-meta and site-packages change on every (un)install."""
+    candidates = [env_path, env_path / "conda-meta"] + list(env_path.glob("lib/python*/site-packages"))
+    return max((p.stat().st_mtime_ns for p in candidates if p.exists()), default=0)
+
+def check_package_in_env(env_path: Path, package: str, probe_cache: Path = None) -> bool:
+    """Checks if a package is installed inside a specific virtual environment.
+    With probe_cache the result is kept per env path + package and reused until the environment changes."""
     python_exec = find_python_executable(env_path)
     if not python_exec.exists():
         embed_print(f" Environment not found at {env_path}")
         return False
-    try:
-        subprocess.run(
+
+    key = f"{env_path.resolve()}::{package}"
+    mtime = env_mtime(env_path)
+    cached = {}
+    if probe_cache is not None and probe_cache.exists():
+        try:
+            with open(probe_cache, "r") as f:
+                cached = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            cached = {}
+    if cached.get(key, {}).get("mtime_ns") == mtime:
+        installed = cached[key]["installed"]
+    else:
+        installed = subprocess.run(
             [str(python_exec), "-c", f"import {package}"],
-            check=True,
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL
-        )
+        ).returncode == 0
+        if probe_cache is not None:
+            cached[key] = {"mtime_ns": mtime, "installed": installed}
+            tmp_path = probe_cache.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(cached, f, indent=2)
+            os.replace(tmp_path, probe_cache)
+
+    if installed:
         embed_print(f"'{package}' is installed in environment: {env_path}")
-        return True
-    except subprocess.CalledProcessError:
+    else:
         embed_print(f"'{package}' is NOT installed in environment: {env_path}")
-        return False
+    return installed
+
+
+def organism_slug(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+
+def protein_id(header: str) -> str:
+    """UniProt ID of a header or hit ID line, parsed as extract_hits_and_append.parse_protein_id() does."""
+    header = header.lstrip(">").strip()
+    parts = header.split("|")
+    if len(parts) > 1:
+        return parts[1].strip()
+    return header.split()[0] if header else ""
+
+def shared_hit_ids(organisms: list, base_dataset_file: str) -> list:
+    """Messages for hit IDs listed by more than one organism or already in the base dataset; merged into one dataset
+    they would give duplicate headers (and an ambiguous species)."""
+    owners = {}
+    for organism in organisms:
+        with open(organism["hit_ids"], "r") as f:
+            for uid in {protein_id(line) for line in f if line.strip()}:
+                owners.setdefault(uid, []).append(organism["name"])
+    problems = [f"{uid} ({', '.join(names)})" for uid, names in owners.items() if len(names) > 1]
+    for header, _ in read_fasta_bytes(base_dataset_file):
+        uid = protein_id(header.decode("utf-8", errors="replace"))
+        if uid in owners:
+            problems.append(f"{uid} ({', '.join(owners[uid])} and the base dataset)")
+    return problems
+
+def concatenate_files(parts: list, output_file: Path):
+    """Concatenates FASTA/ID files, every part starts on its own line."""
+    with open(output_file, "wb+") as out:
+        for part in parts:
+            with open(part, "rb") as f:
+                shutil.copyfileobj(f, out)
+            if out.tell() > 0:
+                out.seek(-1, os.SEEK_END)
+                if out.read(1) != b"\n":
+                    out.write(b"\n")
+
+def visualization_state(organisms: list) -> dict:
+    """Custom protspace styling that sets the hits of every organism apart from the base dataset proteins."""
+    state = {"feature_colors": {"species": {}}, "marker_shape": {"species": {}}}
+    for i, organism in enumerate(organisms):
+        state["feature_colors"]["species"][organism["name"]] = \
+            organism.get("color") or ORGANISM_COLORS[i % len(ORGANISM_COLORS)]
+        state["marker_shape"]["species"][organism["name"]] = \
+            organism.get("shape") or ORGANISM_SHAPES[i % len(ORGANISM_SHAPES)]
+    return state
+
+
+def run_and_prefix(command, prefix="[EMBED]",rx = None, stage=None):
+    """Run a subprocess under the process supervisor and print its lines (only those matching rx if given) with a prefix.
+    The full output goes to the stage log, its metrics to the run report under `stage`."""
+    result = run_supervised(command, stage or Path(command[0]).name, echo=rx or "all", prefix=prefix)
+    if result["status"] != "ok":
+        print_failure(result, prefix)
+        raise subprocess.CalledProcessError(result["returncode"], command)
+
+
+#-------------------------------------- STAGE CHECKPOINTS ------------------------------------------------------
+
+def path_fingerprint(path) -> list:
+    """Size and modification time of a file, or of every file below a directory. None if the path does not exist."""
+    path = Path(path)
+    if path.is_dir():
+        return sorted(
+            [str(p.relative_to(path)), p.stat().st_size, p.stat().st_mtime_ns]
+            for p in path.rglob("*") if p.is_file()
+        )
+    if path.is_file():
+        stat = path.stat()
+        return [stat.st_size, stat.st_mtime_ns]
+    return None
+
+def stage_fingerprint(inputs: list, params: dict) -> str:
+    """Hash over the state of all stage inputs and the stage parameters."""
+    state = {
+        "inputs": {str(p): path_fingerprint(p) for p in inputs},
+        "params": params,
+    }
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode("utf-8")).hexdigest()
 
+def load_checkpoints(checkpoint_path: Path) -> dict:
+    if not checkpoint_path.exists():
+        return {}
+    try:
+        with open(checkpoint_path, "r") as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        embed_print(f" Checkpoint file {checkpoint_path} is corrupt, all stages will be rerun.")
+        return {}
+
+def save_checkpoints(checkpoint_path: Path, checkpoints: dict):
+    tmp_path = checkpoint_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoints, f, indent=2)
+    os.replace(tmp_path, checkpoint_path)
+
+def stage_is_current(checkpoints: dict, stage: str, fingerprint: str, outputs: list) -> bool:
+    """A stage is current if its input/parameter fingerprint is unchanged and its outputs are exactly as it left them."""
+    record = checkpoints.get(stage)
+    if record is None or record.get("fingerprint") != fingerprint:
+        return False
+    current_outputs = {str(p): path_fingerprint(p) for p in outputs}
+    if any(fp is None for fp in current_outputs.values()):
+        return False
+    return record.get("outputs") == current_outputs
 
-def run_and_prefix(command, prefix="[EMBED]",rx = None):
-    """Run a subprocess and prefix its stdout/stderr lines."""
-    pattern = ''
-    if rx is not None:
-        pattern = re.compile(rx)
-    process = subprocess.Popen(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1,
-        universal_newlines=True
-    )
-
-    for line in process.stdout:
-        if rx is not None:
-            if pattern.match(line):
-                print(f"{prefix}{line.rstrip()}")
-        else:
-            print(f"{prefix}{line.rstrip()}")
+def start_stage(checkpoint_path: Path, checkpoints: dict, stage: str):
+    """Drops the record of a stage before it (re)runs, so a failure leaves it marked as stale."""
+    if checkpoints.pop(stage, None) is not None:
+        save_checkpoints(checkpoint_path, checkpoints)
 
-    process.wait()
-    if process.returncode != 0:
-        raise subprocess.CalledProcessError(process.returncode, command)
+def finish_stage(checkpoint_path: Path, checkpoints: dict, stage: str, fingerprint: str, outputs: list):
+    checkpoints[stage] = {
+        "fingerprint": fingerprint,
+        "outputs": {str(p): path_fingerprint(p) for p in outputs},
+    }
+    save_checkpoints(checkpoint_path, checkpoints)
 
 
 #-------------------------------------- MAIN PIPELINE ----------------------------------------------------------
@@ -96,8 +232,14 @@ def run_and_prefix(command, prefix="[EMBED]",rx = None):
 def main():
     parser = argparse.ArgumentParser(description="Protein embedding pipeline.")
     parser.add_argument("-c", "--config", required=True, help="Path to the JSON configuration file.")
-    parser.add_argument("-o", "--organism_name", required=True, help="Organism name.")
+    parser.add_argument("-o", "--organism_name", help="Organism name.")
+    parser.add_argument("--base-only", action="store_true", help="Only embed the base dataset into the embedding cache.")
+    parser.add_argument("--batch", action="store_true", help="Run all organisms of 'embedding.organisms' together.")
     args = parser.parse_args()
+    if not args.base_only and not args.batch and not args.organism_name:
+        parser.error("-o/--organism_name is required unless --base-only or --batch is given.")
+    if args.base_only and args.batch:
+        parser.error("--base-only and --batch cannot be combined.")
 
     config_path = Path(args.config)
     organism_name = str(args.organism_name)
@@ -131,6 +273,8 @@ def main():
         "protspace_methods",
         "protspace_features"
     ]
+    if args.batch:
+        required_keys = [key for key in required_keys if key not in ("hit_ids", "hit_organism_proteome")] + ["organisms"]
     missing_or_empty = [
         key for key in required_keys
         if key not in embedding_section or embedding_section[key] in (None, "", [])
@@ -138,77 +282,318 @@ def main():
     if missing_or_empty:
         exit_with_error(f"Missing or empty required keys in 'embedding': {', '.join(missing_or_empty)}")
 
+    if args.batch:
+        organisms = embedding_section["organisms"]
+        incomplete = [str(o.get("name", i)) for i, o in enumerate(organisms)
+                      if any(not o.get(key) for key in ("name", "hit_ids", "hit_organism_proteome"))]
+        if incomplete:
+            exit_with_error(f"Organisms without name, hit_ids or hit_organism_proteome: {', '.join(incomplete)}")
+        names = [o["name"] for o in organisms]
+        if len({organism_slug(name) for name in names}) != len(names):
+            exit_with_error("Organism names must be unique.")
+        shared = shared_hit_ids(organisms, embedding_section["base_dataset_file"])
+        if shared:
+            exit_with_error(f"{len(shared)} hit IDs belong to more than one organism or are already in the base "
+                            f"dataset, remove them from the hit lists: {', '.join(sorted(shared)[:20])}"
+                            f"{' ...' if len(shared) > 20 else ''}")
+        organism_name = ", ".join(names)
+    else:
+        organisms = [{"name": organism_name, "hit_ids": embedding_section.get("hit_ids"),
+                      "hit_organism_proteome": embedding_section.get("hit_organism_proteome")}]
+
+    set_run_report(config.get("run_report"))
     embed_print(f"Configuration loaded successfully for organism_name '{organism_name}'.")
 
     # ---------- CHECK ENVIRONMENTS AND PACKAGES ----------
+    # "embedding_backend": "bio_embeddings" (CLI, default), "cpu" (in-process ProtT5, EMBEDsupplementary/cpu_embedder.py)
+    # or "worker" (the same model kept resident between runs, EMBEDsupplementary/embedding_worker.py)
+    embedding_backend = embedding_section.get("embedding_backend", "bio_embeddings")
+    # probe results are cached per env path and reused until the environment changes (key "env_probe_cache")
+    probe_cache = Path(embedding_section.get("env_probe_cache") or
+                       Path(embedding_section["workflow_file_location"]) / "env_probe_cache.json")
+    probe_cache.parent.mkdir(parents=True, exist_ok=True)
     embed_env = Path(embedding_section["env_bio_embedding"])
-    if not check_package_in_env(embed_env, "bio_embeddings"):
+    embed_package = "transformers" if embedding_backend in ("cpu", "worker") else "bio_embeddings"
+    if not check_package_in_env(embed_env, embed_package, probe_cache):
         exit_with_error("Exiting Pipeline")
     protspace_env = Path(embedding_section["env_protspace"])
-    if not check_package_in_env(protspace_env, "protspace"):
+    if not check_package_in_env(protspace_env, "protspace", probe_cache):
         exit_with_error("Exiting Pipeline")
 
     # ---------- CREATE WORKFLOW DIRECTORY ----------
-    flow_dir_name = embedding_section["workflow_file_name"].lower() + "_embedding_dir"
+    flow_dir_name = embedding_section["workflow_file_name"].lower() + ("_batch" if args.batch else "") + "_embedding_dir"
     flow_dir_path = Path(embedding_section["workflow_file_location"]) / flow_dir_name
 
 
     if flow_dir_path.exists():
-        exit_with_error("Cannot create new File for the work flow, the specified file already exists.")
-    flow_dir_path.mkdir(parents=True, exist_ok=True)
-    embed_print(f"Workflow directory created under: {flow_dir_path}")
+        embed_print(f"Resuming workflow directory: {flow_dir_path}")
+    else:
+        flow_dir_path.mkdir(parents=True, exist_ok=True)
+        embed_print(f"Workflow directory created under: {flow_dir_path}")
+
+    # full tool logs (default: <workflow dir>/logs) and optional per-stage timeouts, see process_supervisor.py
+    configure(config.get("stage_log_dir") or flow_dir_path / "logs", config.get("stage_timeouts"))
+
+    checkpoint_path = flow_dir_path / "stage_checkpoints.json"
+    checkpoints = load_checkpoints(checkpoint_path)
 
     # ---------- STAGE 1: CLEAN HEADERS ----------
+    # only the base-only and batch runs need the cleaned base dataset on its own, the full run cleans it within stage 2
     cleaned_base_dataset_path = Path(flow_dir_path) /  "dataset_without_hits_cleaned.fasta"
-    try:
-        run_and_prefix(
-            [sys.executable, "EMBEDsupplementary/keep_protein_ids.py",
-             "-i", embedding_section["base_dataset_file"],
-             "-o", str(cleaned_base_dataset_path)])
-        embed_print("Successfully cleaned headers from the base dataset.")
-    except subprocess.CalledProcessError as e:
-        exit_with_error(f"Stage 1 failed: {e}")
-
-    # ---------- STAGE 2: EXTRACT AND APPEND HITS ----------
-    embed_ready_dataset_path = flow_dir_path / "embed_ready_dataset.fasta"
-    try:
-        run_and_prefix(
-            [sys.executable, "EMBEDsupplementary/extract_hits_and_append.py",
-             "-i", embedding_section["hit_ids"],
-             "-p", embedding_section["hit_organism_proteome"],
-             "-b", str(cleaned_base_dataset_path),
-             "-o", str(embed_ready_dataset_path)]
-        )
-        embed_print("Successfully extracted and appended hit proteins.")
-    except subprocess.CalledProcessError as e:
-        exit_with_error(f"Stage 2 failed: {e}")
+    if args.base_only or args.batch:
+        stage_inputs = [embedding_section["base_dataset_file"], "EMBEDsupplementary/keep_protein_ids.py"]
+        stage_outputs = [cleaned_base_dataset_path]
+        fingerprint = stage_fingerprint(stage_inputs, {})
+        if stage_is_current(checkpoints, "stage_1", fingerprint, stage_outputs):
+            embed_print("Stage 1 is up to date, skipping header cleaning.")
+        else:
+            start_stage(checkpoint_path, checkpoints, "stage_1")
+            try:
+                run_and_prefix(
+                    [sys.executable, "EMBEDsupplementary/keep_protein_ids.py",
+                     "-i", embedding_section["base_dataset_file"],
+                     "-o", str(cleaned_base_dataset_path)], stage="embed_stage_1_clean_headers")
+                embed_print("Successfully cleaned headers from the base dataset.")
+            except subprocess.CalledProcessError as e:
+                exit_with_error(f"Stage 1 failed: {e}")
+            finish_stage(checkpoint_path, checkpoints, "stage_1", fingerprint, stage_outputs)
+
+    # ---------- STAGE 2: CLEAN BASE HEADERS, EXTRACT AND APPEND HITS (one streaming pass) ----------
+    hit_ids_path = embedding_section.get("hit_ids")
+    if args.base_only:
+        embed_ready_dataset_path = cleaned_base_dataset_path
+    elif args.batch:
+        # hits of every organism into their own file (concurrently, only organisms whose inputs changed), then the
+        # cleaned base and all hits are merged into one dataset, and all hit IDs into one list
+        hits_dir = flow_dir_path / "organism_hits"
+        hits_dir.mkdir(parents=True, exist_ok=True)
+        pending = []
+        for organism in organisms:
+            slug = organism_slug(organism["name"])
+            organism["hits_fasta"] = hits_dir / f"{slug}_hits.fasta"
+            stage = f"stage_2_{slug}"
+            stage_inputs = [organism["hit_ids"], organism["hit_organism_proteome"],
+                            "EMBEDsupplementary/extract_hits_and_append.py"]
+            fingerprint = stage_fingerprint(stage_inputs, {})
+            if stage_is_current(checkpoints, stage, fingerprint, [organism["hits_fasta"]]):
+                embed_print(f"Hits of {organism['name']} are up to date, skipping extraction.")
+            else:
+                start_stage(checkpoint_path, checkpoints, stage)
+                pending.append((organism, stage, fingerprint))
+        if pending:
+            results = run_concurrently([{
+                "cmd": [sys.executable, "EMBEDsupplementary/extract_hits_and_append.py",
+                        "-i", organism["hit_ids"],
+                        "-p", organism["hit_organism_proteome"],
+                        "-o", str(organism["hits_fasta"])],
+                "stage": f"embed_{stage}_extract_hits",
+                "echo": "all",
+                "prefix": f"[EMBED][{organism['name']}]",
+            } for organism, stage, _ in pending])
+            failed = [result for result in results if result["status"] != "ok"]
+            for result in failed:
+                print_failure(result, "[EMBED]")
+            if failed:
+                exit_with_error(f"Stage 2 failed for {len(failed)} of {len(pending)} organisms.")
+            for organism, stage, fingerprint in pending:
+                finish_stage(checkpoint_path, checkpoints, stage, fingerprint, [organism["hits_fasta"]])
+            embed_print(f"Successfully extracted the hit proteins of {len(pending)} organisms.")
+
+        embed_ready_dataset_path = flow_dir_path / "embed_ready_dataset.fasta"
+        hit_ids_path = flow_dir_path / "batch_hit_ids.txt"
+        stage_inputs = [cleaned_base_dataset_path] + [o["hits_fasta"] for o in organisms] + [o["hit_ids"] for o in organisms]
+        stage_outputs = [embed_ready_dataset_path, hit_ids_path]
+        fingerprint = stage_fingerprint(stage_inputs, {})
+        if stage_is_current(checkpoints, "stage_2", fingerprint, stage_outputs):
+            embed_print("Stage 2 is up to date, skipping merging of the organisms.")
+        else:
+            start_stage(checkpoint_path, checkpoints, "stage_2")
+            concatenate_files([cleaned_base_dataset_path] + [o["hits_fasta"] for o in organisms], embed_ready_dataset_path)
+            concatenate_files([o["hit_ids"] for o in organisms], hit_ids_path)
+            embed_print(f"Base dataset and the hits of {len(organisms)} organisms merged into {embed_ready_dataset_path}.")
+            finish_stage(checkpoint_path, checkpoints, "stage_2", fingerprint, stage_outputs)
+    else:
+        embed_ready_dataset_path = flow_dir_path / "embed_ready_dataset.fasta"
+        stage_inputs = [embedding_section["hit_ids"], embedding_section["hit_organism_proteome"],
+                        embedding_section["base_dataset_file"], "EMBEDsupplementary/extract_hits_and_append.py",
+                        "EMBEDsupplementary/keep_protein_ids.py"]
+        stage_outputs = [embed_ready_dataset_path]
+        fingerprint = stage_fingerprint(stage_inputs, {})
+        if stage_is_current(checkpoints, "stage_2", fingerprint, stage_outputs):
+            embed_print("Stage 2 is up to date, skipping hit extraction.")
+        else:
+            start_stage(checkpoint_path, checkpoints, "stage_2")
+            try:
+                run_and_prefix(
+                    [sys.executable, "EMBEDsupplementary/extract_hits_and_append.py",
+                     "-i", embedding_section["hit_ids"],
+                     "-p", embedding_section["hit_organism_proteome"],
+                     "-b", embedding_section["base_dataset_file"],
+                     "-o", str(embed_ready_dataset_path),
+                     "--clean-base"], stage="embed_stage_2_extract_hits"
+                )
+                embed_print("Successfully extracted and appended hit proteins.")
+            except subprocess.CalledProcessError as e:
+                exit_with_error(f"Stage 2 failed: {e}")
+            finish_stage(checkpoint_path, checkpoints, "stage_2", fingerprint, stage_outputs)
 
     # ---------- STAGE 3: BIO_EMBEDDINGS ----------
-    prefix = flow_dir_path / "bio_embeddings_out"
-    bio_embeddings_config = flow_dir_path / "bio_embedding_config.yml"
-    setup_yml_file(str(embed_ready_dataset_path), str(prefix), "prottrans_t5_xl_u50", str(bio_embeddings_config))
+    # only sequences that are not in the persistent embedding cache yet are sent to bio_embeddings
+    cache_dir = Path(embedding_section.get("embedding_cache_dir") or
+                     Path(embedding_section["workflow_file_location"]) / "embedding_cache")
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    embedding_protocol = "prottrans_t5_xl_u50"
+    # the CPU backend shares the cache with bio_embeddings as long as it runs the same ProtT5 model
+    embedding_model = embedding_section.get("embedding_model") or "Rostlab/prot_t5_xl_uniref50"
+    if embedding_backend in ("cpu", "worker") and embedding_model != "Rostlab/prot_t5_xl_uniref50":
+        embedding_protocol = re.sub(r"[^A-Za-z0-9_.-]", "_", embedding_model)
+    embedding_cache = cache_dir / f"{embedding_protocol}.h5"
+    # the base-only run keeps its own files and checkpoint so it never invalidates the full run
+    stage_3 = "stage_3_base" if args.base_only else "stage_3"
+    to_embed_path = flow_dir_path / ("base_sequences_to_embed.fasta" if args.base_only else "sequences_to_embed.fasta")
+    stage_inputs = [embed_ready_dataset_path]
+    stage_outputs = [to_embed_path, embedding_cache]
+    fingerprint = stage_fingerprint(stage_inputs, {"protocol": embedding_protocol, "cache": str(embedding_cache),
+                                                   "backend": embedding_backend})
+    if stage_is_current(checkpoints, stage_3, fingerprint, stage_outputs):
+        embed_print("Stage 3 is up to date, skipping embedding.")
+    else:
+        start_stage(checkpoint_path, checkpoints, stage_3)
+        try:
+            run_and_prefix(
+                [sys.executable, "EMBEDsupplementary/embedding_cache.py", "missing",
+                 "-i", str(embed_ready_dataset_path),
+                 "-c", str(embedding_cache),
+                 "-o", str(to_embed_path)], stage="embed_stage_3_find_missing"
+            )
+        except subprocess.CalledProcessError as e:
+            exit_with_error(f"Stage 3 failed: {e}")
+
+        prefix = flow_dir_path / ("bio_embeddings_base_out" if args.base_only else "bio_embeddings_out")
+        if to_embed_path.stat().st_size > 0 and embedding_backend == "cpu":
+            # vectors go straight into the cache under their sequence hash, no ingest/renaming step
+            try:
+                run_and_prefix(
+                    [str(find_python_executable(embed_env)), "EMBEDsupplementary/cpu_embedder.py",
+                     "-i", str(to_embed_path),
+                     "-o", str(embedding_cache),
+                     "-m", embedding_model,
+                     "--device", embedding_section.get("embedding_device") or "cpu",
+                     "--threads", str(embedding_section.get("cpu_threads", 0)),
+                     "--max-tokens", str(embedding_section.get("max_tokens_per_batch", 4000))],
+                    stage="embed_stage_3_cpu_embedder"
+                )
+                embed_print("Protein Embeddings produced in-process successfully.")
+            except subprocess.CalledProcessError as e:
+                exit_with_error(f"Stage 3 failed: {e}")
+        elif to_embed_path.stat().st_size > 0 and embedding_backend == "worker":
+            # submitted to the resident worker, which is started (and loads the model) only if none is listening
+            worker_section = embedding_section.get("embedding_worker", {})
+            worker_address = worker_section.get("address") or \
+                str(Path(embedding_section["workflow_file_location"]) / "embedding_worker.sock")
+            try:
+                run_and_prefix(
+                    [sys.executable, "EMBEDsupplementary/embedding_worker.py", "submit",
+                     "-a", worker_address,
+                     "-i", str(to_embed_path),
+                     "-o", str(embedding_cache),
+                     "--python", str(find_python_executable(embed_env)),
+                     "-m", embedding_model,
+                     "--device", embedding_section.get("embedding_device") or "cpu",
+                     "--threads", str(embedding_section.get("cpu_threads", 0)),
+                     "--max-tokens", str(embedding_section.get("max_tokens_per_batch", 4000)),
+                     "--idle-minutes", str(worker_section.get("idle_minutes", 60))],
+                    stage="embed_stage_3_embedding_worker"
+                )
+                embed_print("Protein Embeddings produced by the embedding worker successfully.")
+            except subprocess.CalledProcessError as e:
+                exit_with_error(f"Stage 3 failed: {e}")
+        elif to_embed_path.stat().st_size > 0:
+            bio_embeddings_config = flow_dir_path / f"{prefix.name}_config.yml"
+            setup_yml_file(str(to_embed_path), str(prefix), embedding_protocol, str(bio_embeddings_config),
+                           embedding_section.get("embedding_device") or "cuda")
+
+            try:
+                run_and_prefix(
+                    [str(embed_env/"bin"/"bio_embeddings"), str(bio_embeddings_config),
+                     "--overwrite"], rx = r'^\s*\d+%', stage="embed_stage_3_bio_embeddings"
+                )
+                run_and_prefix(
+                    [sys.executable, "EMBEDsupplementary/embedding_cache.py", "ingest",
+                     "-i", str(prefix / "stage_0/reduced_embeddings_file.h5"),
+                     "-c", str(embedding_cache)], stage="embed_stage_3_ingest"
+                )
+                embed_print("Protein Embeddings produced via bio_embeddings successfully.")
+            except subprocess.CalledProcessError as e:
+                exit_with_error(f"Stage 3 failed: {e}")
+        else:
+            embed_print("All sequences found in the embedding cache, skipping bio_embeddings.")
+        finish_stage(checkpoint_path, checkpoints, stage_3, fingerprint, stage_outputs)
 
-    try:
-        run_and_prefix(
-            [str(embed_env/"bin"/"bio_embeddings"), str(bio_embeddings_config),
-             "--overwrite"], rx = r'^\s*\d+%'
-        )
-        embed_print("Protein Embeddings produced via bio_embeddings successfully.")
-    except subprocess.CalledProcessError as e:
-        exit_with_error(f"Stage 3 failed: {e}")
+    if args.base_only:
+        embed_print("Base dataset embedded into the embedding cache.")
+        return
 
-    # ---------- STAGE 4: CORRECT H5 HEADERS ----------
-    reduced_embeddings_path = prefix /"stage_0/reduced_embeddings_file.h5"
+    # ---------- STAGE 4: ASSEMBLE H5 WITH PROTEIN IDS ----------
+    # cached and new vectors are written under their protein IDs (replaces the renaming via h5_correction.py)
     plot_ready_embeddings = flow_dir_path / "reduced_embeddings_with_ids.h5"
-    try:
-        run_and_prefix(
-            [sys.executable, "EMBEDsupplementary/h5_correction.py",
-             "-i", str(reduced_embeddings_path),
-             "-o", str(plot_ready_embeddings)]
-        )
-        embed_print("Final embeddings successfully corrected and saved.")
-    except subprocess.CalledProcessError as e:
-        exit_with_error(f"Stage 4 failed: {e}")
+    stage_inputs = [embed_ready_dataset_path, embedding_cache]
+    stage_outputs = [plot_ready_embeddings]
+    # optional single contiguous matrix + ID index next to the per-protein file ("embedding_matrix_format": npy | h5)
+    matrix_format = embedding_section.get("embedding_matrix_format") or ""
+    embedding_matrix = flow_dir_path / f"reduced_embeddings_matrix.{matrix_format}"
+    if matrix_format:
+        stage_outputs.append(embedding_matrix)
+    fingerprint = stage_fingerprint(stage_inputs, {"matrix_format": matrix_format})
+    if stage_is_current(checkpoints, "stage_4", fingerprint, stage_outputs):
+        embed_print("Stage 4 is up to date, skipping H5 assembly.")
+    else:
+        start_stage(checkpoint_path, checkpoints, "stage_4")
+        try:
+            run_and_prefix(
+                [sys.executable, "EMBEDsupplementary/embedding_cache.py", "assemble",
+                 "-i", str(embed_ready_dataset_path),
+                 "-c", str(embedding_cache),
+                 "-o", str(plot_ready_embeddings)], stage="embed_stage_4_assemble"
+            )
+            embed_print("Final embeddings successfully corrected and saved.")
+            if matrix_format:
+                run_and_prefix(
+                    [sys.executable, "EMBEDsupplementary/embedding_matrix.py",
+                     "-i", str(plot_ready_embeddings),
+                     "-o", str(embedding_matrix),
+                     "-f", matrix_format], stage="embed_stage_4_matrix"
+                )
+        except subprocess.CalledProcessError as e:
+            exit_with_error(f"Stage 4 failed: {e}")
+        finish_stage(checkpoint_path, checkpoints, "stage_4", fingerprint, stage_outputs)
+
+    # ---------- STAGE 4b: NEAREST BASE NEIGHBOURS OF THE HITS (optional, "knn_neighbours": k > 0) ----------
+    knn_neighbours = int(embedding_section.get("knn_neighbours") or 0)
+    if knn_neighbours > 0:
+        hit_neighbours_path = flow_dir_path / "hit_neighbours.tsv"
+        knn_input = embedding_matrix if matrix_format else plot_ready_embeddings
+        stage_inputs = [knn_input, hit_ids_path, embedding_section["base_dataset_file"]]
+        stage_outputs = [hit_neighbours_path]
+        fingerprint = stage_fingerprint(stage_inputs, {"k": knn_neighbours})
+        if stage_is_current(checkpoints, "stage_4_knn", fingerprint, stage_outputs):
+            embed_print("Hit neighbour table is up to date, skipping k-NN search.")
+        else:
+            start_stage(checkpoint_path, checkpoints, "stage_4_knn")
+            try:
+                run_and_prefix(
+                    [sys.executable, "EMBEDsupplementary/embedding_knn.py",
+                     "-e", str(knn_input),
+                     "-i", str(hit_ids_path),
+                     "-b", embedding_section["base_dataset_file"],
+                     "-o", str(hit_neighbours_path),
+                     "-k", str(knn_neighbours),
+                     "--memory-mb", str(embedding_section.get("knn_memory_mb", 1024))], stage="embed_stage_4_knn"
+                )
+                embed_print(f"Top {knn_neighbours} base neighbours of every hit written to {hit_neighbours_path}.")
+            except subprocess.CalledProcessError as e:
+                exit_with_error(f"k-NN search failed: {e}")
+            finish_stage(checkpoint_path, checkpoints, "stage_4_knn", fingerprint, stage_outputs)
 
     #Unneccessary files from bio_embeddings such as config.yml and stage_0 gets deleted  (THIS PART CAN BE REMOVED IN THE FUTURE)
     #Removal is done because we will make use of Uniprot features in Protspace
@@ -216,38 +601,56 @@ def main():
 
     #------------ STAGE 5: PROTSPACE, GENERATION OF VISUALIZATIONS
     protspace_path = flow_dir_path / "protspace_output"
-    protspace_output = protspace_path / f"{organism_name}_{embedding_section['protspace_methods'].replace(',', '_')}"
-
-    if not protspace_path.exists():
-        protspace_path.mkdir(parents=True, exist_ok=True)
-    try:
-        run_and_prefix([
-            str(protspace_env / "bin" / "protspace-local"),
-            "-i", str(plot_ready_embeddings),
-            "-o", str(protspace_output),
-            "-m", embedding_section["protspace_methods"],
-            "-f", embedding_section["protspace_features"],
-            "--bundled", "false"])
-        embed_print("Protspace visualization produced successfully.")
-    except subprocess.CalledProcessError as e:
-        exit_with_error(f"Stage 5 failed: {e}")
-
-    # here we add a custom visualization for better seperation of target organism_name hits from the base dataset proteins
-
-    custom_style = {
-        "feature_colors": {
-            "species": {
-                f"{organism_name}": "rgba(255, 64, 64, 0.9)"
-            }
-        },
-        "marker_shape": {
-            "species": {
-                f"{organism_name}": "x"
-            }
-        }
-    }
-    with open(str(protspace_output / "visualization_state.json"), "w") as f:
-        json.dump(custom_style, f, indent=2)
+    output_label = "batch" if args.batch else organism_name
+    protspace_output = protspace_path / f"{output_label}_{embedding_section['protspace_methods'].replace(',', '_')}"
+    stage_inputs = [plot_ready_embeddings]
+    stage_outputs = [protspace_output]
+    # "protspace_mode": "full" (default) runs protspace-local on the whole set, "projection" fits PCA/UMAP once on the
+    # base embeddings (models shared by all organisms) and only transforms the hits (EMBEDsupplementary/projection_models.py)
+    protspace_mode = embedding_section.get("protspace_mode") or "full"
+    projection_models_dir = Path(embedding_section.get("projection_models_dir") or
+                                 Path(embedding_section["workflow_file_location"]) / "projection_models") / embedding_protocol
+    fingerprint = stage_fingerprint(stage_inputs, {
+        "organism_name": organism_name,
+        "methods": embedding_section["protspace_methods"],
+        "features": embedding_section["protspace_features"],
+        "mode": protspace_mode,
+        "style": visualization_state(organisms),
+    })
+    if stage_is_current(checkpoints, "stage_5", fingerprint, stage_outputs):
+        embed_print("Stage 5 is up to date, skipping protspace.")
+    else:
+        start_stage(checkpoint_path, checkpoints, "stage_5")
+        if not protspace_path.exists():
+            protspace_path.mkdir(parents=True, exist_ok=True)
+        try:
+            if protspace_mode == "projection":
+                run_and_prefix([
+                    str(find_python_executable(protspace_env)), "EMBEDsupplementary/projection_models.py",
+                    "-i", str(plot_ready_embeddings),
+                    "--hit-ids", *[o["hit_ids"] for o in organisms],
+                    "-m", str(projection_models_dir),
+                    "-o", str(protspace_output),
+                    "--methods", embedding_section["protspace_methods"],
+                    "--organism", *[o["name"] for o in organisms],
+                    "-b", embedding_section["base_dataset_file"],
+                    "-f", embedding_section["protspace_features"]], stage="embed_stage_5_projection")
+            else:
+                run_and_prefix([
+                    str(protspace_env / "bin" / "protspace-local"),
+                    "-i", str(plot_ready_embeddings),
+                    "-o", str(protspace_output),
+                    "-m", embedding_section["protspace_methods"],
+                    "-f", embedding_section["protspace_features"],
+                    "--bundled", "false"], stage="embed_stage_5_protspace")
+            embed_print("Protspace visualization produced successfully.")
+        except subprocess.CalledProcessError as e:
+            exit_with_error(f"Stage 5 failed: {e}")
+
+        # here we add a custom visualization for better seperation of the target organisms' hits from the base dataset proteins
+        with open(str(protspace_output / "visualization_state.json"), "w") as f:
+            json.dump(visualization_state(organisms), f, indent=2)
+        finish_stage(checkpoint_path, checkpoints, "stage_5", fingerprint, stage_outputs)
 
     embed_print("Pipeline completed successfully.")
 
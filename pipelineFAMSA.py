@@ -2,20 +2,115 @@ import subprocess
 import sys
 import shutil
 import json
+import hashlib
+import os
+import tempfile
 from pathlib import Path
 
+from EMBEDsupplementary.fasta_io import read_fasta
+from run_metrics import set_run_report
+from process_supervisor import configure, print_failure, run_supervised
+
 # FAMSA2 MSA
+# With "famsa": {"incremental": true} an existing output alignment is updated instead of recomputed: the sequences of
+# input_fasta are matched to the rows of the stored alignment by header + SHA-1 of the ungapped, upper-case sequence.
+#   - nothing changed:      the alignment is left untouched (its mtime too, so the IQ-TREE steps stay valid)
+#   - removed sequences:    their rows are dropped, together with the columns that become all-gap
+#   - new sequences:        aligned among themselves, then profile-aligned against the existing MSA (famsa -profile)
+# A full realignment runs instead when there is no stored alignment yet or more than "realign_fraction" (default 0.2)
+# of the family (all stored and new sequences together) was added or removed.
+# "threads" (default 0: FAMSA's own choice, all cores) is passed to every FAMSA call as -t.
+
+def sequence_hash(sequence: str) -> str:
+    return hashlib.sha1(sequence.replace("-", "").replace(".", "").upper().encode("ascii")).hexdigest()
+
+def run_famsa(cmd: list, stage: str, threads: int = 0):
+    if threads > 0:
+        cmd = cmd[:1] + ["-t", str(threads)] + cmd[1:]
+    result = run_supervised(cmd, stage, echo="all")
+    if result["status"] != "ok":
+        print_failure(result)
+        raise subprocess.CalledProcessError(result["returncode"], cmd)
+
+def alignment_changes(input_fasta: Path, output_fasta: Path):
+    """Returns (new input records, stored headers, stored matrix, mask of the stored rows still in the input)."""
+    # numpy is only needed when the incremental mode is switched on
+    import numpy as np
+    from pipelineCompaction import read_alignment
+
+    records = list(read_fasta(input_fasta))
+    _, headers, matrix = read_alignment(output_fasta)
+    stored = [(header, sequence_hash(row.tobytes().decode("ascii"))) for header, row in zip(headers, matrix)]
+    wanted = [(header, sequence_hash(sequence)) for header, sequence in records]
+    stored_set, wanted_set = set(stored), set(wanted)
+    new_records = [record for record, key in zip(records, wanted) if key not in stored_set]
+    keep = np.array([key in wanted_set for key in stored], dtype=bool)
+    return new_records, headers, matrix, keep
+
+def incremental_update(famsa: Path, input_fasta: Path, output_fasta: Path, realign_fraction: float,
+                       threads: int = 0) -> bool:
+    """Updates output_fasta in place; False if a full realignment is needed instead."""
+    if not output_fasta.exists():
+        print("No stored alignment yet, aligning from scratch.")
+        return False
+    try:
+        new_records, headers, matrix, keep = alignment_changes(input_fasta, output_fasta)
+    except ValueError as e:
+        print(f"Stored alignment cannot be reused ({e}), aligning from scratch.")
+        return False
+
+    removed = int((~keep).sum())
+    # share of the union of stored and new family that is added or removed, at most 100%
+    family_size = max(len(headers) + len(new_records), 1)
+    changed = (len(new_records) + removed) / family_size
+    print(f"{len(new_records)} new and {removed} removed sequences ({changed:.1%} of the family).")
+    if not new_records and not removed:
+        print(f"Alignment {output_fasta} is up to date.")
+        return True
+    if changed > realign_fraction or not keep.any():
+        print(f"More than {realign_fraction:.0%} of the family changed, realigning from scratch.")
+        return False
+
+    import numpy as np
+    from pipelineCompaction import GAP_CHARS, write_alignment
+
+    with tempfile.TemporaryDirectory(dir=output_fasta.parent) as tmp:
+        tmp = Path(tmp)
+        # existing MSA without the removed sequences and the columns only they filled
+        profile = tmp / "profile.fasta"
+        kept = matrix[keep]
+        write_alignment(profile, [h for h, k in zip(headers, keep) if k], kept[:, ~np.isin(kept, GAP_CHARS).all(axis=0)])
+        updated = tmp / "updated.fasta"
+        if new_records:
+            new_fasta = tmp / "new.fasta"
+            with open(new_fasta, "w") as out:
+                for header, sequence in new_records:
+                    out.write(f">{header}\n{sequence.replace('-', '').replace('.', '')}\n")
+            new_profile = new_fasta
+            if len(new_records) > 1:
+                new_profile = tmp / "new_aligned.fasta"
+                run_famsa([str(famsa), str(new_fasta), str(new_profile)], "famsa_new_sequences", threads)
+            run_famsa([str(famsa), "-profile", str(profile), str(new_profile), str(updated)], "famsa_profile", threads)
+        else:
+            updated = profile
+        # replaced only once complete, a failed update leaves the stored alignment as it was
+        os.replace(updated, output_fasta)
+    print(f"Alignment {output_fasta} updated incrementally.")
+    return True
 
 def famsa(config_path="config.json"):
 
     # Load JSON configuration
     with open(config_path, "r") as f:
         config = json.load(f)
+    set_run_report(config.get("run_report"))
+    configure(config.get("stage_log_dir"), config.get("stage_timeouts"))
 
     # Extract paths from JSON
     famsa = config["famsa"]["exe"]
     input_fasta = config["famsa"]["input_fasta"]
     output_fasta = config["famsa"]["output_fasta"]
+    threads = int(config["famsa"].get("threads", 0))   # 0: FAMSA's default (all cores)
 
       # Ensure paths are properly formatted for subprocess
     famsa = Path(famsa)
@@ -29,9 +124,14 @@ def famsa(config_path="config.json"):
         print("Can be installed with the following command: conda install -c bioconda famsa")
         sys.exit(1)
 
-    # Perform a basic MSA using famsa
+    # Perform a basic MSA using famsa (or add the new sequences to the stored one, see above)
     try:
-        subprocess.run([str(famsa), str(input_fasta), str(output_fasta)]) 
+        realign_fraction = float(config["famsa"].get("realign_fraction", 0.2))
+        if config["famsa"].get("incremental") and \
+                incremental_update(famsa, input_fasta, output_fasta, realign_fraction, threads):
+            print("Done!")
+            return
+        run_famsa([str(famsa), str(input_fasta), str(output_fasta)], "famsa", threads)
         print("Done!")
 
     except subprocess.CalledProcessError:
@@ -39,4 +139,5 @@ def famsa(config_path="config.json"):
         sys.exit(1)
 
 if __name__ == "__main__":
-    famsa()
+    # optional first argument: path to the config file (default: config.json)
+    famsa(sys.argv[1] if len(sys.argv) > 1 else "config.json")
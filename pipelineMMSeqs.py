@@ -4,23 +4,179 @@ import shutil
 import json
 from pathlib import Path
 import os
+import hashlib
+import heapq
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from run_metrics import run_measured, set_run_report
+from EMBEDsupplementary.fasta_io import read_fasta_bytes, write_record
 
 #This pipeline implementation calls mmseqs2 easy-search via WSL on Windows. It uses the default parameters
 #It catches missing wsl installation and missing input files. 
 # As of now it does not check for mmseqs2 installation inside WSL.
 #The input and output paths are defined in the config.json file. So is the format of the output tsv file.
 #sudo apt install mmseqs2 inside WSL to install mmseqs2 if not already installed.
+#Target DBs and their indexes are cached in "db_cache_dir" (default: mmseqs_db_cache), one folder per hash of the
+#target file content and the search parameters. Searching another query family against the same target reuses them.
+#A cache folder is built under a private name and renamed into place once its index exists, so searches running at
+#the same time never build into (or read) a half-built folder; if two build the same one, the first rename wins.
+#Sharded mode ("query_shards" > 1): the query FASTA is split into residue-balanced shards that are searched in parallel
+#("parallel_shards" at a time) within a core budget ("threads") and memory budget ("memory_limit_gb"), the target
+#is split by mmseqs itself through --split-memory-limit. Shard TSVs are merged into one result with a single header.
 
-# Converting a windows path to WSL path 
+# Converting a windows path to WSL path (paths without a drive letter, i.e. POSIX paths, are already valid)
 def windows_to_wsl(path: Path) -> str:
+    if not path.drive:
+        return path.as_posix()
     drive, tail = path.drive[:-1].lower(), path.as_posix()[2:]
     wsl_path = f"/mnt/{drive}/{tail}"
     return wsl_path
 
+# sha256 of a file; the result is remembered per path/size/mtime so multi-GB genomes are hashed only once
+def file_sha256(path: Path, cache_dir: Path) -> str:
+    fingerprints_file = cache_dir / "fingerprints.json"
+    fingerprints = {}
+    if fingerprints_file.exists():
+        with open(fingerprints_file, "r") as f:
+            fingerprints = json.load(f)
+
+    stat = path.stat()
+    known = fingerprints.get(str(path))
+    if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+        return known["sha256"]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    fingerprints[str(path)] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+    # per-process temporary file, a concurrent search never sees a partly written fingerprints.json
+    tmp_path = fingerprints_file.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(fingerprints, f, indent=2)
+    os.replace(tmp_path, fingerprints_file)
+    return digest.hexdigest()
+
+# Folder holding targetDB + index for this target file and these parameters
+def target_db_dir(target: Path, params: list, cache_dir: Path) -> Path:
+    key = hashlib.sha256((file_sha256(target, cache_dir) + " " + " ".join(params)).encode("utf-8")).hexdigest()
+    return cache_dir / key[:16]
+
+# Builds targetDB + index in a private folder next to db_dir and renames it to db_dir once complete
+def build_target_db(exe_cmd: str, target: Path, search_params: list, db_dir: Path):
+    building = Path(tempfile.mkdtemp(prefix=f"{db_dir.name}.building-", dir=db_dir.parent))
+    try:
+        t_db = os.path.join(windows_to_wsl(building), "targetDB")
+        cmds = [
+    ["wsl", exe_cmd, "createdb", windows_to_wsl(target), t_db],                       # nucleotides (genome)
+    # index is kept in the cache folder and reused by every later search against this target
+    ["wsl", exe_cmd, "createindex", t_db, windows_to_wsl(building / "tmp")] + search_params,   # index target genome
+]
+        for c in cmds:
+            print("Running:", " ".join(c))
+            returncode = run_measured(c, f"mmseqs_{c[2]}")
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, c)
+        shutil.rmtree(building / "tmp", ignore_errors=True)
+        (building / "complete").touch()   # mark the cached target DB as usable only after the index exists
+
+        if db_dir.exists() and not (db_dir / "complete").exists():
+            shutil.rmtree(db_dir)   # left behind by an interrupted build that wrote into the cache folder directly
+        try:
+            os.replace(building, db_dir)
+        except OSError:
+            if not (db_dir / "complete").exists():
+                raise
+            print(f"Another search cached this target DB meanwhile, using it: {db_dir}")
+    finally:
+        shutil.rmtree(building, ignore_errors=True)
+
+# Splits a FASTA into n shards with roughly equal residue counts (each record goes to the currently smallest shard)
+def split_fasta(fasta: Path, n_shards: int, out_dir: Path) -> list:
+    shard_paths = [out_dir / f"query_shard_{i}.fasta" for i in range(n_shards)]
+    outs = [open(p, "wb") for p in shard_paths]
+    heap = [(0, i) for i in range(n_shards)]
+
+    try:
+        # plain or gzip/bgzip query, every record goes to the shard with the fewest residues so far
+        for header, sequence in read_fasta_bytes(fasta):
+            size, i = heapq.heappop(heap)
+            write_record(outs[i], header, sequence)
+            heapq.heappush(heap, (size + len(sequence), i))
+    finally:
+        for out in outs:
+            out.close()
+    # shards can stay empty when there are fewer records than shards
+    return [p for p in shard_paths if p.stat().st_size > 0]
+
+# Runs createdb/search/convertalis for one query shard in its own tmp folder, returns the shard TSV
+def search_shard(exe_cmd: str, shard: Path, t_db: str, fmt: str, search_params: list, threads: int,
+                 memory_limit_gb: float, shard_tmp: Path) -> Path:
+    shard_tmp.mkdir(parents=True, exist_ok=True)
+    tmp = windows_to_wsl(shard_tmp)
+    q_db = os.path.join(tmp, "queryDB")
+    res_db = os.path.join(tmp, "searchRes")
+    shard_result = shard_tmp.parent / (shard.stem + ".tsv")
+    limits = ["--threads", str(threads)]
+    if memory_limit_gb:
+        limits += ["--split-memory-limit", f"{max(1, int(memory_limit_gb * 1024))}M"]
+
+    cmds = [
+    ["wsl", exe_cmd, "createdb", windows_to_wsl(shard), q_db],
+    ["wsl", exe_cmd, "search", q_db, t_db, res_db, tmp] + search_params + ["-a"] + limits,
+    ["wsl", exe_cmd, "convertalis", q_db, t_db, res_db, windows_to_wsl(shard_result),
+     "--format-output", fmt, "--format-mode", "4", "--threads", str(threads)]
+]
+    for c in cmds:
+        print(f"[{shard.stem}] Running:", " ".join(c))
+        returncode = run_measured(c, f"mmseqs_{c[2]}_{shard.stem}", stdout=subprocess.DEVNULL)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, c)
+    shutil.rmtree(shard_tmp, ignore_errors=True)   # bounded temp space: a shard's tmp is freed as soon as it is done
+    return shard_result
+
+# Concatenates shard TSVs (in shard order) keeping only the first header row
+def merge_shard_results(shard_results: list, result: Path):
+    header_written = False
+    with open(result, "w") as out:
+        for shard_result in shard_results:
+            with open(shard_result, "r") as f:
+                header = f.readline()
+                if header and not header_written:
+                    out.write(header)
+                    header_written = True
+                shutil.copyfileobj(f, out)
+            shard_result.unlink()
+
+def sharded_search(exe_cmd: str, query: Path, t_db: str, result: Path, fmt: str, search_params: list,
+                   tmp_dir: Path, mm: dict):
+    cores = int(mm.get("threads", os.cpu_count() or 1))
+    n_shards = int(mm.get("query_shards", 1))
+    shard_dir = tmp_dir / "shards"
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    shards = split_fasta(query, n_shards, shard_dir)
+    parallel = max(1, min(int(mm.get("parallel_shards", cores)), len(shards), cores))
+    threads_per_shard = max(1, cores // parallel)
+    memory_per_shard = float(mm.get("memory_limit_gb", 0)) / parallel
+    print(f"Searching {len(shards)} query shards, {parallel} in parallel with {threads_per_shard} threads each.")
+
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        futures = [
+            pool.submit(search_shard, exe_cmd, shard, t_db, fmt, search_params, threads_per_shard,
+                        memory_per_shard, shard_dir / f"{shard.stem}_tmp")
+            for shard in shards
+        ]
+        shard_results = [f.result() for f in futures]
+
+    merge_shard_results(shard_results, result)
+    for shard in shards:
+        shard.unlink()
+
 def mmseqs_search(config_path="config.json"):
     #Reading json config
     with open(config_path, "r") as f:
         cfg = json.load(f)
+    set_run_report(cfg.get("run_report"))
 
     #Check if WSL is installed
     if shutil.which("wsl") is None:
@@ -35,8 +191,10 @@ def mmseqs_search(config_path="config.json"):
     result = Path(mm["result"]).resolve()
     fmt = mm.get("format", "query,target,evalue,pident,alnlen")
     tmp_dir = Path(mm.get("tmp_dir", "tmp")).resolve()
+    db_cache_dir = Path(mm.get("db_cache_dir", "mmseqs_db_cache")).resolve()
     result.parent.mkdir(parents=True, exist_ok=True)
     tmp_dir.mkdir(parents=True, exist_ok=True)
+    db_cache_dir.mkdir(parents=True, exist_ok=True)
 
     # use_wsl = exe.startswith("wsl:")
     exe_cmd = exe.replace("wsl:", "")
@@ -47,23 +205,31 @@ def mmseqs_search(config_path="config.json"):
         print(f"Target not found: {target}"); sys.exit(1)
 
     q = windows_to_wsl(query); 
-    t = windows_to_wsl(target)
     r = windows_to_wsl(result); 
     tmp = windows_to_wsl(tmp_dir)
 
+    # parameters that change the target DB / index, part of the cache key
+    search_params = ["--search-type", "3"]   # force protein->nucleotide (TBLASTN mode)
+    db_dir = target_db_dir(target, [exe_cmd] + search_params, db_cache_dir)
+    db_complete = db_dir / "complete"
+
     q_db = os.path.join(tmp, "queryDB")
-    t_db = os.path.join(tmp, "targetDB")
+    t_db = os.path.join(windows_to_wsl(db_dir), "targetDB")
     res_db = os.path.join(tmp, "searchRes")
 
-    cmds = [
+    sharded = int(mm.get("query_shards", 1)) > 1
+
+    cmds = []
+    if not sharded:
+        cmds += [
     ["wsl", exe_cmd, "createdb", q, q_db],                    # amino acids (proteins)
-    ["wsl", exe_cmd, "createdb", t, t_db],                    # nucleotides (genome)
-    # optional but speeds up repeated runs:
-    ["wsl", exe_cmd, "createindex", t_db, tmp],               # index target genome
+]
+    if not sharded:
+        cmds += [
     # 2) Search: protein (query) vs nucleotide (target)  == TBLASTN
-    ["wsl", exe_cmd, "search", q_db, t_db, res_db, tmp,
-     "--search-type", "3",    # force protein->nucleotide (TBLASTN mode)
-     "-a"],                   # keep alignment info for convertalis/custom fields
+    ["wsl", exe_cmd, "search", q_db, t_db, res_db, tmp]
+     + search_params +
+     ["-a"],                  # keep alignment info for convertalis/custom fields
     # 3) Convert to TSV with your chosen columns
     ["wsl", exe_cmd, "convertalis", q_db, t_db, res_db, r,
      "--format-output", fmt,
@@ -72,12 +238,21 @@ def mmseqs_search(config_path="config.json"):
     
 
     try:
+        if db_complete.exists():
+            print(f"Reusing cached target DB and index: {db_dir}")
+        else:
+            build_target_db(exe_cmd, target, search_params, db_dir)
         for c in cmds:
             print("Running:", " ".join(c))
-            subprocess.run(c, check=True)
+            returncode = run_measured(c, f"mmseqs_{c[2]}")
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, c)
+        if sharded:
+            sharded_search(exe_cmd, query, t_db, result, fmt, search_params, tmp_dir, mm)
     except subprocess.CalledProcessError:
         print("MMseqs2 easy-search failed.")
         sys.exit(1)
 
 if __name__ == "__main__":
-    mmseqs_search()
\ No newline at end of file
+    # optional first argument: path to the config file (default: config.json)
+    mmseqs_search(sys.argv[1] if len(sys.argv) > 1 else "config.json")
\ No newline at end of file
@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from pipelineBatch import CoreBudget
+
+# Runs the whole workflow as a dependency graph instead of one script after the other.
+# Stages (each one is the existing script, started as a subprocess with the same config file):
+#   mmseqs      pipelineMMSeqs.py                               -
+#   filter      mmseqs_filter.py -> embedding.hit_ids           after mmseqs
+#   embed_base  pipelineEMBEDDER.py --base-only                 -            (base dataset into the embedding cache)
+#   embed       pipelineEMBEDDER.py -o <organism_name>          after filter, embed_base
+#   famsa       pipelineFAMSA.py                                -
+#   tree        pipelineTreePart.py                             after famsa
+# Independent branches run at the same time; a stage starts once its dependencies finished and the cores it reserves
+# ("stage_cores") are free within the global budget ("cores", default: all cores). Dependencies on stages that are
+# not selected count as satisfied (their outputs are expected to exist). If a stage fails, everything downstream of it
+# is skipped while unrelated branches keep running. Every stage logs to <log_dir>/<stage>.log.
+# The reserved cores are handed to the tools: mmseqs, famsa and tree run with a copy of the config
+# (<log_dir>/<stage>_config.json) in which mmseqs.threads, famsa.threads and the IQ-TREE threads (a fixed count is
+# capped, AUTO gets ntmax) are set to the stage's cores. The embedding stages keep embedding.cpu_threads as configured,
+# so both use the same resident worker settings.
+# Stages run from the repository folder (like run.sh), so relative paths in config.json are relative to it.
+# Settings live in the "orchestrator" section of config.json.
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+DEPENDENCIES = {
+    "mmseqs": [],
+    "filter": ["mmseqs"],
+    "embed_base": [],
+    "embed": ["filter", "embed_base"],
+    "famsa": [],
+    "tree": ["famsa"],
+}
+
+def default_stage_cores(cores: int) -> dict:
+    # heavy CPU stages share the budget, the rest are light or GPU bound
+    return {
+        "mmseqs": max(1, cores // 2),
+        "filter": 1,
+        "embed_base": 1,
+        "embed": 1,
+        "famsa": max(1, cores // 4),
+        "tree": max(1, cores // 2),
+    }
+
+def stage_config(config: dict, name: str, cores: int) -> dict:
+    """Copy of the config with the thread settings of the stage's tool set to its cores, None if it has none."""
+    staged = json.loads(json.dumps(config))
+    if name == "mmseqs":
+        staged.setdefault("mmseqs", {})["threads"] = cores
+    elif name == "famsa":
+        staged.setdefault("famsa", {})["threads"] = cores
+    elif name == "tree":
+        iqtree = staged.setdefault("iqtree", {})
+        threads = str(iqtree.get("threads", "AUTO"))
+        if threads.upper() == "AUTO":
+            iqtree["ntmax"] = cores
+        else:
+            iqtree["threads"] = str(min(int(threads), cores))
+    else:
+        return None
+    return staged
+
+def stage_config_paths(config_path: Path, config: dict, stages: list, stage_cores: dict, cores: int,
+                       log_dir: Path) -> dict:
+    paths = {}
+    for name in DEPENDENCIES:
+        # a stage never gets more than the global budget, see CoreBudget.acquire
+        staged = stage_config(config, name, min(stage_cores[name], cores)) if name in stages else None
+        if staged is None:
+            paths[name] = config_path
+            continue
+        paths[name] = log_dir / f"{name}_config.json"
+        with open(paths[name], "w") as f:
+            json.dump(staged, f, indent=2)
+    return paths
+
+def stage_commands(config_paths: dict, config: dict, settings: dict) -> dict:
+    python = sys.executable
+    organism_name = settings.get("organism_name", "")
+    return {
+        "mmseqs": [python, "pipelineMMSeqs.py", str(config_paths["mmseqs"])],
+        "filter": [python, "mmseqs_filter.py", "-c", str(config_paths["filter"]),
+                   "--hit-ids", config.get("embedding", {}).get("hit_ids", "hit_ids.txt")]
+                  + [str(a) for a in settings.get("filter_args", [])],
+        "embed_base": [python, "pipelineEMBEDDER.py", "-c", str(config_paths["embed_base"]), "--base-only"],
+        "embed": [python, "pipelineEMBEDDER.py", "-c", str(config_paths["embed"]), "-o", organism_name],
+        "famsa": [python, "pipelineFAMSA.py", str(config_paths["famsa"])],
+        "tree": [python, "pipelineTreePart.py", str(config_paths["tree"])],
+    }
+
+def topological_order(dependencies: dict) -> list:
+    order = []
+    state = {}
+
+    def visit(name):
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise ValueError(f"Dependency cycle at stage '{name}'.")
+        state[name] = "visiting"
+        for dep in dependencies[name]:
+            visit(dep)
+        state[name] = "done"
+        order.append(name)
+
+    for name in dependencies:
+        visit(name)
+    return order
+
+def run_stage(name: str, cmd: list, cores: int, dep_futures: list, budget: CoreBudget, log_dir: Path) -> dict:
+    # wait for the upstream stages, do not start if any of them did not succeed
+    if any(f.result()["status"] != "ok" for f in dep_futures):
+        print(f"[DAG] {name}: skipped (upstream stage failed)")
+        return {"stage": name, "status": "skipped", "seconds": None}
+
+    cores = budget.acquire(cores)
+    print(f"[DAG] {name}: started ({cores} cores)")
+    start = time.perf_counter()
+    try:
+        with open(log_dir / f"{name}.log", "w") as log:
+            result = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT, cwd=SCRIPT_DIR)
+    finally:
+        budget.release(cores)
+    seconds = round(time.perf_counter() - start, 2)
+
+    status = "ok" if result.returncode == 0 else f"failed (exit code {result.returncode})"
+    print(f"[DAG] {name}: {status} after {seconds}s")
+    return {"stage": name, "status": status, "seconds": seconds}
+
+def run_graph(stages: list, commands: dict, stage_cores: dict, cores: int, log_dir: Path) -> list:
+    dependencies = {name: [d for d in DEPENDENCIES[name] if d in stages] for name in stages}
+    order = topological_order(dependencies)
+    budget = CoreBudget(cores)
+    futures = {}
+
+    # one worker per stage, the dependencies and the core budget decide what actually runs concurrently
+    with ThreadPoolExecutor(max_workers=len(order) or 1) as pool:
+        for name in order:
+            futures[name] = pool.submit(run_stage, name, commands[name], stage_cores[name],
+                                        [futures[d] for d in dependencies[name]], budget, log_dir)
+        return [futures[name].result() for name in order]
+
+def orchestrate(config_path="config.json", stages=None, cores=None):
+    config_path = Path(config_path).resolve()
+    with open(config_path, "r") as f:
+        config = json.load(f)
+    settings = config.get("orchestrator", {})
+
+    stages = stages or settings.get("stages") or list(DEPENDENCIES)
+    unknown = [s for s in stages if s not in DEPENDENCIES]
+    if unknown:
+        print(f"Unknown stage(s): {', '.join(unknown)}. Known: {', '.join(DEPENDENCIES)}"); sys.exit(1)
+    if "embed" in stages and not settings.get("organism_name"):
+        print("orchestrator.organism_name is required for the 'embed' stage."); sys.exit(1)
+
+    cores = cores or int(settings.get("cores") or os.cpu_count() or 1)
+    stage_cores = default_stage_cores(cores)
+    stage_cores.update({k: int(v) for k, v in settings.get("stage_cores", {}).items()})
+    log_dir = Path(settings.get("log_dir") or "orchestrator_logs").resolve()
+    log_dir.mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    config_paths = stage_config_paths(config_path, config, stages, stage_cores, cores, log_dir)
+    results = run_graph(stages, stage_commands(config_paths, config, settings), stage_cores, cores, log_dir)
+    print(f"[DAG] Finished in {time.perf_counter() - start:.2f}s, logs in {log_dir}")
+    for r in results:
+        print(f"[DAG]   {r['stage']:<11} {r['status']:<30} {'' if r['seconds'] is None else r['seconds']}")
+    if any(r["status"] != "ok" for r in results):
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the pipeline stages as a dependency graph.")
+    parser.add_argument("-c", "--config", default="config.json", help="Path to the JSON configuration file.")
+    parser.add_argument("-s", "--stages", help=f"Comma separated subset of: {','.join(DEPENDENCIES)}")
+    parser.add_argument("--cores", type=int, help="Global core budget (default: orchestrator.cores or all cores).")
+    args = parser.parse_args()
+
+    orchestrate(args.config, args.stages.split(",") if args.stages else None, args.cores)
+
+if __name__ == "__main__":
+    main()
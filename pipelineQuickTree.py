@@ -0,0 +1,157 @@
+import json
+import re
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from pipelineCompaction import GAP_CHARS, read_alignment
+
+# Quick-look neighbour-joining tree, built in-process with NumPy, for triage before the ML run with IQ-TREE.
+# 1) Pairwise distances over the FAMSA alignment, vectorized: for every residue state one indicator matrix
+#    (sequences x columns) is multiplied with its transpose, summed up this gives the identical sites of all pairs at
+#    once; the sites where both sequences have a residue come from the same product over the non-gap mask.
+#      p-distance: p = 1 - identical / compared      Poisson: d = -ln(1 - p)  (capped where p approaches 1)
+#    Gaps ('-', '.', '?') and unknown residues ('X' in proteins, 'N' in nucleotides) are not compared.
+# 2) Neighbour-joining (Saitou & Nei) on that matrix, the distance matrix is shrunk in place after every join.
+# The unrooted tree is written as Newick to <alignment>.nj.treefile, next to IQ-TREE's <alignment>.treefile.
+# pipelineTreePart.py runs it when "iqtree": {"mode": "nj"} is set ("distance": "poisson" (default) or "p").
+
+NUCLEOTIDES = set(b"ACGTUN")
+MAX_POISSON_P = 1 - 1e-6
+NEWICK_SPECIAL = re.compile(r"[\s(),:;\[\]']")
+
+
+def distance_matrix(matrix: np.ndarray, method: str = "poisson") -> np.ndarray:
+    lower = (matrix >= ord("a")) & (matrix <= ord("z"))
+    matrix = np.where(lower, matrix - 32, matrix).astype(np.uint8)
+    missing = np.isin(matrix, np.concatenate([GAP_CHARS, np.frombuffer(b"?", dtype=np.uint8)]))
+    states = set(np.unique(matrix[~missing]).tolist())
+    unknown = b"N" if states <= NUCLEOTIDES else b"X"
+    missing |= matrix == unknown[0]
+    states.discard(unknown[0])
+
+    present = (~missing).astype(np.float32)
+    compared = present @ present.T
+    identical = np.zeros_like(compared)
+    for state in states:
+        indicator = (matrix == state).astype(np.float32)
+        identical += indicator @ indicator.T
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = np.clip(1.0 - identical.astype(np.float64) / compared, 0.0, 1.0)
+    if method == "poisson":
+        with np.errstate(divide="ignore"):
+            distances = -np.log(1.0 - np.minimum(p, MAX_POISSON_P))
+    elif method == "p":
+        distances = p
+    else:
+        raise ValueError(f"Unknown distance '{method}' (expected 'poisson' or 'p').")
+
+    # pairs without a single comparable site get the largest distance observed
+    undefined = ~np.isfinite(distances)
+    if undefined.any():
+        finite = distances[~undefined]
+        distances[undefined] = finite.max() if finite.size else 1.0
+    np.fill_diagonal(distances, 0.0)
+    return distances
+
+
+def newick_label(name: str) -> str:
+    return NEWICK_SPECIAL.sub("_", name) or "unnamed"
+
+
+def neighbor_joining(distances: np.ndarray, names: list) -> str:
+    """Returns the unrooted NJ tree as Newick; negative branch lengths are set to 0."""
+    n = len(names)
+    nodes = [newick_label(name) for name in names]
+    if n == 1:
+        return f"({nodes[0]});"
+    if n == 2:
+        return f"({nodes[0]}:{distances[0, 1] / 2:.6f},{nodes[1]}:{distances[0, 1] / 2:.6f});"
+
+    # float32 working copy: every join makes a few passes over the remaining matrix, which is memory bound
+    d = distances.astype(np.float32, copy=True)
+    row_sums = distances.sum(axis=1)
+    q_buffer = np.empty_like(d)
+    m = n
+    while m > 3:
+        active = d[:m, :m]
+        # Q = (m - 2) * d - r_i - r_j, computed into a reused buffer
+        q = np.multiply(active, m - 2, out=q_buffer[:m, :m])
+        sums = row_sums[:m].astype(np.float32)
+        q -= sums[:, None]
+        q -= sums[None, :]
+        np.fill_diagonal(q, np.inf)
+        i, j = divmod(int(np.argmin(q)), m)
+        i, j = min(i, j), max(i, j)
+
+        dij = float(active[i, j])
+        limb_i = max(0.0, 0.5 * dij + (row_sums[i] - row_sums[j]) / (2 * (m - 2)))
+        limb_j = max(0.0, dij - limb_i)
+        joined = f"({nodes[i]}:{limb_i:.6f},{nodes[j]}:{limb_j:.6f})"
+        new_row = 0.5 * (active[i] + active[j] - dij)
+        new_row[i] = 0.0
+
+        # row sums change by the new column minus the two joined ones
+        row_sums[:m] += new_row - active[:, i] - active[:, j]
+        row_sums[i] = new_row.sum(dtype=np.float64)
+
+        # new node takes row/column i, the last row/column moves into j
+        d[i, :m] = new_row
+        d[:m, i] = new_row
+        nodes[i] = joined
+        last = m - 1
+        if j != last:
+            d[j, :m] = d[last, :m]
+            d[:m, j] = d[:m, last]
+            d[j, j] = 0.0
+            nodes[j] = nodes[last]
+            row_sums[j] = row_sums[last]
+        m -= 1
+
+    # three nodes left: one central node
+    a, b, c = d[0, 1], d[0, 2], d[1, 2]
+    limbs = [max(0.0, (a + b - c) / 2), max(0.0, (a + c - b) / 2), max(0.0, (b + c - a) / 2)]
+    return "(" + ",".join(f"{node}:{limb:.6f}" for node, limb in zip(nodes[:3], limbs)) + ");"
+
+
+def quick_tree_path(alignment_fasta: Path) -> Path:
+    return Path(str(alignment_fasta) + ".nj.treefile")
+
+
+def quick_tree(alignment_fasta: Path, output_treefile: Path = None, method: str = "poisson") -> Path:
+    output_treefile = output_treefile or quick_tree_path(alignment_fasta)
+    start = time.perf_counter()
+    names, _, matrix = read_alignment(alignment_fasta)
+    if not names:
+        raise ValueError(f"{alignment_fasta} contains no sequences.")
+    distances = distance_matrix(matrix, method)
+    print(f"{method} distances of {len(names)} sequences x {matrix.shape[1]} columns "
+          f"in {time.perf_counter() - start:.2f}s")
+
+    newick = neighbor_joining(distances, names)
+    with open(output_treefile, "w") as f:
+        f.write(newick + "\n")
+    print(f"Neighbour-joining tree written to {output_treefile} ({time.perf_counter() - start:.2f}s in total)")
+    return output_treefile
+
+
+def main(config_path="config.json"):
+    # Load JSON configuration
+    with open(config_path, "r") as f:
+        config = json.load(f)
+
+    alignment_fasta = Path(config["famsa"]["output_fasta"])
+    if not alignment_fasta.exists():
+        print(f"Alignment not found: {alignment_fasta}"); sys.exit(1)
+    try:
+        quick_tree(alignment_fasta, method=config.get("iqtree", {}).get("distance", "poisson"))
+    except ValueError as e:
+        print(f"Quick-look tree failed: {e}"); sys.exit(1)
+
+
+if __name__ == "__main__":
+    # optional first argument: path to the config file (default: config.json)
+    main(sys.argv[1] if len(sys.argv) > 1 else "config.json")
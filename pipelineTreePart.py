@@ -1,37 +1,112 @@
 import subprocess
 import json
+import os
 import re
 import sys
 from pathlib import Path
+from run_metrics import set_run_report
+from process_supervisor import configure, print_failure, run_supervised
+
+# IQ-TREE on the FAMSA alignment.
+# Default ("mode": "single"): one invocation does ModelFinder, tree search and 1000 UFBoot replicates (-m MFP -B 1000),
+# so no likelihood work is repeated. "mode": "two_pass" keeps the old behaviour (model selection, then a bootstrap run).
+# "mode": "nj" skips IQ-TREE and writes a quick-look neighbour-joining tree (<alignment>.nj.treefile, see
+# pipelineQuickTree.py) for triage within minutes.
+# "threads" (default "AUTO") is passed to -T; with AUTO, IQ-TREE benchmarks and picks the thread count itself,
+# capped at the number of cores of the machine (-ntmax). Output goes to the stage log (process_supervisor.py), only
+# progress lines (IQTREE_PROGRESS) are printed.
+# With "compaction": {"enabled": true} the tree is built on the compacted alignment (see pipelineCompaction.py) and
+# the collapsed identical sequences are re-attached in <compacted alignment>.expanded.treefile.
+
+IQTREE_PROGRESS = r"Best-fit model:|^Iteration \d+ /|^BEST SCORE FOUND|^Total wall-clock time|ERROR"
+
+def run_iqtree(cmd, stage="iqtree"):
+    """Runs IQ-TREE, prints its progress lines and returns the best-fit model if ModelFinder reported one."""
+    best_model = None
+    model_pattern = re.compile(r"Best-fit model:\s+(\S+)")
+
+    def handle_line(line):
+        nonlocal best_model
+        match = model_pattern.search(line)
+        if match:
+            best_model = match.group(1)
+
+    result = run_supervised(cmd, stage, echo=IQTREE_PROGRESS, prefix="[IQTREE] ", line_callback=handle_line)
+    if result["status"] != "ok":
+        print_failure(result, "[IQTREE] ")
+        print(f"IQ-TREE failed with exit code {result['returncode']}.")
+        sys.exit(1)
+    return best_model
+
+def expand_compacted_tree(compact_fasta: Path, suffix: str = ".treefile"):
+    from pipelineCompaction import expand_tree
+    treefile = Path(str(compact_fasta) + suffix)
+    expand_tree(treefile, Path(str(compact_fasta) + ".duplicates.json"),
+                Path(str(compact_fasta) + suffix.replace(".treefile", ".expanded.treefile")))
 
 def iqTree(config_path="config.json"):
     # Load JSON configuration
     with open(config_path, "r") as f:
         config = json.load(f)
+    set_run_report(config.get("run_report"))
+    configure(config.get("stage_log_dir"), config.get("stage_timeouts"))
 
     # Extract paths from JSON
     iqtree_exe = config["iqtree"]["exe"]
     alignment_fasta = config["famsa"]["output_fasta"]
+    mode = config["iqtree"].get("mode", "single")
+    threads = str(config["iqtree"].get("threads", "AUTO"))
 
     # Ensure paths are properly formatted for subprocess
     iqtree_exe = Path(iqtree_exe)
     alignment_fasta = Path(alignment_fasta)
+    settings = config.get("compaction", {})
+    compacted = settings.get("enabled", False)
+    if compacted:
+        # numpy is only needed when compaction is switched on
+        from pipelineCompaction import compact_alignment, compacted_path
+        compact_fasta = compacted_path(alignment_fasta, settings)
+        print("Compacting alignment...")
+        compact_alignment(alignment_fasta, compact_fasta, float(settings.get("max_gap_fraction", 0.9)))
+        alignment_fasta = compact_fasta
+
+    if mode == "nj":
+        # quick-look neighbour-joining tree in-process, no IQ-TREE run
+        from pipelineQuickTree import quick_tree
+        print("Building quick-look neighbour-joining tree...")
+        try:
+            quick_tree(alignment_fasta, method=config["iqtree"].get("distance", "poisson"))
+        except ValueError as e:
+            print(f"Quick-look tree failed: {e}"); sys.exit(1)
+        if compacted:
+            expand_compacted_tree(alignment_fasta, ".nj.treefile")
+        return
+
+    thread_args = ["-T", threads]
+    if threads.upper() == "AUTO":
+        # "ntmax" caps the AUTO search (the orchestrator sets it to the stage's reserved cores)
+        thread_args += ["-ntmax", str(config["iqtree"].get("ntmax") or os.cpu_count() or 1)]
+
+    if mode == "single":
+        # Model selection, tree search and UFBoot in one run
+        print("Running IQ-TREE (model selection + bootstrap)...")
+        best_model = run_iqtree(
+            [str(iqtree_exe), "-s", str(alignment_fasta), "-m", "MFP", "-B", "1000", "-redo"] + thread_args
+        )
+        if best_model:
+            print(f"Best-fit model: {best_model}")
+        print("IQ-TREE analysis completed.")
+        if compacted:
+            expand_compacted_tree(alignment_fasta)
+        return
 
     # Step 1: Run IQ-TREE to find the best-fit model
     print("Running model selection...")
-    result = subprocess.run(
-        [str(iqtree_exe), "-s", str(alignment_fasta), "-redo"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True
-    )
-
-    stdout_str = result.stdout
+    best_model = run_iqtree([str(iqtree_exe), "-s", str(alignment_fasta), "-m", "MF", "-redo"] + thread_args,
+                            "iqtree_model_selection")
 
     # Extract best-fit model
-    match = re.search(r"Best-fit model:\s+(\S+)", stdout_str)
-    if match:
-        best_model = match.group(1)
+    if best_model:
         print(f"Best-fit model: {best_model}")
     else:
         print("No model found.")
@@ -39,14 +114,13 @@ def iqTree(config_path="config.json"):
 
     # Step 2: Run IQ-TREE with bootstrap analysis
     print("Running final IQ-TREE analysis...")
-    subprocess.run(
-        [str(iqtree_exe), "-s", str(alignment_fasta), "-m", best_model, "-bb", "1000", "-redo"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True
-    )
+    run_iqtree([str(iqtree_exe), "-s", str(alignment_fasta), "-m", best_model, "-bb", "1000", "-redo"] + thread_args,
+               "iqtree_bootstrap")
 
     print("IQ-TREE analysis completed.")
+    if compacted:
+        expand_compacted_tree(alignment_fasta)
 
 if __name__ == "__main__":
-    iqTree()
+    # optional first argument: path to the config file (default: config.json)
+    iqTree(sys.argv[1] if len(sys.argv) > 1 else "config.json")
@@ -0,0 +1,215 @@
+import asyncio
+import os
+import re
+import signal
+import subprocess
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from run_metrics import record_metrics, wait_with_rusage
+
+# asyncio supervisor for the external tools (bio_embeddings, protspace, IQ-TREE, FAMSA, ...).
+# run_process() starts one tool and, without blocking the event loop, reads its combined stdout/stderr in 64 KiB chunks:
+#   - the raw output is queued to a writer task that writes it to <log_dir>/<stage>.log in a worker thread,
+#   - only the last `ring_lines` lines are kept in memory (ring buffer, returned as "tail" and shown on failure),
+#   - lines are only decoded and printed when they match the `echo` regex (searched once per chunk, not per line),
+#     or all of them with echo="all". Progress bars that redraw with '\r' count as lines.
+# A stage can get a timeout; on timeout or cancellation the tool's whole process group is terminated (SIGTERM, SIGKILL
+# after a grace period). run_all() runs several tools at once and, with fail_fast, cancels the siblings as soon as one
+# fails. Every run is recorded in the run report (see run_metrics.py), the wait with rusage happens in a thread.
+# Every run has its own three threads (wait4, stdout reads, log writes) instead of asyncio's shared default executor:
+# a blocking wait4 per child would otherwise exhaust that pool once enough children run at once, leaving no thread to
+# read their pipes, and the children would block on full pipes forever.
+# configure() sets the log folder and per-stage timeouts (keys "stage_log_dir" and "stage_timeouts" of config.json).
+# The synchronous wrappers run_supervised() / run_concurrently() are for the scripts that are not async themselves.
+
+CHUNK_SIZE = 1 << 16
+RING_LINES = 200
+KILL_GRACE_SECONDS = 10
+
+_log_dir = None
+_timeouts = {}
+
+
+def configure(log_dir=None, timeouts=None):
+    """Sets the folder for the full stage logs (None: no log files) and the per-stage timeouts in seconds."""
+    global _log_dir, _timeouts
+    _log_dir = Path(log_dir) if log_dir else None
+    _timeouts = {stage: float(seconds) for stage, seconds in (timeouts or {}).items() if seconds}
+
+
+def terminate_group(process: subprocess.Popen):
+    if process.poll() is not None:
+        return
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, signal.SIGTERM)
+        else:
+            process.terminate()
+    except (ProcessLookupError, PermissionError):
+        return
+
+    def kill():
+        if process.returncode is not None:
+            return
+        try:
+            if os.name == "posix":
+                os.killpg(process.pid, signal.SIGKILL)
+            elif process.poll() is None:
+                process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+    asyncio.get_running_loop().call_later(KILL_GRACE_SECONDS, kill)
+
+
+async def _write_log(log_path: Path, queue: asyncio.Queue, executor: ThreadPoolExecutor):
+    loop = asyncio.get_running_loop()
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(log_path, "wb") as log:
+        while True:
+            data = await queue.get()
+            if data is None:
+                return
+            await loop.run_in_executor(executor, log.write, data)
+
+
+async def _pump_output(process: subprocess.Popen, tail: deque, log_queue, pattern, echo_all: bool, prefix: str,
+                       line_callback, executor: ThreadPoolExecutor):
+    loop = asyncio.get_running_loop()
+    pending = b""
+
+    def emit(line: bytes):
+        text = line.decode("utf-8", errors="replace").rstrip()
+        if text:
+            print(f"{prefix}{text}", flush=True)
+            if line_callback is not None:
+                line_callback(text)
+
+    while True:
+        chunk = await loop.run_in_executor(executor, process.stdout.read1, CHUNK_SIZE)
+        if log_queue is not None and chunk:
+            log_queue.put_nowait(chunk)
+        data = pending + chunk if chunk else pending + b"\n"
+        cut = max(data.rfind(b"\n"), data.rfind(b"\r")) + 1
+        complete, pending = data[:cut].replace(b"\r", b"\n"), data[cut:]
+        if complete:
+            lines = complete.split(b"\n")[:-1]
+            tail.extend(line for line in lines if line)
+            if echo_all:
+                for line in lines:
+                    emit(line)
+            elif pattern is not None:
+                last_start = -1
+                for match in pattern.finditer(complete):
+                    start = complete.rfind(b"\n", 0, match.start()) + 1
+                    if start != last_start:
+                        last_start = start
+                        emit(complete[start:complete.find(b"\n", match.start())])
+        if not chunk:
+            return
+
+
+async def run_process(cmd, stage: str, echo=None, prefix: str = "", line_callback=None, timeout=None,
+                      log_path=None, ring_lines: int = RING_LINES, **popen_kwargs) -> dict:
+    """Runs cmd under supervision. echo: None, "all" or a regex of the lines to print (line_callback gets them too).
+    Returns {"stage", "status" (ok | failed | timeout), "returncode", "seconds", "tail", "log"}.
+    Raises asyncio.CancelledError after terminating the tool if the task is cancelled."""
+    loop = asyncio.get_running_loop()
+    timeout = timeout if timeout is not None else _timeouts.get(stage)
+    if log_path is None and _log_dir is not None:
+        log_path = _log_dir / f"{stage}.log"
+    pattern = re.compile(echo.encode("utf-8"), re.MULTILINE) if echo and echo != "all" else None
+
+    started = datetime.now(timezone.utc)
+    start = time.perf_counter()
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               start_new_session=(os.name == "posix"), **popen_kwargs)
+    tail = deque(maxlen=ring_lines)
+    # one thread each for wait4, the pipe reads and the log writes of this child
+    executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix=f"supervise-{stage}")
+    log_queue = asyncio.Queue() if log_path is not None else None
+    writer = asyncio.ensure_future(_write_log(Path(log_path), log_queue, executor)) if log_path is not None else None
+    pump = asyncio.ensure_future(_pump_output(process, tail, log_queue, pattern, echo == "all", prefix, line_callback,
+                                              executor))
+    waiter = loop.run_in_executor(executor, wait_with_rusage, process)
+
+    async def finish():
+        await asyncio.shield(pump)
+        return await asyncio.shield(waiter)
+
+    status = None
+    cancelled = False
+    try:
+        rusage = await asyncio.wait_for(finish(), timeout)
+    except asyncio.TimeoutError:
+        status = "timeout"
+        print(f"{prefix}{stage} exceeded its timeout of {timeout}s, terminating.", flush=True)
+        terminate_group(process)
+    except asyncio.CancelledError:
+        cancelled = True
+        terminate_group(process)
+    if status is not None or cancelled:
+        # the tool is going down, collect the rest of its output and its exit status
+        rusage = await waiter
+        await pump
+    if writer is not None:
+        log_queue.put_nowait(None)
+        await writer
+    process.stdout.close()
+    executor.shutdown(wait=False)
+
+    seconds = time.perf_counter() - start
+    record_metrics(stage, cmd, started, seconds, process.returncode, rusage)
+    if cancelled:
+        raise asyncio.CancelledError()
+    if status is None:
+        status = "ok" if process.returncode == 0 else "failed"
+    return {"stage": stage, "status": status, "returncode": process.returncode, "seconds": round(seconds, 2),
+            "tail": list(line.decode("utf-8", errors="replace") for line in tail),
+            "log": str(log_path) if log_path is not None else None}
+
+
+async def run_all(specs: list, fail_fast: bool = True) -> list:
+    """Runs several tools at once; specs are dicts of run_process arguments. With fail_fast the remaining tools are
+    cancelled (and terminated) as soon as one does not succeed. Results are in the order of specs."""
+    tasks = [asyncio.ensure_future(run_process(**spec)) for spec in specs]
+    pending = set(tasks)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        if fail_fast and any(not t.cancelled() and (t.exception() or t.result()["status"] != "ok") for t in done):
+            for t in pending:
+                t.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            break
+
+    results = []
+    for spec, task in zip(specs, tasks):
+        if task.cancelled():
+            results.append({"stage": spec["stage"], "status": "cancelled", "returncode": None, "seconds": None,
+                            "tail": [], "log": None})
+        elif task.exception() is not None:
+            raise task.exception()
+        else:
+            results.append(task.result())
+    return results
+
+
+def run_supervised(cmd, stage: str, **kwargs) -> dict:
+    """Synchronous run_process() for scripts that are not async."""
+    return asyncio.run(run_process(cmd, stage, **kwargs))
+
+
+def run_concurrently(specs: list, fail_fast: bool = True) -> list:
+    return asyncio.run(run_all(specs, fail_fast))
+
+
+def print_failure(result: dict, prefix: str = ""):
+    """Prints the ring buffer of a failed stage (the full output is in its log file)."""
+    print(f"{prefix}{result['stage']} {result['status']} (exit code {result['returncode']}), last output lines:")
+    for line in result["tail"][-20:]:
+        print(f"{prefix}  {line}")
+    if result["log"]:
+        print(f"{prefix}Full log: {result['log']}")
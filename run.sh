@@ -6,5 +6,8 @@ python3 pipelineFAMSA.py
 # run tree part
  python3 pipelineTreePart.py
 
+# many families at once (FAMSA + IQ-TREE per family, see batch section in config.json)
+# python3 pipelineBatch.py data/families/*.fasta
+
 
 
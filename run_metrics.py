@@ -0,0 +1,82 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Structured per-stage metrics for every external tool the pipeline starts.
+# run_measured() starts the process, optionally hands each output line to a callback, waits with os.wait4 and appends
+# one JSON line per stage to the run report set with set_run_report() (key "run_report" in config.json):
+#   stage, command, start time, return code, wall time, user/system CPU time and peak RSS of the child,
+#   bytes read/written by the child (block I/O from rusage, i.e. what actually hit the storage layer, page cache hits
+#   are not counted).
+# On platforms without os.wait4 (Windows) only the wall time and return code are recorded.
+
+_report_path = None
+_report_lock = threading.Lock()
+
+# ru_maxrss is KiB on Linux, bytes on macOS; ru_inblock/ru_oublock count 512 byte blocks
+_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+_BLOCK_SIZE = 512
+
+def set_run_report(path):
+    """Sets the JSONL file the metrics are appended to (None disables the report)."""
+    global _report_path
+    _report_path = Path(path) if path else None
+    if _report_path is not None:
+        _report_path.parent.mkdir(parents=True, exist_ok=True)
+
+def wait_with_rusage(process: subprocess.Popen):
+    """Waits for the process and returns its rusage (None where wait4 is not available)."""
+    if not hasattr(os, "wait4"):
+        process.wait()
+        return None
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return rusage
+
+def record_metrics(stage: str, cmd, started: datetime, wall_seconds: float, returncode: int, rusage=None):
+    if _report_path is None:
+        return
+    record = {
+        "stage": stage,
+        "command": [str(c) for c in cmd],
+        "started": started.isoformat(),
+        "returncode": returncode,
+        "wall_seconds": round(wall_seconds, 3),
+        "cpu_user_seconds": None,
+        "cpu_system_seconds": None,
+        "peak_rss_mb": None,
+        "read_bytes": None,
+        "written_bytes": None,
+    }
+    if rusage is not None:
+        record.update({
+            "cpu_user_seconds": round(rusage.ru_utime, 3),
+            "cpu_system_seconds": round(rusage.ru_stime, 3),
+            "peak_rss_mb": round(rusage.ru_maxrss * _RSS_UNIT / (1024 * 1024), 1),
+            "read_bytes": rusage.ru_inblock * _BLOCK_SIZE,
+            "written_bytes": rusage.ru_oublock * _BLOCK_SIZE,
+        })
+    with _report_lock:
+        with open(_report_path, "a") as report:
+            report.write(json.dumps(record) + "\n")
+
+def run_measured(cmd, stage: str, line_callback=None, **popen_kwargs) -> int:
+    """Runs cmd, passes every output line (stdout+stderr) to line_callback if given and records its metrics.
+    Returns the exit code."""
+    if line_callback is not None:
+        popen_kwargs.update(stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+
+    started = datetime.now(timezone.utc)
+    start = time.perf_counter()
+    process = subprocess.Popen(cmd, **popen_kwargs)
+    if line_callback is not None:
+        for line in process.stdout:
+            line_callback(line)
+    rusage = wait_with_rusage(process)
+    record_metrics(stage, cmd, started, time.perf_counter() - start, process.returncode, rusage)
+    return process.returncode